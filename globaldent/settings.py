@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -77,10 +78,73 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Las transacciones toman el bloqueo de escritura al empezar: dos
+            # reservas simultáneas se validan una después de la otra
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
 
+# Odontograma
+# rows (por defecto): 32 filas Tooth por paciente, creadas al registrarlo.
+# packed: los 32 estados en ClinicalHistory.odontogram y filas Tooth solo
+# para los dientes con procedimientos. Cambiar con `migrate_odontogram`.
+
+ODONTOGRAM_STORAGE = os.environ.get('GLOBALDENT_ODONTOGRAM', 'rows')
+
+
+# Agenda
+# Horario de atención (hora de inicio, hora de fin) y duración de cada franja
+# de la agenda semanal en minutos (15, 30 o 60; ?slot= la cambia por vista).
+
+AGENDA_HOURS = (8, 18)
+AGENDA_SLOT_MINUTES = 30
+
+
+# Recordatorios de citas
+# Backend de envío (ver management/reminders.py): console (por defecto), file
+# (un archivo por ejecución en EMAIL_FILE_PATH), smtp (EMAIL_HOST:EMAIL_PORT;
+# en pruebas, `python -m aiosmtpd -n -l localhost:1025`) o la ruta de un
+# backend de correo de Django. --backend lo cambia por ejecución.
+
+REMINDER_BACKEND = os.environ.get('GLOBALDENT_REMINDERS', 'console')
+REMINDER_HOURS = 24
+DEFAULT_FROM_EMAIL = os.environ.get('GLOBALDENT_EMAIL_FROM', 'GlobalDent <no-reply@globaldent.local>')
+EMAIL_HOST = os.environ.get('GLOBALDENT_EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('GLOBALDENT_EMAIL_PORT', '1025'))
+EMAIL_FILE_PATH = os.environ.get('GLOBALDENT_EMAIL_DIR', BASE_DIR / 'sent_reminders')
+
+
+# Cache
+# Fragmentos del dashboard y listados (ver management/fragments.py).
+# GLOBALDENT_CACHE=file (por defecto) o locmem; GLOBALDENT_CACHE_DIR para la ruta en disco.
+# Las versiones de los fragmentos deben verse desde todos los procesos (workers,
+# comandos de manage.py): con locmem cada proceso tiene su propia caché y los
+# fragmentos no se cachean (ver fragments.is_shared).
+
+CACHE_BACKEND = os.environ.get('GLOBALDENT_CACHE', 'file')
+
+if CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('GLOBALDENT_CACHE_DIR', BASE_DIR / 'cache'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'globaldent',
+        }
+    }
+
+# Segundos que se conserva un fragmento aunque no cambien los datos
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
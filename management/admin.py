@@ -1,14 +1,18 @@
+from django import forms
 from django.contrib import admin
 from django.utils.html import format_html
 from .models import (
     Patient, ClinicalHistory, Tooth, Consultation, 
-    Procedure, ToothProcedure, Payment, Appointment
+    Procedure, ToothProcedure, Payment, Appointment, AppointmentSeries,
+    AppointmentReminder
 )
+from . import odontogram, procedure_effects, scheduling
 
 # 1. Registro simple de modelos de catálogo
 @admin.register(Procedure)
 class ProcedureAdmin(admin.ModelAdmin):
-    list_display = ('name', 'base_price_formatted')
+    list_display = ('name', 'base_price_formatted', 'resulting_status', 'effect_scope')
+    list_filter = ('resulting_status', 'effect_scope')
     search_fields = ('name',)
     list_per_page = 20
 
@@ -27,6 +31,25 @@ class PaymentAdmin(admin.ModelAdmin):
     def amount_formatted(self, obj):
         return f"${obj.amount:,.2f}"
 
+    def save_model(self, request, obj, form, change):
+        """Actualiza lo pagado y el saldo de la(s) consulta(s) afectada(s)."""
+        super().save_model(request, obj, form, change)
+        obj.consultation.update_payment_totals()
+        previous_id = form.initial.get('consultation')
+        if change and previous_id and previous_id != obj.consultation_id:
+            Consultation.objects.get(pk=previous_id).update_payment_totals()
+
+    def delete_model(self, request, obj):
+        consultation = obj.consultation
+        super().delete_model(request, obj)
+        consultation.update_payment_totals()
+
+    def delete_queryset(self, request, queryset):
+        consultation_ids = set(queryset.values_list('consultation_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for consultation in Consultation.objects.filter(pk__in=consultation_ids):
+            consultation.update_payment_totals()
+
 # 2. Inlines para modelos relacionados
 class ToothInline(admin.TabularInline):
     """Muestra los 32 dientes dentro de la Historia Clínica."""
@@ -97,7 +120,7 @@ class PatientAdmin(admin.ModelAdmin):
                       'id_number', 'gender', 'date_of_birth')
         }),
         ('Información de Contacto', {
-            'fields': ('phone_number', 'address')
+            'fields': ('phone_number', 'email', 'address')
         }),
     )
 
@@ -123,34 +146,51 @@ class PaymentInline(admin.TabularInline):
     fields = ('amount', 'method', 'payment_date')
     readonly_fields = ('payment_date',)
 
+class ToothProcedureInlineForm(forms.ModelForm):
+    """
+    El diente se elige por número ADA, como en ToothProcedureForm: con el
+    odontograma empaquetado la fila Tooth se crea en save_formset solo para
+    el diente referenciado.
+    """
+    tooth_number = forms.TypedChoiceField(coerce=int, label='Diente')
+    # Historia del paciente de la consulta (ver ToothProcedureInline.get_formset)
+    history = None
+
+    class Meta:
+        model = ToothProcedure
+        fields = ['tooth_number', 'procedure', 'price_charged', 'notes']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Estados leídos de la cadena empaquetada o de las filas, sin escribir
+        teeth = odontogram.teeth_for(self.history) if self.history else odontogram.unpack(None)
+        self.fields['tooth_number'].choices = [('', '---------')] + [
+            (tooth.number_ada, f"Diente {tooth.number_ada} ({tooth.get_status_display()})")
+            for tooth in teeth
+        ]
+        if self.instance.tooth_id:
+            self.initial['tooth_number'] = self.instance.tooth.number_ada
+
+
 class ToothProcedureInline(admin.TabularInline):
     """Muestra los procedimientos aplicados en esta consulta."""
     model = ToothProcedure
+    form = ToothProcedureInlineForm
     extra = 1
-    fields = ('tooth', 'procedure', 'price_charged', 'notes')
+    fields = ('tooth_number', 'procedure', 'price_charged', 'notes')
     readonly_fields = ('created_at',)
-    
-    def formfield_for_foreignkey(self, db_field, request, **kwargs):
-        """Filtra los dientes para mostrar solo los del paciente de la consulta actual."""
-        if db_field.name == "tooth":
-            # Obtenemos el ID de la consulta desde la URL
-            consultation_id = request.resolver_match.kwargs.get('object_id')
-            if consultation_id:
-                try:
-                    consultation = Consultation.objects.get(pk=consultation_id)
-                    # Filtramos solo los dientes del paciente de esta consulta
-                    kwargs["queryset"] = Tooth.objects.filter(
-                        history__patient=consultation.patient
-                    ).order_by('number_ada')
-                except Consultation.DoesNotExist:
-                    pass
-        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_formset(self, request, obj=None, **kwargs):
+        """Los dientes que se ofrecen son los del paciente de la consulta actual."""
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.form.history = getattr(obj.patient, 'history', None) if obj else None
+        return formset
 
 @admin.register(Consultation)
 class ConsultationAdmin(admin.ModelAdmin):
     """Panel para la gestión de Consultas."""
     list_display = ('patient', 'date', 'total_cost_formatted', 'get_balance_display', 'user')
-    readonly_fields = ('date', 'total_cost', 'get_balance_display')
+    readonly_fields = ('date', 'total_cost', 'amount_paid', 'get_balance_display')
     inlines = [ToothProcedureInline, PaymentInline]
     date_hierarchy = 'date'
     list_filter = ('user', 'date')
@@ -164,7 +204,7 @@ class ConsultationAdmin(admin.ModelAdmin):
             'fields': ('reason', 'notes')
         }),
         ('Información Financiera', {
-            'fields': ('total_cost', 'get_balance_display'),
+            'fields': ('total_cost', 'amount_paid', 'get_balance_display'),
             'classes': ('collapse',)
         }),
     )
@@ -178,21 +218,29 @@ class ConsultationAdmin(admin.ModelAdmin):
         balance = obj.get_balance()
         if balance > 0:
             return format_html(
-                '<span style="color: red; font-weight: bold;">${:,.2f} PENDIENTE</span>',
-                balance
+                '<span style="color: red; font-weight: bold;">${} PENDIENTE</span>',
+                f"{balance:,.2f}"
             )
         elif balance < 0:
             return format_html(
-                '<span style="color: green; font-weight: bold;">${:,.2f} A FAVOR</span>',
-                abs(balance)
+                '<span style="color: green; font-weight: bold;">${} A FAVOR</span>',
+                f"{abs(balance):,.2f}"
             )
         return format_html('<span style="color: blue;">✓ Saldada</span>')
 
     def save_formset(self, request, form, formset, change):
         """
         Se ejecuta DESPUÉS de guardar los inlines (ToothProcedure y Payment).
-        Aquí recalculamos el total_cost.
+        Aquí recalculamos el total_cost y el saldo.
         """
+        if formset.model == ToothProcedure:
+            # Solo se crea la fila Tooth del diente elegido (odontograma empaquetado)
+            history = form.instance.patient.history
+            for inline_form in formset.forms:
+                number = getattr(inline_form, 'cleaned_data', {}).get('tooth_number')
+                if number and inline_form.has_changed() and inline_form not in formset.deleted_forms:
+                    inline_form.instance.tooth = odontogram.get_tooth(history, number)
+
         instances = formset.save(commit=True)
         
         # Si el formset es de ToothProcedure, recalculamos el costo total
@@ -200,6 +248,18 @@ class ConsultationAdmin(admin.ModelAdmin):
             consultation = form.instance
             consultation.total_cost = consultation.calculate_total_cost()
             consultation.save(update_fields=['total_cost'])
+            
+            # Mismo efecto sobre el odontograma que al agregar el procedimiento desde la consulta
+            applied = formset.new_objects + [
+                obj for obj, fields in formset.changed_objects
+                if {'tooth_number', 'procedure'} & set(fields)
+            ]
+            for tooth_procedure in applied:
+                procedure_effects.apply(tooth_procedure, consultation_id=consultation.pk)
+        
+        # Si el formset es de Payment, recalculamos lo pagado y el saldo
+        elif formset.model == Payment:
+            form.instance.update_payment_totals()
         
         return instances
 
@@ -210,14 +270,44 @@ class ConsultationAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+class AppointmentAdminForm(forms.ModelForm):
+    """Rechaza citas que se solapan con otra del mismo odontólogo."""
+    # Quien agenda: save_model lo asigna si no se elige odontólogo (ver get_form)
+    default_user = None
+
+    class Meta:
+        model = Appointment
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_time = cleaned_data.get('start_time')
+        end_time = cleaned_data.get('end_time')
+        if start_time and end_time:
+            if end_time <= start_time:
+                raise forms.ValidationError('La hora de fin debe ser posterior a la hora de inicio.')
+            # changeform_view ya corre en una transacción: el bloqueo dura hasta guardar
+            user = cleaned_data.get('user') or self.default_user
+            scheduling.check_overlap(
+                user.pk if user else None,
+                cleaned_data.get('date'),
+                start_time,
+                end_time,
+                exclude_pk=self.instance.pk,
+                status=cleaned_data.get('status'),
+            )
+        return cleaned_data
+
+
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
     """Panel para la gestión de Citas."""
+    form = AppointmentAdminForm
     list_display = ('patient', 'date', 'start_time', 'end_time', 'status_badge', 'user')
     list_filter = ('status', 'date', 'user')
     search_fields = ('patient__first_name', 'patient__paternal_surname', 'reason')
     date_hierarchy = 'date'
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('series', 'occurrence_date', 'created_at', 'updated_at')
     
     fieldsets = (
         ('Información de la Cita', {
@@ -230,6 +320,10 @@ class AppointmentAdmin(admin.ModelAdmin):
             'fields': ('consultation',),
             'classes': ('collapse',)
         }),
+        ('Serie', {
+            'fields': ('series', 'occurrence_date'),
+            'classes': ('collapse',)
+        }),
         ('Metadatos', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
@@ -250,8 +344,85 @@ class AppointmentAdmin(admin.ModelAdmin):
             obj.get_status_display()
         )
     
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        form.default_user = request.user
+        return form
+
     def save_model(self, request, obj, form, change):
         """Guarda el usuario que agendó la cita si no está asignado."""
         if not obj.user:
             obj.user = request.user
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+
+class AppointmentSeriesAdminForm(forms.ModelForm):
+    """Rechaza series cuyas citas chocan con la agenda del odontólogo."""
+    default_user = None
+
+    class Meta:
+        model = AppointmentSeries
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_time = cleaned_data.get('start_time')
+        end_time = cleaned_data.get('end_time')
+        if start_time and end_time and end_time <= start_time:
+            raise forms.ValidationError('La hora de fin debe ser posterior a la hora de inicio.')
+        if not self.errors and cleaned_data.get('start_date'):
+            user = cleaned_data.get('user') or self.default_user
+            series = AppointmentSeries(
+                pk=self.instance.pk,
+                user_id=user.pk if user else None,
+                excluded_dates=cleaned_data.get('excluded_dates') or [],
+                **{name: cleaned_data.get(name) for name in (
+                    'start_date', 'start_time', 'end_time', 'frequency', 'interval', 'count', 'until',
+                )},
+            )
+            scheduling.check_series_overlap(series)
+        return cleaned_data
+
+
+@admin.register(AppointmentSeries)
+class AppointmentSeriesAdmin(admin.ModelAdmin):
+    """Panel para las series de citas periódicas."""
+    form = AppointmentSeriesAdminForm
+    list_display = ('patient', 'user', 'start_date', 'start_time', 'rule_display', 'last_date')
+    list_filter = ('frequency', 'user')
+    search_fields = ('patient__first_name', 'patient__paternal_surname', 'reason')
+    readonly_fields = ('last_date', 'created_at', 'updated_at')
+
+    @admin.display(description='Regla')
+    def rule_display(self, obj):
+        return obj.rule_display()
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        form.default_user = request.user
+        return form
+
+    def save_model(self, request, obj, form, change):
+        """Asigna el odontólogo que creó la serie si no está asignado."""
+        if not obj.user:
+            obj.user = request.user
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(AppointmentReminder)
+class AppointmentReminderAdmin(admin.ModelAdmin):
+    """Registro de recordatorios enviados (solo lectura; lo escribe send_appointment_reminders)."""
+    list_display = ('patient', 'date', 'start_time', 'recipient', 'backend', 'sent_at')
+    list_filter = ('backend', 'date')
+    search_fields = ('patient__first_name', 'patient__paternal_surname', 'recipient', 'key')
+    date_hierarchy = 'date'
+    readonly_fields = (
+        'key', 'patient', 'appointment', 'series', 'date', 'start_time',
+        'recipient', 'backend', 'run', 'claimed_at', 'sent_at',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,218 @@
+"""
+Cuadrícula de la agenda semanal.
+
+Las citas de la semana se leen con una sola consulta y se reparten en una
+pasada en una matriz franja × día: cada cita se anota en la celda donde
+empieza y se marca como "en curso" en las franjas siguientes que ocupa. La
+plantilla recorre la matriz sin comparar horas, así que el trabajo es
+proporcional a las celdas más las citas.
+
+El feed JSON de la agenda (varios odontólogos, por día, semana o mes) lleva
+un ETag calculado con consultas agregadas sobre el rango (última
+modificación y número de citas, de sus pacientes y de las series de citas
+activas): si nada cambió, la vista responde 304 sin leer ni serializar las
+citas. No lleva Last-Modified: un borrado no mueve la última modificación y
+una petición con solo If-Modified-Since recibiría un 304 incorrecto.
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from datetime import date, time, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from . import recurrence
+from .models import Appointment
+
+SLOT_CHOICES = (15, 30, 60)
+FEED_VIEWS = ('day', 'week', 'month')
+MAX_FEED_DAYS = 92
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _time(minutes):
+    minutes = min(minutes, 24 * 60 - 1)
+    return time(minutes // 60, minutes % 60)
+
+
+def slot_minutes(value=None):
+    """Duración de franja válida a partir de ?slot= o de settings.AGENDA_SLOT_MINUTES."""
+    default = getattr(settings, 'AGENDA_SLOT_MINUTES', 30)
+    try:
+        value = int(value) if value else default
+    except ValueError:
+        return default
+    return value if value in SLOT_CHOICES else default
+
+
+@dataclass
+class Cell:
+    date: date
+    time: time
+    # Citas que empiezan en esta franja
+    starts: list = field(default_factory=list)
+    # Citas que empezaron antes y siguen en curso
+    continues: list = field(default_factory=list)
+
+
+@dataclass
+class Row:
+    time: time
+    cells: list
+
+    @property
+    def label(self):
+        return self.time.strftime('%H:%M')
+
+
+def build_grid(appointments, start_of_week, days=7, slot=30, hours=None):
+    """
+    Filas de la agenda ([Row], una por franja) para las citas dadas. El rango
+    de horas se amplía si alguna cita empieza antes o termina después del
+    horario de atención. A cada cita se le asigna `slot_span` (franjas que ocupa).
+    """
+    first_hour, last_hour = hours or getattr(settings, 'AGENDA_HOURS', (8, 18))
+    appointments = list(appointments)
+    start = first_hour * 60
+    end = last_hour * 60
+    for appointment in appointments:
+        start = min(start, _minutes(appointment.start_time) // slot * slot)
+        end = max(end, _minutes(appointment.end_time))
+    slot_count = max(1, -(-(end - start) // slot))
+
+    dates = [start_of_week + timedelta(days=i) for i in range(days)]
+    rows = [
+        Row(_time(start + index * slot), [Cell(day, _time(start + index * slot)) for day in dates])
+        for index in range(slot_count)
+    ]
+
+    for appointment in appointments:
+        column = (appointment.date - start_of_week).days
+        if not 0 <= column < days:
+            continue
+        first = (_minutes(appointment.start_time) - start) // slot
+        last = max(first, -(-(_minutes(appointment.end_time) - start) // slot) - 1)
+        last = min(last, slot_count - 1)
+        appointment.slot_span = last - first + 1
+        rows[first].cells[column].starts.append(appointment)
+        for index in range(first + 1, last + 1):
+            rows[index].cells[column].continues.append(appointment)
+    return rows
+
+
+def week_appointments(user, start_of_week, days=7):
+    """
+    Citas de la semana del odontólogo (una consulta) más las ocurrencias de
+    sus series que caen en la semana, ordenadas por inicio.
+    """
+    end = start_of_week + timedelta(days=days - 1)
+    appointments = list(Appointment.objects.filter(
+        user=user,
+        date__gte=start_of_week,
+        date__lte=end,
+    ).select_related('patient').only(
+        'date', 'start_time', 'end_time', 'reason', 'status', 'series', 'occurrence_date',
+        'patient__first_name', 'patient__paternal_surname', 'patient__maternal_surname',
+    ).order_by('date', 'start_time', 'pk'))
+    occurrences = recurrence.expand(start_of_week, end, dentist_ids=[user.pk])
+    if occurrences:
+        appointments = sorted(appointments + occurrences, key=lambda a: (a.date, a.start_time))
+    return appointments
+
+
+def feed_range(view='week', anchor=None, start=None, end=None):
+    """
+    Fechas (inicio, fin inclusive) del feed: el día, la semana (lunes a
+    domingo) o el mes que contiene `anchor`, o el rango explícito start-end.
+    """
+    if start is not None or end is not None:
+        start = start or end
+        end = end or start
+    elif view == 'day':
+        start = end = anchor
+    elif view == 'week':
+        start = anchor - timedelta(days=anchor.weekday())
+        end = start + timedelta(days=6)
+    elif view == 'month':
+        start = anchor.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    else:
+        raise ValueError(f"Vista no válida: '{view}'. Use {', '.join(FEED_VIEWS)}.")
+    if end < start:
+        raise ValueError('La fecha final debe ser posterior a la inicial.')
+    if (end - start).days >= MAX_FEED_DAYS:
+        raise ValueError(f'El rango no puede superar {MAX_FEED_DAYS} días.')
+    return start, end
+
+
+def feed_appointments(dentist_ids, start, end):
+    """Citas del rango (incluidas las canceladas) de los odontólogos indicados."""
+    return Appointment.objects.filter(user_id__in=dentist_ids, date__gte=start, date__lte=end)
+
+
+def feed_version(queryset, series, *key):
+    """
+    ETag del rango. El número de citas y de series cubre los borrados, que no
+    dejan updated_at; `key` distingue rangos y odontólogos.
+    """
+    state = queryset.aggregate(
+        changed=Max('updated_at'),
+        patient_changed=Max('patient__updated_at'),
+        count=Count('pk'),
+    )
+    # Las ocurrencias sin guardar también muestran el nombre del paciente de la serie
+    series_state = series.aggregate(
+        changed=Max('updated_at'),
+        patient_changed=Max('patient__updated_at'),
+        count=Count('pk'),
+    )
+    last_modified = max(
+        filter(None, (
+            state['changed'], state['patient_changed'],
+            series_state['changed'], series_state['patient_changed'],
+        )),
+        default=None,
+    )
+    digest = hashlib.sha1(
+        repr((key, last_modified, state['count'], series_state['count'])).encode()
+    ).hexdigest()
+    return digest
+
+
+def feed_payload(queryset, series, dentists, start, end):
+    """
+    Contenido del feed: rango, odontólogos [(id, usuario)] y sus citas,
+    incluidas las ocurrencias de series sin guardar (id null), ordenadas.
+    """
+    appointments = list(queryset.select_related('patient').only(
+        'user', 'date', 'start_time', 'end_time', 'reason', 'status', 'series', 'occurrence_date',
+        'patient__first_name', 'patient__paternal_surname', 'patient__maternal_surname',
+    ))
+    appointments += recurrence.expand(start, end, series=list(series.select_related('patient')))
+    appointments.sort(key=lambda a: (a.date, a.start_time, a.user_id or 0, a.pk or 0))
+    return {
+        'start': start,
+        'end': end,
+        'dentists': [{'id': pk, 'username': username} for pk, username in dentists],
+        'appointments': [
+            {
+                'id': appointment.pk,
+                'dentist_id': appointment.user_id,
+                'date': appointment.date,
+                'start': appointment.start_time.strftime('%H:%M'),
+                'end': appointment.end_time.strftime('%H:%M'),
+                'patient': str(appointment.patient),
+                'patient_id': appointment.patient_id,
+                'reason': appointment.reason,
+                'status': appointment.status,
+                'status_display': appointment.get_status_display(),
+                'series_id': appointment.series_id,
+                'url': appointment.get_absolute_url(),
+            }
+            for appointment in appointments
+        ],
+    }
@@ -0,0 +1,119 @@
+"""
+Detección de pacientes duplicados.
+
+Cuando el DNI está vacío, la restricción única no evita registrar dos veces
+a la misma persona. Cada paciente guarda una clave de bloque (apellido paterno
+normalizado + año de nacimiento, columna indexada `duplicate_key`) y solo se
+comparan entre sí los pacientes del mismo bloque: al crear uno es una búsqueda
+en el índice y unas pocas comparaciones, y el recorrido completo evita las
+comparaciones O(n²) de todos contra todos.
+"""
+
+import re
+from difflib import SequenceMatcher
+from itertools import combinations, groupby
+
+from .models import Patient
+from .typeahead import normalize
+
+# Similitud mínima del nombre completo para considerar un posible duplicado
+NAME_THRESHOLD = 0.8
+# Con esta similitud basta el nombre (el bloque ya garantiza el año de nacimiento)
+STRONG_NAME_THRESHOLD = 0.95
+
+FIELDS = (
+    'pk', 'first_name', 'paternal_surname', 'maternal_surname',
+    'id_number', 'date_of_birth', 'phone_number', 'duplicate_key',
+)
+
+
+def blocking_key(paternal_surname, date_of_birth):
+    """Apellido paterno sin acentos ni espacios + año de nacimiento."""
+    surname = re.sub(r'[^a-z]', '', normalize(paternal_surname))
+    year = str(date_of_birth)[:4] if date_of_birth else ''
+    return f'{surname}:{year}'[:48]
+
+
+def _full_name(data):
+    parts = [data.get('first_name'), data.get('paternal_surname'), data.get('maternal_surname')]
+    return ' '.join(normalize(part) for part in parts if part)
+
+
+def _phone(data):
+    return re.sub(r'\D', '', data.get('phone_number') or '')
+
+
+def compare(a, b):
+    """
+    Motivos por los que dos pacientes (dicts con los campos de FIELDS) parecen
+    la misma persona, o una lista vacía si no lo parecen.
+    """
+    if a.get('id_number') and b.get('id_number') and a['id_number'] != b['id_number']:
+        return []
+
+    similarity = SequenceMatcher(None, _full_name(a), _full_name(b)).ratio()
+    if similarity < NAME_THRESHOLD:
+        return []
+
+    reasons = []
+    if a.get('date_of_birth') and a.get('date_of_birth') == b.get('date_of_birth'):
+        reasons.append('misma fecha de nacimiento')
+    phone = _phone(a)
+    if len(phone) >= 6 and phone == _phone(b):
+        reasons.append('mismo teléfono')
+    if not reasons and similarity < STRONG_NAME_THRESHOLD:
+        return []
+    reasons.insert(0, f'nombre {similarity:.0%} similar')
+    return reasons
+
+
+def find_duplicates(data, exclude_pk=None):
+    """
+    Posibles duplicados de un paciente nuevo o editado. `data` son los datos
+    del formulario (cleaned_data). Devuelve [(paciente, motivos)].
+    """
+    key = blocking_key(data.get('paternal_surname'), data.get('date_of_birth'))
+    candidates = Patient.objects.filter(duplicate_key=key)
+    if exclude_pk is not None:
+        candidates = candidates.exclude(pk=exclude_pk)
+
+    matches = []
+    for patient in candidates:
+        reasons = compare(data, {field: getattr(patient, field) for field in FIELDS})
+        if reasons:
+            matches.append((patient, reasons))
+    return matches
+
+
+def refresh_keys(chunk_size=2000):
+    """Recalcula las claves de bloque que estén desactualizadas. Devuelve cuántas cambiaron."""
+    stale = []
+    updated = 0
+    for patient in Patient.objects.only(
+        'paternal_surname', 'date_of_birth', 'duplicate_key'
+    ).order_by('pk').iterator(chunk_size=chunk_size):
+        key = blocking_key(patient.paternal_surname, patient.date_of_birth)
+        if key != patient.duplicate_key:
+            patient.duplicate_key = key
+            stale.append(patient)
+        if len(stale) >= chunk_size:
+            Patient.objects.bulk_update(stale, ['duplicate_key'])
+            updated += len(stale)
+            stale = []
+    if stale:
+        Patient.objects.bulk_update(stale, ['duplicate_key'])
+        updated += len(stale)
+    return updated
+
+
+def scan(chunk_size=2000):
+    """
+    Recorre la tabla ordenada por clave de bloque y compara solo dentro de cada
+    bloque. Genera (paciente_a, paciente_b, motivos), con los pacientes como dicts.
+    """
+    rows = Patient.objects.order_by('duplicate_key', 'pk').values(*FIELDS).iterator(chunk_size=chunk_size)
+    for _, block in groupby(rows, key=lambda row: row['duplicate_key']):
+        for a, b in combinations(list(block), 2):
+            reasons = compare(a, b)
+            if reasons:
+                yield a, b, reasons
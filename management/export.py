@@ -0,0 +1,110 @@
+"""
+Exportación de los datos clínicos en JSON Lines comprimido con gzip.
+
+Cada línea es {"model": ..., "pk": ..., "fields": {...}}. Las tablas se leen
+con .values().iterator(), así que la memoria no depende del tamaño de la
+clínica, y el gzip se genera por trozos con zlib para poder enviarlo en un
+StreamingHttpResponse o escribirlo en un archivo.
+
+Con `since` solo se exportan las filas creadas o modificadas desde esa fecha
+(campo updated_at). Los dientes no tienen marca propia: un cambio de estado
+actualiza la historia clínica y se exportan los 32 dientes de esa historia.
+La primera línea indica la marca de agua para la siguiente exportación. Los
+borrados y los comandos rebuild_* (UPDATE masivos) no mueven la marca de
+agua: después de ellos conviene una exportación completa.
+
+updated_at se fija al guardar, antes del commit: una transacción que empezó
+antes de la exportación y confirma después tiene una marca anterior a la de
+agua y no la habría visto ninguna de las dos exportaciones. Por eso la marca
+de agua se retrasa WATERMARK_OVERLAP respecto al inicio y las exportaciones
+incrementales se solapan: una fila puede llegar repetida y quien las importe
+debe quedarse con la última por (model, pk). Las transacciones más largas que
+el solapamiento siguen pudiendo perderse.
+"""
+
+import json
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import (
+    Appointment,
+    ClinicalHistory,
+    Consultation,
+    Patient,
+    Payment,
+    Tooth,
+    ToothProcedure,
+)
+
+# (nombre, modelo, campo de la marca de agua)
+EXPORTS = (
+    ('patient', Patient, 'updated_at'),
+    ('clinical_history', ClinicalHistory, 'updated_at'),
+    ('tooth', Tooth, 'history__updated_at'),
+    ('consultation', Consultation, 'updated_at'),
+    ('tooth_procedure', ToothProcedure, 'updated_at'),
+    ('payment', Payment, 'updated_at'),
+    ('appointment', Appointment, 'updated_at'),
+)
+# Margen para las transacciones que confirman después de iniciada la exportación
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+def parse_since(value):
+    """Fecha (AAAA-MM-DD) o fecha y hora ISO 8601 → datetime con zona horaria."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Fecha no válida: '{value}'. Use AAAA-MM-DD o AAAA-MM-DDTHH:MM[:SS][±HH:MM]")
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def next_watermark():
+    """
+    Tomada antes de leer y retrasada WATERMARK_OVERLAP: lo que cambie durante
+    la exportación, o confirme poco después, entra también en la siguiente.
+    """
+    return timezone.now() - WATERMARK_OVERLAP
+
+
+def export_records(since=None, chunk_size=2000, watermark=None):
+    """
+    Genera los registros a exportar, precedidos por uno con la marca de agua
+    (el `since` de la siguiente exportación; ver next_watermark).
+    """
+    watermark = watermark or next_watermark()
+    yield {'model': 'export', 'fields': {'since': since, 'watermark': watermark, 'overlap': WATERMARK_OVERLAP}}
+    for name, model, field in EXPORTS:
+        queryset = model.objects.order_by('pk')
+        if since is not None:
+            queryset = queryset.filter(**{f'{field}__gte': since})
+        for row in queryset.values().iterator(chunk_size=chunk_size):
+            yield {'model': name, 'pk': row.pop('id'), 'fields': row}
+
+
+def jsonl(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def gzip_stream(lines, level=6):
+    """Comprime un iterable de líneas en formato gzip, trozo a trozo."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for line in lines:
+        data = compressor.compress(line.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_gzip(since=None, chunk_size=2000, watermark=None):
+    """Exportación completa o incremental como bytes gzip en streaming."""
+    return gzip_stream(jsonl(export_records(since=since, chunk_size=chunk_size, watermark=watermark)))
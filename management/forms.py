@@ -1,5 +1,7 @@
 from django import forms
-from .models import Patient, ClinicalHistory, Consultation, Procedure, ToothProcedure, Payment, Tooth, Appointment
+from django.urls import reverse_lazy
+from .models import Patient, ClinicalHistory, Consultation, Procedure, ToothProcedure, Payment, Appointment, AppointmentSeries
+from . import odontogram, scheduling
 
 
 class PatientForm(forms.ModelForm):
@@ -10,7 +12,7 @@ class PatientForm(forms.ModelForm):
         fields = [
             'first_name', 'paternal_surname', 'maternal_surname',
             'id_number', 'gender', 'date_of_birth',
-            'phone_number', 'address'
+            'phone_number', 'email', 'address'
         ]
         widgets = {
             'first_name': forms.TextInput(attrs={
@@ -40,6 +42,10 @@ class PatientForm(forms.ModelForm):
                 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm',
                 'placeholder': 'Teléfono'
             }),
+            'email': forms.EmailInput(attrs={
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm',
+                'placeholder': 'correo@ejemplo.com'
+            }),
             'address': forms.Textarea(attrs={
                 'rows': 3,
                 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm',
@@ -54,6 +60,7 @@ class PatientForm(forms.ModelForm):
             'gender': 'Género',
             'date_of_birth': 'Fecha de Nacimiento',
             'phone_number': 'Teléfono',
+            'email': 'Correo Electrónico',
             'address': 'Dirección',
         }
 
@@ -136,7 +143,7 @@ class ProcedureForm(forms.ModelForm):
     
     class Meta:
         model = Procedure
-        fields = ['name', 'description', 'base_price']
+        fields = ['name', 'description', 'base_price', 'resulting_status', 'effect_scope']
         widgets = {
             'name': forms.TextInput(attrs={
                 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm',
@@ -152,37 +159,56 @@ class ProcedureForm(forms.ModelForm):
                 'placeholder': '0.00',
                 'step': '0.01'
             }),
+            'resulting_status': forms.Select(attrs={
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+            }),
+            'effect_scope': forms.Select(attrs={
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+            }),
         }
         labels = {
             'name': 'Nombre',
             'description': 'Descripción',
             'base_price': 'Precio Base',
+            'resulting_status': 'Estado Resultante del Diente',
+            'effect_scope': 'Alcance',
         }
 
 
 class ToothProcedureForm(forms.ModelForm):
-    """Formulario para agregar un procedimiento a un diente."""
+    """
+    Formulario para agregar un procedimiento a un diente. El diente se elige
+    por número ADA; su fila Tooth se crea al guardar si aún no existe
+    (odontograma empaquetado).
+    """
+    tooth_number = forms.TypedChoiceField(
+        coerce=int,
+        label='Diente',
+        widget=forms.Select(attrs={
+            'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+        }),
+    )
     
     def __init__(self, *args, **kwargs):
         patient = kwargs.pop('patient', None)
         super().__init__(*args, **kwargs)
         
-        # Filtrar solo los dientes del paciente actual
-        if patient and hasattr(patient, 'history'):
-            self.fields['tooth'].queryset = Tooth.objects.filter(
-                history=patient.history
-            ).order_by('number_ada')
-        
-        # Personalizar el display de los dientes
-        self.fields['tooth'].label_from_instance = lambda obj: f"Diente {obj.number_ada} ({obj.get_status_display()})"
+        # Dientes del paciente actual con su estado
+        self.history = patient.history if patient and hasattr(patient, 'history') else None
+        teeth = odontogram.teeth_for(self.history) if self.history else odontogram.unpack(None)
+        self.fields['tooth_number'].choices = [('', '---------')] + [
+            (tooth.number_ada, f"Diente {tooth.number_ada} ({tooth.get_status_display()})")
+            for tooth in teeth
+        ]
+    
+    def save(self, commit=True):
+        self.instance.tooth = odontogram.get_tooth(self.history, self.cleaned_data['tooth_number'])
+        return super().save(commit)
     
     class Meta:
         model = ToothProcedure
-        fields = ['tooth', 'procedure', 'price_charged', 'notes']
+        fields = ['tooth_number', 'procedure', 'price_charged', 'notes']
         widgets = {
-            'tooth': forms.Select(attrs={
-                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
-            }),
             'procedure': forms.Select(attrs={
                 'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
             }),
@@ -198,7 +224,6 @@ class ToothProcedureForm(forms.ModelForm):
             }),
         }
         labels = {
-            'tooth': 'Diente',
             'procedure': 'Procedimiento',
             'price_charged': 'Precio Cobrado',
             'notes': 'Notas',
@@ -227,6 +252,28 @@ class PaymentForm(forms.ModelForm):
         }
 
 
+class PatientTypeaheadWidget(forms.Widget):
+    """
+    Campo de paciente con autocompletado: un input de texto que consulta el
+    endpoint patient_typeahead y un input oculto con el id elegido. Solo se
+    renderiza el paciente seleccionado, no la tabla completa.
+    """
+    template_name = 'management/widgets/patient_typeahead.html'
+
+    def __init__(self, attrs=None, url=None):
+        super().__init__(attrs)
+        self.url = url or reverse_lazy('patient_typeahead')
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        label = ''
+        if value not in (None, ''):
+            patient = Patient.objects.filter(pk=value).first()
+            label = str(patient) if patient else ''
+        context['widget'].update({'url': str(self.url), 'label': label})
+        return context
+
+
 class AppointmentForm(forms.ModelForm):
     """Formulario para crear y editar citas."""
     
@@ -234,8 +281,9 @@ class AppointmentForm(forms.ModelForm):
         model = Appointment
         fields = ['patient', 'date', 'start_time', 'end_time', 'reason', 'notes', 'status']
         widgets = {
-            'patient': forms.Select(attrs={
-                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+            'patient': PatientTypeaheadWidget(attrs={
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm',
+                'placeholder': 'Buscar por nombre o DNI'
             }),
             'date': forms.DateInput(attrs={
                 'type': 'date',
@@ -272,6 +320,11 @@ class AppointmentForm(forms.ModelForm):
             'status': 'Estado',
         }
     
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Odontólogo de la cita: el de la instancia al editar, el que agenda al crear
+        self.dentist_id = self.instance.user_id or (user.pk if user else None)
+
     def clean(self):
         cleaned_data = super().clean()
         start_time = cleaned_data.get('start_time')
@@ -280,5 +333,109 @@ class AppointmentForm(forms.ModelForm):
         if start_time and end_time:
             if end_time <= start_time:
                 raise forms.ValidationError('La hora de fin debe ser posterior a la hora de inicio.')
+            scheduling.check_overlap(
+                self.dentist_id,
+                cleaned_data.get('date'),
+                start_time,
+                end_time,
+                exclude_pk=self.instance.pk,
+                status=cleaned_data.get('status'),
+                # Ocurrencia de una serie que se guarda al editarla
+                exclude_occurrence=(
+                    (self.instance.series_id, self.instance.occurrence_date)
+                    if self.instance.pk is None and self.instance.series_id else None
+                ),
+            )
         
         return cleaned_data
+
+
+class AppointmentSeriesForm(forms.ModelForm):
+    """Formulario para crear citas periódicas (una serie en lugar de una cita por fecha)."""
+
+    class Meta:
+        model = AppointmentSeries
+        fields = ['patient', 'start_date', 'start_time', 'end_time', 'frequency', 'interval', 'count', 'until', 'reason', 'notes']
+        widgets = {
+            'patient': PatientTypeaheadWidget(attrs={
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm',
+                'placeholder': 'Buscar por nombre o DNI'
+            }),
+            'start_date': forms.DateInput(attrs={
+                'type': 'date',
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+            }),
+            'start_time': forms.TimeInput(attrs={
+                'type': 'time',
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+            }),
+            'end_time': forms.TimeInput(attrs={
+                'type': 'time',
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+            }),
+            'frequency': forms.Select(attrs={
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+            }),
+            'interval': forms.NumberInput(attrs={
+                'min': '1',
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+            }),
+            'count': forms.NumberInput(attrs={
+                'min': '1',
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+            }),
+            'until': forms.DateInput(attrs={
+                'type': 'date',
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm'
+            }),
+            'reason': forms.TextInput(attrs={
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm',
+                'placeholder': 'Ej: Control de ortodoncia'
+            }),
+            'notes': forms.Textarea(attrs={
+                'rows': 3,
+                'class': 'mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 sm:text-sm',
+                'placeholder': 'Notas adicionales (opcional)'
+            }),
+        }
+        labels = {
+            'patient': 'Paciente',
+            'start_date': 'Primera Cita',
+            'start_time': 'Hora de Inicio',
+            'end_time': 'Hora de Fin',
+            'frequency': 'Frecuencia',
+            'interval': 'Repetir Cada',
+            'count': 'Número de Citas',
+            'until': 'Hasta',
+            'reason': 'Motivo de las Citas',
+            'notes': 'Notas',
+        }
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dentist_id = self.instance.user_id or (user.pk if user else None)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_time = cleaned_data.get('start_time')
+        end_time = cleaned_data.get('end_time')
+        start_date = cleaned_data.get('start_date')
+        until = cleaned_data.get('until')
+
+        if start_time and end_time and end_time <= start_time:
+            raise forms.ValidationError('La hora de fin debe ser posterior a la hora de inicio.')
+        if not cleaned_data.get('count') and not until:
+            raise forms.ValidationError('Indique el número de citas o la fecha final de la serie.')
+        if start_date and until and until < start_date:
+            raise forms.ValidationError('La fecha final debe ser posterior a la primera cita.')
+
+        if not self.errors and start_time and end_time and start_date:
+            series = AppointmentSeries(
+                pk=self.instance.pk,
+                user_id=self.dentist_id,
+                **{name: cleaned_data.get(name) for name in (
+                    'start_date', 'start_time', 'end_time', 'frequency', 'interval', 'count', 'until',
+                )},
+            )
+            scheduling.check_series_overlap(series)
+        return cleaned_data
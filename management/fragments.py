@@ -0,0 +1,110 @@
+"""
+Versiones de caché para los fragmentos de plantilla (dashboard y listados).
+
+Cada grupo de datos ('patient', 'consultation', 'payment', 'procedure') tiene
+un número de versión en la caché. Las plantillas incluyen las versiones de las que dependen
+en la clave del fragmento (`{% cache %}`), y los signals cambian la versión
+al confirmar la transacción de una escritura, así que los fragmentos viejos
+simplemente dejan de usarse.
+
+La escritura puede ocurrir en otro proceso (otro worker, el admin, un comando
+como import_patients), así que las versiones solo sirven si la caché es
+compartida. Con LocMemCache cada proceso tiene la suya: en ese caso los
+fragmentos se generan en cada petición (tiempo de vida 0).
+"""
+
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+
+GROUPS = ('patient', 'consultation', 'payment', 'procedure')
+
+KEY_PREFIX = 'fragment_version'
+
+
+def is_shared():
+    """True si la caché por defecto la ven todos los procesos (no es LocMemCache)."""
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def _key(group):
+    return f'{KEY_PREFIX}:{group}'
+
+
+def _initial_version():
+    # Basado en el reloj para no reutilizar versiones si la clave se pierde
+    return int(time.time() * 1000)
+
+
+def versions():
+    """Versión actual de cada grupo (una sola lectura a la caché)."""
+    keys = {_key(group): group for group in GROUPS}
+    found = cache.get_many(keys)
+    missing = {key: _initial_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return {keys[key]: value for key, value in found.items()}
+
+
+def _atomic_incr():
+    """True si `incr` es atómico entre procesos (Redis, Memcached)."""
+    return isinstance(caches['default'], (RedisCache, BaseMemcachedCache))
+
+
+def bump(*groups):
+    """
+    Invalida los fragmentos de los grupos indicados. En FileBasedCache y
+    LocMemCache `incr` lee y luego escribe, y dos procesos podrían llegar a la
+    misma versión: ahí se escribe una versión nueva y única en lugar de sumar.
+    """
+    atomic = _atomic_incr()
+    for group in groups:
+        if atomic:
+            try:
+                cache.incr(_key(group))
+                continue
+            except ValueError:
+                pass
+        cache.set(_key(group), uuid4().hex, timeout=None)
+
+
+def bump_on_commit(*groups):
+    """Invalida al confirmar la transacción, para no cachear datos sin confirmar."""
+    transaction.on_commit(lambda: bump(*groups))
+
+
+def context():
+    """Variables para las plantillas: versiones y tiempo de vida de los fragmentos."""
+    return {
+        'timeout': getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 3600) if is_shared() else 0,
+        **versions(),
+    }
+
+
+def cached(fragment_cache, fragments):
+    """
+    Nombres de los fragmentos {nombre: grupos de los que depende} que ya están
+    en la caché con las versiones de `fragment_cache` (ver context), para no
+    leer datos que la plantilla no va a usar.
+    """
+    if not fragment_cache['timeout']:
+        return set()
+    try:
+        # La misma caché que usa {% cache %}
+        fragment_store = caches['template_fragments']
+    except InvalidCacheBackendError:
+        fragment_store = caches['default']
+    keys = {
+        make_template_fragment_key(name, [fragment_cache[group] for group in groups]): name
+        for name, groups in fragments.items()
+    }
+    return {keys[key] for key in fragment_store.get_many(keys)}
@@ -0,0 +1,144 @@
+"""
+Importación masiva de pacientes.
+
+Crear pacientes uno a uno dispara por cada fila los signals de historia
+clínica, dientes, estadísticas e índice de búsqueda. Aquí los pacientes, sus
+historias y (en modo 'rows') sus 32 dientes se crean con bulk_create en
+lotes, cada lote en su propia transacción. bulk_create no envía post_save,
+así que los efectos de esos signals se aplican una vez por lote: contador de
+pacientes, índice FTS5, clave de duplicados y versión de los fragmentos.
+"""
+
+import time
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import fragments, odontogram, search, stats
+from .duplicates import blocking_key
+from .models import ClinicalHistory, Patient, Tooth
+
+DEFAULT_CHUNK_SIZE = 2000
+
+PATIENT_FIELDS = (
+    'first_name', 'paternal_surname', 'maternal_surname', 'id_number',
+    'gender', 'date_of_birth', 'phone_number', 'email', 'address',
+)
+HISTORY_FIELDS = (
+    'preexisting_conditions', 'current_medications', 'emergency_contact_name',
+    'emergency_contact_phone', 'blood_type', 'oral_health_observations',
+)
+
+
+@dataclass
+class ImportResult:
+    # Filas válidas (en --dry-run no se crean)
+    valid: int = 0
+    created: int = 0
+    # (número de fila, mensaje)
+    errors: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.valid / self.elapsed if self.elapsed else 0.0
+
+
+def _clean(model, data, fields):
+    """Instancia validada (sin restricciones únicas) a partir de los valores de texto."""
+    values = {}
+    for name in fields:
+        value = data.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in ('', None):
+            model_field = model._meta.get_field(name)
+            value = None if model_field.null else model_field.get_default()
+        values[name] = value
+    instance = model(**values)
+    instance.full_clean(exclude=['patient'], validate_unique=False)
+    return instance
+
+
+def _message(error):
+    if hasattr(error, 'message_dict'):
+        return '; '.join(f"{name}: {' '.join(messages)}" for name, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+def _save_chunk(chunk, result, dry_run):
+    """Valida y crea un lote de filas [(número de fila, datos)]."""
+    seen_ids = {}
+    valid = []
+    for line, data in chunk:
+        try:
+            patient = _clean(Patient, data, PATIENT_FIELDS)
+            history = _clean(ClinicalHistory, data, HISTORY_FIELDS)
+        except ValidationError as e:
+            result.errors.append((line, _message(e)))
+            continue
+        if patient.id_number:
+            if patient.id_number in seen_ids:
+                result.errors.append((line, f'id_number: repetido en la fila {seen_ids[patient.id_number]}'))
+                continue
+            seen_ids[patient.id_number] = line
+        patient.duplicate_key = blocking_key(patient.paternal_surname, patient.date_of_birth)
+        valid.append((line, patient, history))
+
+    # Una sola consulta por lote para los DNI que ya existen
+    existing = set(Patient.objects.filter(id_number__in=list(seen_ids)).values_list('id_number', flat=True))
+    rows = []
+    for line, patient, history in valid:
+        if patient.id_number in existing:
+            result.errors.append((line, 'id_number: ya existe un paciente con este DNI'))
+        else:
+            rows.append((patient, history))
+    result.valid += len(rows)
+    if dry_run or not rows:
+        return
+
+    with transaction.atomic():
+        patients = Patient.objects.bulk_create([patient for patient, _ in rows])
+        histories = []
+        for patient, (_, history) in zip(patients, rows):
+            history.patient = patient
+            histories.append(history)
+        histories = ClinicalHistory.objects.bulk_create(histories)
+        if not odontogram.is_packed():
+            Tooth.objects.bulk_create([
+                Tooth(history=history, number_ada=number, status='S')
+                for history in histories for number in odontogram.TEETH
+            ])
+
+        # Lo que harían los signals de post_save, una vez por lote
+        stats.apply_delta(total_patients=len(patients))
+        search.index_new_patients(patients)
+        fragments.bump_on_commit('patient')
+    result.created += len(patients)
+
+
+def import_patients(rows, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False, progress=None):
+    """
+    Importa pacientes desde un iterable de dicts con los campos de Patient y,
+    opcionalmente, de ClinicalHistory. Las filas inválidas se omiten y se
+    informan en ImportResult.errors con su número (empezando en 1).
+    `progress(result)` se llama tras cada lote.
+    """
+    result = ImportResult()
+    started = time.perf_counter()
+    chunk = []
+    for line, data in enumerate(rows, start=1):
+        chunk.append((line, data))
+        if len(chunk) >= chunk_size:
+            _save_chunk(chunk, result, dry_run)
+            chunk = []
+            result.elapsed = time.perf_counter() - started
+            if progress:
+                progress(result)
+    if chunk:
+        _save_chunk(chunk, result, dry_run)
+    result.elapsed = time.perf_counter() - started
+    if progress:
+        progress(result)
+    return result
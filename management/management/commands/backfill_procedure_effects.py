@@ -0,0 +1,21 @@
+"""
+Asigna a los procedimientos del catálogo el efecto que antes se deducía del
+nombre ('extracción' → Extraído, 'obturación'/'resina' → Obturado).
+Solo cambia los que siguen con el valor por defecto (Pendiente, alcance Diente).
+También corre automáticamente después de cada migrate.
+Uso: python manage.py backfill_procedure_effects
+"""
+
+from django.core.management.base import BaseCommand
+
+from management.procedure_effects import backfill_legacy
+
+
+class Command(BaseCommand):
+    help = 'Deduce el efecto sobre el odontograma de los procedimientos a partir de su nombre'
+
+    def handle(self, *args, **kwargs):
+        updated = backfill_legacy()
+        for procedure in updated:
+            self.stdout.write(f'{procedure.name}: {procedure.get_resulting_status_display()}')
+        self.stdout.write(self.style.SUCCESS(f'[OK] {len(updated)} procedimientos actualizados'))
@@ -0,0 +1,165 @@
+"""
+Mide la detección de citas solapadas con un odontólogo de prueba con miles de
+citas: latencia del mapa de ocupación y de la consulta por índice frente a
+recorrer toda su agenda, y reservas simultáneas del mismo horario (solo una
+debe guardarse).
+Uso: python manage.py benchmark_appointment_conflicts [--appointments 5000] [--probes 1000] [--threads 8]
+"""
+
+import random
+import statistics
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections, transaction
+
+from management import occupancy
+from management.forms import AppointmentForm
+from management.models import Appointment, Patient
+from management.scheduling import overlapping
+
+# Citas de 45 minutos cada hora entre las 8:00 y las 18:00
+DAY_SLOTS = 10
+
+
+def _at(day, minutes):
+    return (datetime.combine(day, datetime.min.time()) + timedelta(minutes=minutes)).time()
+
+
+class Command(BaseCommand):
+    help = 'Mide la detección de solapamientos de citas y su comportamiento con reservas simultáneas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=5000, help='Citas del odontólogo de prueba')
+        parser.add_argument('--probes', type=int, default=1000, help='Comprobaciones de horario a medir')
+        parser.add_argument('--threads', type=int, default=8, help='Reservas simultáneas del mismo horario')
+
+    def handle(self, *args, **kwargs):
+        patient = Patient.objects.order_by('pk').first()
+        if patient is None:
+            raise CommandError('No hay pacientes; ejecute populate_data primero.')
+
+        dentist = User.objects.create_user(f'benchmark_{int(time.time())}')
+        try:
+            self._run(dentist, patient, kwargs)
+        finally:
+            Appointment.objects.filter(user=dentist).delete()
+            dentist.delete()
+
+    def _run(self, dentist, patient, kwargs):
+        first_day = date.today() + timedelta(days=3650)
+        days = -(-kwargs['appointments'] // DAY_SLOTS)
+        Appointment.objects.bulk_create([
+            Appointment(
+                patient=patient, user=dentist, date=first_day + timedelta(days=index // DAY_SLOTS),
+                start_time=_at(first_day, 480 + (index % DAY_SLOTS) * 60),
+                end_time=_at(first_day, 480 + (index % DAY_SLOTS) * 60 + 45),
+                reason='Benchmark',
+            )
+            for index in range(kwargs['appointments'])
+        ], batch_size=1000)
+        # bulk_create no envía post_save: los mapas de ocupación se calculan aquí
+        occupancy.refresh_days((dentist.pk, first_day + timedelta(days=day)) for day in range(days))
+
+        rng = random.Random(1)
+        probes = []
+        for _ in range(kwargs['probes']):
+            day = first_day + timedelta(days=rng.randrange(days))
+            start = 480 + rng.randrange(0, 600, 15)
+            probes.append((day, _at(day, start), _at(day, start + 30)))
+
+        bitmap = []
+        for day, start, end in probes:
+            began = time.perf_counter()
+            occupancy.is_free(dentist.pk, day, start, end)
+            bitmap.append(time.perf_counter() - began)
+
+        indexed = []
+        conflicts = 0
+        for day, start, end in probes:
+            began = time.perf_counter()
+            conflicts += overlapping(dentist.pk, day, start, end).exists()
+            indexed.append(time.perf_counter() - began)
+
+        scanned = []
+        for day, start, end in probes[:max(1, len(probes) // 10)]:
+            began = time.perf_counter()
+            any(
+                row_day == day and row_start < end and row_end > start
+                for row_day, row_start, row_end in Appointment.objects.filter(user=dentist).exclude(
+                    status='X'
+                ).values_list('date', 'start_time', 'end_time')
+            )
+            scanned.append(time.perf_counter() - began)
+
+        self.stdout.write('\n' + '=' * 64)
+        self.stdout.write(self.style.SUCCESS(f"SOLAPAMIENTOS ({kwargs['appointments']} citas, {days} días)"))
+        self.stdout.write('=' * 64)
+        self.stdout.write(f"{'Estrategia':<32}{'media ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for label, latencies in (
+            ('Mapa de ocupación (bits)', bitmap),
+            ('Índice (user, date, inicio, fin)', indexed),
+            ('Recorrer la agenda', scanned),
+        ):
+            ordered = sorted(latencies)
+            p95 = ordered[max(int(len(ordered) * 0.95) - 1, 0)]
+            self.stdout.write(
+                f'{label:<32}{statistics.mean(ordered) * 1000:>10.3f}'
+                f'{statistics.median(ordered) * 1000:>10.3f}{p95 * 1000:>10.3f}'
+            )
+        self.stdout.write(f'Horarios con conflicto: {conflicts} de {len(probes)}')
+        if connection.vendor == 'sqlite':
+            day, start, end = probes[0]
+            sql, params = overlapping(dentist.pk, day, start, end).query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                self.stdout.write('Plan: ' + ' | '.join(row[-1] for row in cursor.fetchall()))
+
+        self._concurrent(dentist, patient, first_day + timedelta(days=days + 1), kwargs['threads'])
+
+    def _concurrent(self, dentist, patient, day, threads):
+        """Varias reservas del mismo horario a la vez, por el mismo camino que la vista."""
+        barrier = threading.Barrier(threads)
+        results = []
+
+        def book():
+            try:
+                form = AppointmentForm({
+                    'patient': patient.pk, 'date': day, 'start_time': '09:00', 'end_time': '09:45',
+                    'reason': 'Benchmark', 'status': 'P',
+                }, user=dentist)
+                barrier.wait()
+                with transaction.atomic():
+                    saved = form.is_valid()
+                    if saved:
+                        appointment = form.save(commit=False)
+                        appointment.user = dentist
+                        appointment.save()
+                results.append(saved)
+            except DatabaseError as e:
+                # Bloqueo de la base de datos: se cuenta como error, no como reserva
+                results.append(e)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=book) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        saved = results.count(True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        self.stdout.write('\n' + '=' * 64)
+        self.stdout.write(self.style.SUCCESS(f'RESERVAS SIMULTÁNEAS ({threads} hilos, mismo horario)'))
+        self.stdout.write('=' * 64)
+        self.stdout.write(f'Guardadas: {saved}  Rechazadas por solapamiento: {results.count(False)}  Errores: {len(errors)}')
+        for error in errors[:3]:
+            self.stdout.write(f'  {type(error).__name__}: {error}')
+        stored = Appointment.objects.filter(user=dentist, date=day).count()
+        style = self.style.SUCCESS if stored == 1 else self.style.ERROR
+        self.stdout.write(style(f'Citas guardadas en ese horario: {stored}'))
+        self.stdout.write('=' * 64 + '\n')
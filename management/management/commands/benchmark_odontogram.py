@@ -0,0 +1,97 @@
+"""
+Compara el odontograma en filas Tooth con el empaquetado: tamaño de las
+tablas y latencia de patient_detail / consultation_detail.
+Uso: python manage.py benchmark_odontogram [--requests 100] [--username admin]
+"""
+
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from management.models import ClinicalHistory, Consultation, Tooth
+
+
+def table_bytes(model):
+    """Bytes ocupados por la tabla y sus índices (SQLite con dbstat), o None."""
+    if connection.vendor != 'sqlite':
+        return None
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT SUM(pgsize) FROM dbstat WHERE name = %s "
+                "OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s)",
+                [table, table],
+            )
+            return cursor.fetchone()[0]
+    except DatabaseError:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Mide tamaño de tablas y latencia de páginas con el odontograma en filas y empaquetado'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='Peticiones por página y modo')
+        parser.add_argument('--username', help='Usuario con el que se inicia sesión (por defecto, el primer superusuario)')
+
+    def handle(self, *args, **kwargs):
+        username = kwargs.get('username')
+        users = User.objects.filter(username=username) if username else User.objects.filter(is_superuser=True)
+        user = users.first()
+        if user is None:
+            raise CommandError('No hay un usuario para iniciar sesión (use --username).')
+
+        consultation = Consultation.objects.order_by('-date').first()
+        if consultation is None:
+            raise CommandError('No hay consultas; ejecute populate_data primero.')
+
+        histories = ClinicalHistory.objects.count()
+        teeth = Tooth.objects.count()
+        self.stdout.write('\n' + '=' * 64)
+        self.stdout.write(self.style.SUCCESS('TAMAÑO'))
+        self.stdout.write('=' * 64)
+        self.stdout.write(f'Historias clínicas: {histories}')
+        self.stdout.write(f'Filas Tooth:        {teeth} ({teeth / histories if histories else 0:.1f} por historia)')
+        for model in (Tooth, ClinicalHistory):
+            size = table_bytes(model)
+            label = f'{size / 1024:.1f} KiB' if size is not None else 'n/d (sin dbstat)'
+            self.stdout.write(f'{model._meta.db_table:<32}{label:>20}')
+        if teeth < histories * 32:
+            self.stdout.write(self.style.WARNING(
+                'Faltan filas Tooth (datos empaquetados): el modo rows mostrará odontogramas incompletos.'
+            ))
+
+        urls = [
+            ('patient_detail', reverse('patient_detail', args=[consultation.patient_id])),
+            ('consultation_detail', reverse('consultation_detail', args=[consultation.pk])),
+        ]
+        client = Client()
+        client.force_login(user)
+
+        self.stdout.write('\n' + '=' * 64)
+        self.stdout.write(f"{'Página':<24}{'Modo':<10}{'media ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        self.stdout.write('=' * 64)
+        for name, url in urls:
+            for mode in ('rows', 'packed'):
+                with override_settings(ODONTOGRAM_STORAGE=mode, ALLOWED_HOSTS=['testserver']):
+                    client.get(url)  # Calentamiento
+                    latencies = []
+                    for _ in range(kwargs['requests']):
+                        start = time.perf_counter()
+                        client.get(url)
+                        latencies.append(time.perf_counter() - start)
+                ordered = sorted(latencies)
+                p95 = ordered[max(int(len(ordered) * 0.95) - 1, 0)]
+                self.stdout.write(
+                    f"{name:<24}{mode:<10}"
+                    f"{statistics.mean(ordered) * 1000:>10.2f}"
+                    f"{statistics.median(ordered) * 1000:>10.2f}"
+                    f"{p95 * 1000:>10.2f}"
+                )
+        self.stdout.write('=' * 64 + '\n')
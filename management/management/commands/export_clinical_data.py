@@ -0,0 +1,43 @@
+"""
+Exporta pacientes, historias, dientes, consultas, procedimientos, pagos y citas
+en JSON Lines comprimido con gzip.
+Uso: python manage.py export_clinical_data salida.jsonl.gz [--since 2025-01-31T02:00:00]
+     (con '-' como salida escribe en stdout)
+"""
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from management.export import export_gzip, next_watermark, parse_since
+
+
+class Command(BaseCommand):
+    help = 'Exporta los datos clínicos en JSON Lines con gzip (completo o incremental)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Archivo de salida (.jsonl.gz) o '-' para stdout")
+        parser.add_argument('--since', help='Solo filas creadas o modificadas desde esta fecha/hora (ISO 8601)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Filas leídas por consulta')
+
+    def handle(self, *args, **kwargs):
+        try:
+            since = parse_since(kwargs['since']) if kwargs['since'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        watermark = next_watermark()
+        chunks = export_gzip(since=since, chunk_size=kwargs['chunk_size'], watermark=watermark)
+        if kwargs['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        size = 0
+        with open(kwargs['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+                size += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f"[OK] {size / 1024:.0f} KB escritos en {kwargs['output']}"))
+        self.stdout.write(f'Siguiente exportación incremental: --since {watermark.isoformat()}')
@@ -0,0 +1,32 @@
+"""
+Busca posibles pacientes duplicados comparando solo dentro de cada bloque
+(apellido paterno normalizado + año de nacimiento).
+Uso: python manage.py find_duplicate_patients
+"""
+
+from django.core.management.base import BaseCommand
+
+from management.duplicates import refresh_keys, scan
+
+
+class Command(BaseCommand):
+    help = 'Lista los pacientes que parecen estar registrados más de una vez'
+
+    def handle(self, *args, **kwargs):
+        updated = refresh_keys()
+        if updated:
+            self.stdout.write(f'{updated} claves de bloque actualizadas')
+
+        found = 0
+        for a, b, reasons in scan():
+            found += 1
+            self.stdout.write(
+                f"#{a['pk']} {a['first_name']} {a['paternal_surname']} {a['maternal_surname'] or ''}".rstrip()
+                + f"  <->  #{b['pk']} {b['first_name']} {b['paternal_surname']} {b['maternal_surname'] or ''}".rstrip()
+                + f"  ({', '.join(reasons)})"
+            )
+
+        if found:
+            self.stdout.write(self.style.WARNING(f'{found} posibles duplicados'))
+        else:
+            self.stdout.write(self.style.SUCCESS('[OK] No se encontraron posibles duplicados'))
@@ -0,0 +1,54 @@
+"""
+Importa pacientes desde un CSV en lotes, sin los signals por fila.
+Columnas: first_name, paternal_surname, maternal_surname, id_number, gender,
+date_of_birth (AAAA-MM-DD), phone_number, email, address y, opcionalmente, los campos
+de la historia clínica (blood_type, preexisting_conditions, ...).
+Uso: python manage.py import_patients pacientes.csv [--chunk-size 2000] [--dry-run]
+"""
+
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from management.importer import DEFAULT_CHUNK_SIZE, import_patients
+
+
+class Command(BaseCommand):
+    help = 'Importa pacientes desde un archivo CSV en lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Archivo CSV con encabezados')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Filas por lote/transacción')
+        parser.add_argument('--dry-run', action='store_true', help='Solo valida, no crea nada')
+        parser.add_argument('--max-errors', type=int, default=50, help='Errores a mostrar (0 = todos)')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['chunk_size'] < 1:
+            raise CommandError('--chunk-size debe ser mayor que 0.')
+
+        def progress(result):
+            self.stdout.write(f'  {result.valid} filas válidas, {result.created} creadas ({result.rows_per_second:.0f} filas/s)')
+
+        try:
+            with open(kwargs['path'], newline='', encoding='utf-8-sig') as handle:
+                result = import_patients(
+                    csv.DictReader(handle),
+                    chunk_size=kwargs['chunk_size'],
+                    dry_run=kwargs['dry_run'],
+                    progress=progress,
+                )
+        except OSError as e:
+            raise CommandError(f'No se pudo leer el archivo: {e}')
+
+        max_errors = kwargs['max_errors']
+        for line, message in result.errors[:max_errors or None]:
+            # +1 por la fila de encabezados
+            self.stdout.write(self.style.ERROR(f'Fila {line + 1}: {message}'))
+        if max_errors and len(result.errors) > max_errors:
+            self.stdout.write(f'... y {len(result.errors) - max_errors} errores más')
+
+        action = 'validados' if kwargs['dry_run'] else 'importados'
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] {result.valid} pacientes {action} en {result.elapsed:.1f}s '
+            f'({result.rows_per_second:.0f} filas/s), {len(result.errors)} filas con errores'
+        ))
@@ -0,0 +1,34 @@
+"""
+Cambia el almacenamiento del odontograma entre 32 filas Tooth por paciente
+y la cadena empaquetada en ClinicalHistory.odontogram.
+Uso: python manage.py migrate_odontogram --to packed|rows
+Después, ajustar GLOBALDENT_ODONTOGRAM al mismo valor y reiniciar.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from management.odontogram import to_packed, to_rows
+
+
+class Command(BaseCommand):
+    help = 'Migra el odontograma entre filas Tooth y el formato empaquetado'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=['packed', 'rows'], required=True, help='Modo de destino')
+
+    def handle(self, *args, **kwargs):
+        mode = kwargs['to']
+        if mode == 'packed':
+            histories, deleted = to_packed()
+            self.stdout.write(self.style.SUCCESS(
+                f'[OK] {histories} odontogramas empaquetados, {deleted} filas Tooth sin procedimientos eliminadas'
+            ))
+        else:
+            created = to_rows()
+            self.stdout.write(self.style.SUCCESS(f'[OK] {created} filas Tooth creadas'))
+
+        if settings.ODONTOGRAM_STORAGE != mode:
+            self.stdout.write(self.style.WARNING(
+                f'Configure GLOBALDENT_ODONTOGRAM={mode} (ahora: {settings.ODONTOGRAM_STORAGE}) y reinicie el servidor.'
+            ))
@@ -14,6 +14,7 @@ from management.models import (
     Patient, ClinicalHistory, Tooth, Consultation, 
     Procedure, ToothProcedure, Payment, Appointment
 )
+from management import odontogram, procedure_effects
 
 
 class Command(BaseCommand):
@@ -97,10 +98,27 @@ class Command(BaseCommand):
             ('Curetaje Dental', 'Limpieza profunda de encías', Decimal('1200.00')),
         ]
         
+        # Efecto sobre el odontograma: los demás dejan el diente pendiente de tratamiento
+        effects = {
+            'Limpieza Dental': '',
+            'Extracción Simple': 'E',
+            'Extracción Compleja': 'E',
+            'Obturación (Resina)': 'O',
+            'Obturación (Amalgama)': 'O',
+            'Radiografía Periapical': '',
+            'Radiografía Panorámica': '',
+            'Aplicación de Flúor': '',
+            'Consulta General': '',
+        }
+        
         for name, description, price in procedures_data:
             Procedure.objects.get_or_create(
                 name=name,
-                defaults={'description': description, 'base_price': price}
+                defaults={
+                    'description': description,
+                    'base_price': price,
+                    'resulting_status': effects.get(name, 'P'),
+                }
             )
         
         self.stdout.write(self.style.SUCCESS(f'[OK] {len(procedures_data)} procedimientos creados'))
@@ -111,51 +129,61 @@ class Command(BaseCommand):
             {
                 'first_name': 'María', 'paternal_surname': 'González', 'maternal_surname': 'López',
                 'id_number': '12345678', 'gender': 'F', 'date_of_birth': '1985-03-15',
+                'email': 'maria.gonzalez@ejemplo.com',
                 'phone_number': '555-0101', 'address': 'Av. Principal 123, Col. Centro'
             },
             {
                 'first_name': 'Carlos', 'paternal_surname': 'Rodríguez', 'maternal_surname': 'Martínez',
                 'id_number': '23456789', 'gender': 'M', 'date_of_birth': '1990-07-22',
+                'email': 'carlos.rodriguez@ejemplo.com',
                 'phone_number': '555-0102', 'address': 'Calle Reforma 456, Col. Juárez'
             },
             {
                 'first_name': 'Ana', 'paternal_surname': 'Hernández', 'maternal_surname': 'García',
                 'id_number': '34567890', 'gender': 'F', 'date_of_birth': '1978-11-30',
+                'email': 'ana.hernandez@ejemplo.com',
                 'phone_number': '555-0103', 'address': 'Blvd. Insurgentes 789, Col. Roma'
             },
             {
                 'first_name': 'Luis', 'paternal_surname': 'Martínez', 'maternal_surname': 'Sánchez',
                 'id_number': '45678901', 'gender': 'M', 'date_of_birth': '1995-05-18',
+                'email': 'luis.martinez@ejemplo.com',
                 'phone_number': '555-0104', 'address': 'Av. Universidad 321, Col. Del Valle'
             },
             {
                 'first_name': 'Patricia', 'paternal_surname': 'López', 'maternal_surname': 'Ramírez',
                 'id_number': '56789012', 'gender': 'F', 'date_of_birth': '1982-09-25',
+                'email': 'patricia.lopez@ejemplo.com',
                 'phone_number': '555-0105', 'address': 'Calle Morelos 654, Col. Centro'
             },
             {
                 'first_name': 'Roberto', 'paternal_surname': 'García', 'maternal_surname': 'Torres',
                 'id_number': '67890123', 'gender': 'M', 'date_of_birth': '1988-02-14',
+                'email': 'roberto.garcia@ejemplo.com',
                 'phone_number': '555-0106', 'address': 'Av. Revolución 987, Col. Mixcoac'
             },
             {
                 'first_name': 'Laura', 'paternal_surname': 'Pérez', 'maternal_surname': 'Flores',
                 'id_number': '78901234', 'gender': 'F', 'date_of_birth': '1992-12-08',
+                'email': 'laura.perez@ejemplo.com',
                 'phone_number': '555-0107', 'address': 'Calle Hidalgo 147, Col. Polanco'
             },
             {
                 'first_name': 'Jorge', 'paternal_surname': 'Sánchez', 'maternal_surname': 'Morales',
                 'id_number': '89012345', 'gender': 'M', 'date_of_birth': '1975-06-20',
+                'email': 'jorge.sanchez@ejemplo.com',
                 'phone_number': '555-0108', 'address': 'Av. Constitución 258, Col. Condesa'
             },
             {
                 'first_name': 'Sofía', 'paternal_surname': 'Ramírez', 'maternal_surname': 'Cruz',
                 'id_number': '90123456', 'gender': 'F', 'date_of_birth': '1998-04-12',
+                'email': 'sofia.ramirez@ejemplo.com',
                 'phone_number': '555-0109', 'address': 'Blvd. Juárez 369, Col. Narvarte'
             },
             {
                 'first_name': 'Miguel', 'paternal_surname': 'Torres', 'maternal_surname': 'Ruiz',
                 'id_number': '01234567', 'gender': 'M', 'date_of_birth': '1980-08-05',
+                'email': 'miguel.torres@ejemplo.com',
                 'phone_number': '555-0110', 'address': 'Calle Independencia 741, Col. San Ángel'
             },
         ]
@@ -170,6 +198,7 @@ class Command(BaseCommand):
                 gender=patient_data['gender'],
                 date_of_birth=datetime.strptime(patient_data['date_of_birth'], '%Y-%m-%d').date(),
                 phone_number=patient_data['phone_number'],
+                email=patient_data['email'],
                 address=patient_data['address']
             )
             
@@ -216,11 +245,10 @@ class Command(BaseCommand):
         history.save()
         
         # Actualizar algunos dientes con estados variados
-        teeth = list(history.teeth.all())
         tooth_statuses = ['C', 'O', 'P', 'E']
         # Cambiar el estado de algunos dientes aleatoriamente
         for _ in range(random.randint(2, 8)):
-            tooth = random.choice(teeth)
+            tooth = odontogram.get_tooth(history, random.randint(1, 32))
             tooth.status = random.choice(tooth_statuses)
             tooth.save()
 
@@ -229,7 +257,6 @@ class Command(BaseCommand):
         num_consultations = random.randint(1, 3)
         
         procedures = list(Procedure.objects.all())
-        teeth = list(patient.history.teeth.all())
         
         for i in range(num_consultations):
             # Fecha de consulta en los últimos 6 meses
@@ -263,13 +290,13 @@ class Command(BaseCommand):
             
             for _ in range(num_procedures):
                 procedure = random.choice(procedures)
-                tooth = random.choice(teeth)
+                tooth = odontogram.get_tooth(patient.history, random.randint(1, 32))
                 
                 # Precio con variación del ±10%
                 variation = Decimal(random.uniform(0.9, 1.1))
                 price = (procedure.base_price * variation).quantize(Decimal('0.01'))
                 
-                ToothProcedure.objects.create(
+                tooth_procedure = ToothProcedure.objects.create(
                     consultation=consultation,
                     tooth=tooth,
                     procedure=procedure,
@@ -279,12 +306,8 @@ class Command(BaseCommand):
                 
                 total_cost += price
                 
-                # Actualizar estado del diente según procedimiento
-                if 'Extracción' in procedure.name:
-                    tooth.status = 'E'
-                elif 'Obturación' in procedure.name:
-                    tooth.status = 'O'
-                tooth.save()
+                # Actualizar estado del diente según el efecto del procedimiento
+                procedure_effects.apply(tooth_procedure, consultation_id=consultation.pk)
             
             consultation.total_cost = total_cost
             consultation.save()
@@ -327,6 +350,9 @@ class Command(BaseCommand):
                 remaining -= amount
                 if remaining <= 0:
                     break
+        
+        # Actualizar lo pagado y el saldo desnormalizados
+        consultation.update_payment_totals()
 
     def create_appointments(self, patient, user):
         """Crea citas para el paciente."""
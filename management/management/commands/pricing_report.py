@@ -0,0 +1,56 @@
+"""
+Distribución de descuentos: precio cobrado frente al precio base del catálogo.
+Uso: python manage.py pricing_report [--start AAAA-MM-DD] [--end AAAA-MM-DD] [--json]
+"""
+
+import json
+from datetime import date
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from management.pricing import pricing_analysis
+
+
+class Command(BaseCommand):
+    help = 'Analiza la razón precio cobrado / precio base por procedimiento, odontólogo y mes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='Fecha inicial (AAAA-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Fecha final (AAAA-MM-DD)')
+        parser.add_argument('--json', action='store_true', help='Imprime el resultado completo en JSON')
+
+    def handle(self, *args, **kwargs):
+        try:
+            result = pricing_analysis(kwargs.get('start'), kwargs.get('end'))
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        if kwargs.get('json'):
+            self.stdout.write(json.dumps(result, cls=DjangoJSONEncoder, indent=2, ensure_ascii=False))
+            return
+
+        overall = result['overall']
+        if not overall['count']:
+            self.stdout.write(self.style.WARNING('No hay procedimientos aplicados en el rango.'))
+            return
+
+        self.stdout.write('\n' + '=' * 78)
+        self.stdout.write(self.style.SUCCESS('RAZON PRECIO COBRADO / PRECIO BASE'))
+        self.stdout.write('=' * 78)
+        self.stdout.write(f"{'Grupo':<34}{'n':>6}{'media':>8}{'p10':>8}{'p50':>8}{'p90':>8}{'desc. %':>9}")
+        self.stdout.write('-' * 78)
+        self._row('Global', overall)
+        for section, label in (('by_procedure', 'procedure'), ('by_dentist', 'dentist'), ('by_month', 'month')):
+            self.stdout.write('-' * 78)
+            for item in result[section]:
+                self._row(str(item[label]), item)
+        self.stdout.write('=' * 78 + '\n')
+
+    def _row(self, name, stats):
+        p = stats['percentiles']
+        self.stdout.write(
+            f"{name[:33]:<34}{stats['count']:>6}{stats['mean']:>8.3f}"
+            f"{p['p10']:>8.3f}{p['p50']:>8.3f}{p['p90']:>8.3f}{stats['mean_discount_pct']:>9.2f}"
+        )
@@ -0,0 +1,38 @@
+"""
+Recalcula lo pagado y el saldo desnormalizados de todas las consultas.
+Uso: python manage.py rebuild_balances
+"""
+
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from management.models import Consultation, Payment
+
+
+class Command(BaseCommand):
+    help = 'Recalcula amount_paid y balance de todas las consultas a partir de sus pagos'
+
+    def handle(self, *args, **kwargs):
+        paid = Coalesce(
+            Subquery(
+                Payment.objects.filter(consultation=OuterRef('pk'))
+                .values('consultation')
+                .annotate(total=Sum('amount'))
+                .values('total')[:1]
+            ),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+
+        # Un solo UPDATE para toda la tabla
+        with transaction.atomic():
+            updated = Consultation.objects.update(amount_paid=paid)
+            Consultation.objects.update(balance=F('total_cost') - F('amount_paid'))
+
+        pending = Consultation.objects.filter(balance__gt=0).count()
+        self.stdout.write(self.style.SUCCESS(f'[OK] {updated} consultas actualizadas'))
+        self.stdout.write(f'Consultas con saldo pendiente: {pending}')
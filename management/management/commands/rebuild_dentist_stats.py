@@ -0,0 +1,31 @@
+"""
+Reconstruye los agregados diarios de productividad por odontólogo.
+Uso: python manage.py rebuild_dentist_stats [--days 90]
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from management.productivity import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recalcula la productividad diaria por odontólogo (DentistDailyStats)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Solo recalcula los últimos N días (por defecto, todo el historial)',
+        )
+
+    def handle(self, *args, **kwargs):
+        days = kwargs.get('days')
+        since = timezone.localdate() - timedelta(days=days) if days else None
+
+        rows = rebuild(since=since)
+        scope = f'desde {since}' if since else 'todo el historial'
+        self.stdout.write(self.style.SUCCESS(f'[OK] {rows} filas diarias reconstruidas ({scope})'))
@@ -0,0 +1,113 @@
+"""
+Reconstruye los mapas de ocupación de la agenda (DentistDayOccupancy) o, con
+--check, los compara con la tabla de citas: filas guardadas frente a las
+recalculadas y, para horarios al azar, la respuesta de los bits frente a la
+consulta de solapamientos.
+Uso: python manage.py rebuild_occupancy [--days 90] [--check] [--probes 2000]
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from management import occupancy
+from management.models import DentistDayOccupancy
+from management.scheduling import overlapping
+
+
+def _at(minutes):
+    return datetime.min.replace(hour=minutes // 60, minute=minutes % 60).time()
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los mapas de ocupación por odontólogo y día, o los verifica contra las citas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Solo los últimos N días y los futuros (por defecto, todo el historial)',
+        )
+        parser.add_argument('--check', action='store_true', help='Verifica sin modificar nada')
+        parser.add_argument('--probes', type=int, default=2000, help='Horarios al azar a comparar con --check')
+
+    def handle(self, *args, **kwargs):
+        days = kwargs.get('days')
+        since = timezone.localdate() - timedelta(days=days) if days else None
+        scope = f'desde {since}' if since else 'todo el historial'
+
+        if not kwargs['check']:
+            rows = occupancy.rebuild(since=since)
+            self.stdout.write(self.style.SUCCESS(f'[OK] {rows} filas de ocupación reconstruidas ({scope})'))
+            return
+
+        expected = occupancy.compute_all(since)
+        rows = DentistDayOccupancy.objects.all()
+        if since:
+            rows = rows.filter(day__gte=since)
+        actual = {
+            (user_id, day): (occupancy.decode(bitmap), exact)
+            for user_id, day, bitmap, exact in rows.values_list('user_id', 'day', 'bitmap', 'exact')
+        }
+        mismatches = sorted(
+            (key, actual.get(key), expected.get(key))
+            for key in expected.keys() | actual.keys()
+            if actual.get(key) != expected.get(key)
+        )
+
+        self.stdout.write('\n' + '=' * 64)
+        self.stdout.write(self.style.SUCCESS(f'MAPAS DE OCUPACIÓN ({scope})'))
+        self.stdout.write('=' * 64)
+        self.stdout.write(f'Filas guardadas:   {len(actual)}')
+        self.stdout.write(f'Filas esperadas:   {len(expected)}')
+        self.stdout.write(f'Días no exactos:   {sum(1 for _, exact in expected.values() if not exact)}')
+        style = self.style.ERROR if mismatches else self.style.SUCCESS
+        self.stdout.write(style(f'Diferencias:       {len(mismatches)}'))
+        for (user_id, day), stored, computed in mismatches[:10]:
+            self.stdout.write(f'  odontólogo {user_id}, {day}: guardado {stored}, esperado {computed}')
+
+        wrong = self._probes(expected, kwargs['probes'])
+        self.stdout.write('=' * 64 + '\n')
+        if mismatches or wrong:
+            raise CommandError('Los mapas de ocupación no coinciden con las citas; ejecute rebuild_occupancy.')
+
+    def _probes(self, expected, probes):
+        """Horarios al azar en días con citas: bits guardados frente a la consulta por índice."""
+        if not expected or probes < 1:
+            return 0
+        rng = random.Random(1)
+        keys = sorted(expected)
+        samples = []
+        for _ in range(probes):
+            user_id, day = rng.choice(keys)
+            start = rng.randrange(7 * 60, 20 * 60, rng.choice((5, 15)))
+            samples.append((user_id, day, start, start + rng.choice((10, 15, 30, 45, 60))))
+
+        wrong = undecided = 0
+        bitmap_time = table_time = 0.0
+        for user_id, day, start, end in samples:
+            start, end = _at(start), _at(end)
+            began = time.perf_counter()
+            free = occupancy.is_free(user_id, day, start, end)
+            bitmap_time += time.perf_counter() - began
+            began = time.perf_counter()
+            busy = overlapping(user_id, day, start, end).exists()
+            table_time += time.perf_counter() - began
+            if free is None:
+                undecided += 1
+            elif free == busy:
+                wrong += 1
+                if wrong <= 10:
+                    self.stdout.write(f'  odontólogo {user_id}, {day} {start:%H:%M}-{end:%H:%M}: bits {free}, citas libre {not busy}')
+
+        style = self.style.ERROR if wrong else self.style.SUCCESS
+        self.stdout.write(style(f'Horarios probados: {len(samples)}  incorrectos: {wrong}  sin decidir (día no exacto): {undecided}'))
+        self.stdout.write(
+            f'Media por horario: bits {bitmap_time / len(samples) * 1000:.3f} ms, '
+            f'citas {table_time / len(samples) * 1000:.3f} ms'
+        )
+        return wrong
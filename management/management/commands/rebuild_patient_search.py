@@ -0,0 +1,18 @@
+"""
+Regenera el índice de búsqueda de texto completo de pacientes (FTS5).
+Uso: python manage.py rebuild_patient_search
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from management.search import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice FTS5 de búsqueda de pacientes'
+
+    def handle(self, *args, **kwargs):
+        count = rebuild()
+        if count is None:
+            raise CommandError('La base de datos no es SQLite con FTS5; la búsqueda usa icontains.')
+        self.stdout.write(self.style.SUCCESS(f'[OK] {count} pacientes indexados'))
@@ -0,0 +1,19 @@
+"""
+Reconstruye los agregados de ingresos (diarios, semanales y mensuales).
+Uso: python manage.py rebuild_revenue_rollups
+"""
+
+from django.core.management.base import BaseCommand
+
+from management.models import Payment
+from management.revenue import rebuild_revenue_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los agregados de ingresos por periodo, método de pago y odontólogo'
+
+    def handle(self, *args, **kwargs):
+        created = rebuild_revenue_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] {created} agregados creados a partir de {Payment.objects.count()} pagos'
+        ))
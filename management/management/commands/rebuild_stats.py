@@ -0,0 +1,22 @@
+"""
+Reconstruye la instantánea de estadísticas del dashboard.
+Uso: python manage.py rebuild_stats
+"""
+
+from django.core.management.base import BaseCommand
+
+from management.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Recalcula desde cero las estadísticas del dashboard (ClinicStats)'
+
+    def handle(self, *args, **kwargs):
+        stats = rebuild_stats()
+
+        self.stdout.write(self.style.SUCCESS('[OK] Estadisticas reconstruidas'))
+        self.stdout.write(f'Pacientes: {stats.total_patients}')
+        self.stdout.write(f'Consultas: {stats.total_consultations}')
+        self.stdout.write(f'Procedimientos aplicados: {stats.total_procedures}')
+        self.stdout.write(f'Ingresos del mes: {stats.monthly_income}')
+        self.stdout.write(f'Consultas con saldo pendiente: {stats.pending_balance_count}')
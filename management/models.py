@@ -15,8 +15,24 @@ class Patient(models.Model):
     gender = models.CharField(max_length=1, choices=(('M', 'Masculino'), ('F', 'Femenino'), ('O', 'Otro')), default='M')
     date_of_birth = models.DateField()
     phone_number = models.CharField(max_length=20, blank=True, null=True)
+    # Destinatario de los recordatorios de citas (ver reminders.py)
+    email = models.EmailField(blank=True, null=True)
     address = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Marca de agua de la exportación incremental (ver export.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Clave de bloque para detectar duplicados (apellido normalizado + año de nacimiento)
+    duplicate_key = models.CharField(max_length=48, blank=True, default='', db_index=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        """Mantiene la clave de bloque de duplicados al día."""
+        from .duplicates import blocking_key
+
+        self.duplicate_key = blocking_key(self.paternal_surname, self.date_of_birth)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'paternal_surname', 'date_of_birth'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'duplicate_key'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         # CORREGIDO: usar los campos correctos
@@ -27,6 +43,10 @@ class Patient(models.Model):
         verbose_name = "Paciente"
         verbose_name_plural = "Pacientes"
         ordering = ['paternal_surname', 'first_name']
+        indexes = [
+            # Paginación por cursor del listado de pacientes
+            models.Index(fields=['paternal_surname', 'first_name', 'id'], name='patient_name_keyset_idx'),
+        ]
 
 
 class ClinicalHistory(models.Model):
@@ -44,6 +64,10 @@ class ClinicalHistory(models.Model):
     emergency_contact_phone = models.CharField(max_length=25, null=True, blank=True)
     blood_type = models.CharField(max_length=5, null=True, blank=True)
     oral_health_observations = models.TextField(null=True, blank=True)
+    # Estado de los dientes ADA 1-32, un carácter por diente (ver odontogram.py)
+    odontogram = models.CharField(max_length=32, default='S' * 32, editable=False)
+    # Marca de agua de la exportación incremental; también cambia con el estado de los dientes
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Historia de {self.patient}"
@@ -107,6 +131,11 @@ class Consultation(models.Model):
     reason = models.TextField(verbose_name="Motivo de la consulta")
     notes = models.TextField(blank=True, null=True, verbose_name="Notas de la exploración")
     total_cost = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    # Desnormalizados: se actualizan con update_payment_totals() al crear/borrar pagos
+    amount_paid = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    balance = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    # Marca de agua de la exportación incremental (ver export.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Consulta de {self.patient} - {self.date.strftime('%Y-%m-%d')}"
@@ -115,6 +144,39 @@ class Consultation(models.Model):
         verbose_name = "Consulta"
         verbose_name_plural = "Consultas"
         ordering = ['-date']
+        indexes = [
+            # Consultas con saldo pendiente: recorrido del índice en lugar de GROUP BY sobre pagos
+            models.Index(fields=['balance', '-date'], name='consultation_balance_idx'),
+            # Línea de tiempo del paciente
+            models.Index(fields=['patient', '-date', '-id'], name='consultation_patient_date_idx'),
+            # Productividad diaria por odontólogo
+            models.Index(fields=['user', 'date'], name='consultation_user_date_idx'),
+            # Paginación por cursor del listado de consultas
+            models.Index(fields=['-date', '-id'], name='consultation_date_keyset_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Mantiene el saldo sincronizado con el costo total y lo pagado.
+        Al actualizar nunca escribe amount_paid (lo mantiene update_payment_totals):
+        el saldo se calcula en SQL con lo pagado que hay en la base, no con el
+        valor leído al inicio de la petición.
+        """
+        if self._state.adding:
+            self.balance = self.total_cost - self.amount_paid
+            super().save(*args, **kwargs)
+            return
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            update_fields = {field.name for field in self._meta.concrete_fields if not field.primary_key}
+        update_fields = set(update_fields) - {'amount_paid', 'balance'}
+        if 'total_cost' in update_fields:
+            update_fields.add('balance')
+            self.balance = self.total_cost - models.F('amount_paid')
+        kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        if 'balance' in update_fields:
+            self.refresh_from_db(fields=['amount_paid', 'balance'])
 
     def calculate_total_cost(self):
         """Calcula el costo total de los procedimientos en esta consulta."""
@@ -124,18 +186,53 @@ class Consultation(models.Model):
         return total
 
     def get_balance(self):
-        """Calcula el saldo pendiente (costo total - pagos realizados)."""
-        total_paid = self.payments.aggregate(
+        """Saldo pendiente (costo total - pagos realizados)."""
+        return self.balance
+
+    def update_payment_totals(self):
+        """
+        Recalcula lo pagado y el saldo a partir de los pagos y los guarda con un
+        UPDATE directo. Llamar dentro de la transacción que crea o borra el pago.
+        """
+        self.amount_paid = self.payments.aggregate(
             total=models.Sum('amount')
         )['total'] or Decimal('0.00')
-        return self.total_cost - total_paid
+        Consultation.objects.filter(pk=self.pk).update(
+            amount_paid=self.amount_paid,
+            balance=models.F('total_cost') - self.amount_paid,
+            updated_at=timezone.now(),
+        )
+        self.balance = self.total_cost - self.amount_paid
 
 
 class Procedure(models.Model):
     """Catálogo de posibles procedimientos dentales."""
+    SCOPE_CHOICES = [
+        ('T', 'Diente'),
+        ('Q', 'Cuadrante'),
+        ('A', 'Arcada'),
+        ('M', 'Boca completa'),
+    ]
+
     name = models.CharField(max_length=150, unique=True)
     description = models.TextField(blank=True)
     base_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Efecto sobre el odontograma al aplicarlo (ver procedure_effects.py)
+    resulting_status = models.CharField(
+        max_length=1,
+        choices=Tooth.STATUS_CHOICES,
+        blank=True,
+        default='P',
+        help_text="Estado en que queda el diente. Vacío: no cambia el odontograma."
+    )
+    effect_scope = models.CharField(
+        max_length=1,
+        choices=SCOPE_CHOICES,
+        default='T',
+        help_text="Dientes a los que se aplica el estado (los extraídos no cambian salvo en alcance Diente)."
+    )
+    # Versión del catálogo para la tabla de efectos de cada proceso (ver procedure_effects.py)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -165,6 +262,8 @@ class ToothProcedure(models.Model):
     price_charged = models.DecimalField(max_digits=10, decimal_places=2)
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Marca de agua de la exportación incremental (ver export.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.procedure.name} en diente {self.tooth.number_ada}"
@@ -173,6 +272,10 @@ class ToothProcedure(models.Model):
         verbose_name = "Procedimiento en Diente"
         verbose_name_plural = "Procedimientos en Dientes"
         ordering = ['-created_at']
+        indexes = [
+            # Línea de tiempo del paciente: procedimientos de sus consultas, recientes primero
+            models.Index(fields=['consultation', '-created_at', '-id'], name='toothproc_consult_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         """Al guardar, si no se especifica precio, usar el precio base del procedimiento."""
@@ -181,6 +284,51 @@ class ToothProcedure(models.Model):
         super().save(*args, **kwargs)
 
 
+class OdontogramSnapshot(models.Model):
+    """
+    Historial del odontograma de un paciente. Los registros de tipo delta
+    guardan los dientes que cambiaron en una consulta; cada cierto número de
+    deltas se guarda un checkpoint con los 32 estados, de modo que el
+    odontograma en cualquier fecha es un checkpoint más unos pocos deltas
+    (ver odontogram_history.py).
+    """
+    KIND_CHOICES = [
+        ('D', 'Cambios'),
+        ('C', 'Checkpoint'),
+    ]
+
+    history = models.ForeignKey(
+        ClinicalHistory,
+        on_delete=models.CASCADE,
+        related_name='odontogram_snapshots'
+    )
+    # Consulta en la que se hicieron los cambios (vacía si se editó fuera de una consulta)
+    consultation = models.ForeignKey(
+        Consultation,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='odontogram_snapshots'
+    )
+    sequence = models.PositiveIntegerField()
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    # Checkpoint: 32 estados. Delta: número ADA de dos dígitos + estado por diente ("05E12O")
+    state = models.CharField(max_length=96)
+    recorded_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.sequence} - {self.history.patient}"
+
+    class Meta:
+        verbose_name = "Versión de Odontograma"
+        verbose_name_plural = "Versiones de Odontograma"
+        ordering = ['history', 'sequence']
+        unique_together = [['history', 'sequence']]
+        indexes = [
+            models.Index(fields=['history', 'kind', '-recorded_at'], name='odontogram_snapshot_kind_idx'),
+        ]
+
+
 # --- Pagos ---
 
 class Payment(models.Model):
@@ -199,6 +347,8 @@ class Payment(models.Model):
         ('R', 'Transferencia'),
     ]
     method = models.CharField(max_length=1, choices=METHOD_CHOICES, default='E')
+    # Marca de agua de la exportación incremental (ver export.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Pago de ${self.amount} para {self.consultation.patient} - {self.payment_date.strftime('%Y-%m-%d')}"
@@ -207,6 +357,50 @@ class Payment(models.Model):
         verbose_name = "Pago"
         verbose_name_plural = "Pagos"
         ordering = ['-payment_date']
+        indexes = [
+            models.Index(fields=['payment_date'], name='payment_date_idx'),
+            # Línea de tiempo del paciente: pagos de sus consultas, recientes primero
+            models.Index(fields=['consultation', '-payment_date', '-id'], name='payment_consult_date_idx'),
+        ]
+
+
+class RevenueRollup(models.Model):
+    """
+    Ingresos agregados por periodo (día, semana o mes), método de pago y
+    odontólogo. Se actualiza desde signals.py al escribir pagos y se puede
+    reconstruir con `python manage.py rebuild_revenue_rollups`.
+    """
+    PERIOD_CHOICES = [
+        ('D', 'Diario'),
+        ('W', 'Semanal'),
+        ('M', 'Mensual'),
+    ]
+
+    period = models.CharField(max_length=1, choices=PERIOD_CHOICES)
+    # Primer día del periodo (el lunes para las semanas)
+    period_start = models.DateField()
+    method = models.CharField(max_length=1, choices=Payment.METHOD_CHOICES)
+    # Odontólogo de la consulta pagada
+    user = models.ForeignKey(
+        User,
+        # Antes de borrar al usuario sus filas pasan a user=NULL (signals.py)
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='revenue_rollups'
+    )
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    payment_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.get_period_display()} {self.period_start} ({self.get_method_display()}): ${self.total}"
+
+    class Meta:
+        verbose_name = "Ingreso Agregado"
+        verbose_name_plural = "Ingresos Agregados"
+        ordering = ['period', 'period_start']
+        # El índice único también sirve para los rangos (period, period_start)
+        unique_together = [['period', 'period_start', 'method', 'user']]
 
 
 # --- Citas / Agendamiento ---
@@ -249,12 +443,29 @@ class Appointment(models.Model):
         related_name='appointment'
     )
     
+    # Ocurrencia de una serie guardada al editarla, confirmarla, atenderla o cancelarla
+    series = models.ForeignKey(
+        'AppointmentSeries',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='appointments'
+    )
+    occurrence_date = models.DateField(null=True, blank=True, editable=False)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.patient} - {self.date} {self.start_time}"
     
+    def get_absolute_url(self):
+        """Detalle de la cita; las ocurrencias sin guardar de una serie tienen su propia URL."""
+        from django.urls import reverse
+        if self.pk is None and self.series_id:
+            return reverse('appointment_occurrence', args=[self.series_id, self.occurrence_date.isoformat()])
+        return reverse('appointment_detail', args=[self.pk])
+    
     def duration_minutes(self):
         """Calcula la duración de la cita en minutos."""
         from datetime import datetime, timedelta
@@ -267,4 +478,230 @@ class Appointment(models.Model):
         verbose_name = "Cita"
         verbose_name_plural = "Citas"
         ordering = ['date', 'start_time']
-        unique_together = [['date', 'start_time', 'user']]  # Evita citas duplicadas en el mismo horario
\ No newline at end of file
+        unique_together = [['date', 'start_time', 'user']]  # Evita citas duplicadas en el mismo horario
+        indexes = [
+            # Agenda del odontólogo y detección de solapamientos (ver scheduling.py)
+            models.Index(fields=['user', 'date', 'start_time', 'end_time'], name='appointment_overlap_idx'),
+            models.Index(fields=['patient', '-date', '-start_time', '-id'], name='appointment_patient_date_idx'),
+            # Recordatorios: citas de las próximas horas por cursor (ver reminders.py)
+            models.Index(fields=['date', 'start_time', 'id'], name='appointment_date_start_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['series', 'occurrence_date'], name='appointment_series_occurrence_unique'),
+        ]
+
+
+class AppointmentSeries(models.Model):
+    """
+    Citas periódicas (p. ej. control de ortodoncia cada 4 semanas). Las
+    ocurrencias se calculan solo para el rango que se consulta (ver
+    recurrence.py); se guardan como Appointment al editarlas, confirmarlas,
+    atenderlas o cancelarlas.
+    """
+    FREQUENCY_CHOICES = [
+        ('D', 'Diaria'),
+        ('W', 'Semanal'),
+        ('M', 'Mensual'),
+    ]
+
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.CASCADE,
+        related_name='appointment_series'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='appointment_series'
+    )
+    start_date = models.DateField(verbose_name="Primera cita")
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    reason = models.CharField(max_length=200)
+    notes = models.TextField(blank=True, null=True)
+
+    frequency = models.CharField(max_length=1, choices=FREQUENCY_CHOICES, default='W')
+    interval = models.PositiveSmallIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        help_text="Cada cuántos días, semanas o meses."
+    )
+    count = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(1)],
+        verbose_name="Número de citas"
+    )
+    until = models.DateField(null=True, blank=True, verbose_name="Hasta")
+    # Fechas sin cita (AAAA-MM-DD), como EXDATE en iCalendar
+    excluded_dates = models.JSONField(default=list, blank=True)
+    # Última ocurrencia (None si la serie no termina); se calcula al guardar
+    last_date = models.DateField(null=True, blank=True, editable=False)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        from .recurrence import last_occurrence
+
+        self.last_date = last_occurrence(self)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.patient} - {self.get_frequency_display()} desde {self.start_date}"
+
+    def rule_display(self):
+        """Regla en texto, p. ej. "Cada 4 semanas, 12 citas"."""
+        singular, plural = {'D': ('día', 'días'), 'W': ('semana', 'semanas'), 'M': ('mes', 'meses')}[self.frequency]
+        text = f"Cada {singular}" if self.interval == 1 else f"Cada {self.interval} {plural}"
+        if self.count:
+            text += f", {self.count} citas"
+        elif self.until:
+            text += f", hasta el {self.until:%d/%m/%Y}"
+        return text
+
+    class Meta:
+        verbose_name = "Serie de Citas"
+        verbose_name_plural = "Series de Citas"
+        ordering = ['start_date', 'start_time']
+        indexes = [
+            # Series activas en un rango para un odontólogo
+            models.Index(fields=['user', 'start_date', 'last_date'], name='series_user_range_idx'),
+        ]
+
+
+class AppointmentReminder(models.Model):
+    """
+    Registro de recordatorios de citas. La clave identifica la cita (o la
+    ocurrencia de la serie) y su horario, así que volver a ejecutar el envío
+    no repite recordatorios y una cita movida recibe uno nuevo.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    patient = models.ForeignKey(
+        Patient,
+        on_delete=models.CASCADE,
+        related_name='reminders'
+    )
+    appointment = models.ForeignKey(
+        Appointment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reminders'
+    )
+    series = models.ForeignKey(
+        AppointmentSeries,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reminders'
+    )
+    date = models.DateField()
+    start_time = models.TimeField()
+    recipient = models.EmailField()
+    backend = models.CharField(max_length=100)
+    # Ejecución que reservó el envío (ver reminders.py)
+    run = models.CharField(max_length=32, editable=False)
+    claimed_at = models.DateTimeField(auto_now_add=True)
+    # None mientras el envío está reservado y aún no confirmado
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.patient} - {self.date} {self.start_time}"
+
+    class Meta:
+        verbose_name = "Recordatorio de Cita"
+        verbose_name_plural = "Recordatorios de Citas"
+        ordering = ['-claimed_at']
+
+
+class DentistDayOccupancy(models.Model):
+    """
+    Agenda ocupada de un odontólogo en un día, un bit por franja de 5 minutos
+    (ver occupancy.py). Se recalcula el día afectado en cada escritura de
+    citas (signals.py) y se reconstruye con `python manage.py rebuild_occupancy`.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='occupancy'
+    )
+    day = models.DateField()
+    # 288 bits (bit n = minutos 5n a 5n+5) en hexadecimal
+    bitmap = models.CharField(max_length=72)
+    # Citas alineadas a 5 minutos y sin solaparse: los bits responden sin leer las citas
+    exact = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.user} - {self.day}"
+
+    class Meta:
+        verbose_name = "Ocupación Diaria"
+        verbose_name_plural = "Ocupación Diaria"
+        ordering = ['day', 'user']
+        unique_together = [['user', 'day']]
+
+
+# --- Productividad por odontólogo ---
+
+class DentistDailyStats(models.Model):
+    """
+    Productividad diaria de un odontólogo. Se recalcula el día afectado en cada
+    escritura (signals.py) y se reconstruye con `python manage.py rebuild_dentist_stats`.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='daily_stats'
+    )
+    day = models.DateField()
+    consultations = models.PositiveIntegerField(default=0)
+    procedures = models.PositiveIntegerField(default=0)
+    billed = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    collected = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    appointments = models.PositiveIntegerField(default=0)
+    appointments_attended = models.PositiveIntegerField(default=0)
+    appointments_cancelled = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} - {self.day}"
+
+    class Meta:
+        verbose_name = "Productividad Diaria"
+        verbose_name_plural = "Productividad Diaria"
+        ordering = ['day', 'user']
+        unique_together = [['user', 'day']]
+        indexes = [
+            models.Index(fields=['day'], name='dentist_stats_day_idx'),
+        ]
+
+# --- Estadísticas ---
+
+class ClinicStats(models.Model):
+    """
+    Instantánea de las estadísticas del dashboard (fila única, pk=1).
+
+    Se mantiene incrementalmente desde signals.py en la misma transacción que
+    las escrituras de Patient, Consultation, ToothProcedure y Payment, para que
+    el dashboard no tenga que recorrer las tablas completas en cada carga.
+    Se puede reconstruir con `python manage.py rebuild_stats`.
+    """
+    SINGLETON_PK = 1
+
+    total_patients = models.PositiveIntegerField(default=0)
+    total_consultations = models.PositiveIntegerField(default=0)
+    total_procedures = models.PositiveIntegerField(default=0)
+    # Ingresos acumulados del mes indicado en income_month (primer día del mes)
+    monthly_income = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    income_month = models.DateField(null=True, blank=True)
+    # Consultas con costo y saldo pendiente
+    pending_balance_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Estadísticas ({self.updated_at:%Y-%m-%d %H:%M})"
+
+    class Meta:
+        verbose_name = "Estadísticas de la Clínica"
+        verbose_name_plural = "Estadísticas de la Clínica"
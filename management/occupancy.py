@@ -0,0 +1,215 @@
+"""
+Mapa de ocupación de la agenda.
+
+Cada fila DentistDayOccupancy guarda el día de un odontólogo como un entero
+de 288 bits: el bit n está encendido si alguna cita activa (no cancelada)
+ocupa parte de los minutos [5n, 5n + 5). Así, saber si un horario está libre
+es un AND con la máscara del horario, los huecos del día son las rachas de
+ceros y la ocupación es contar bits.
+
+Las citas que no empiezan o terminan en múltiplo de 5 minutos se redondean
+hacia afuera, de modo que los bits cubren al menos el tiempo ocupado. Si
+todas las citas del día están alineadas y no se solapan entre sí (`exact`),
+cada bit pertenece a una sola cita y las respuestas son exactas; si no, un
+AND vacío sigue probando que el horario está libre, pero los choques y los
+huecos se comprueban con las citas (ver scheduling.py).
+
+Las ocurrencias de series sin fila propia no están en la tabla; `states` las
+suma al leer un rango.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+
+from . import recurrence
+from .models import Appointment, DentistDayOccupancy
+
+SLOT = 5
+SLOTS = 24 * 60 // SLOT
+CANCELLED = 'X'
+# (bitmap, exact) de un día sin citas
+EMPTY = (0, True)
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def mask(start, end):
+    """Bits de los minutos [start, end), redondeados hacia afuera a franjas de SLOT."""
+    first = max(start, 0) // SLOT
+    last = min(-(-end // SLOT), SLOTS)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def time_mask(start_time, end_time):
+    return mask(_minutes(start_time), _minutes(end_time))
+
+
+def encode(bitmap):
+    return f'{bitmap:0{SLOTS // 4}x}'
+
+
+def decode(value):
+    return int(value, 16)
+
+
+def add(state, start_time, end_time):
+    """Estado (bitmap, exact) tras sumar la cita [start_time, end_time)."""
+    bitmap, exact = state
+    bits = time_mask(start_time, end_time)
+    aligned = _minutes(start_time) % SLOT == 0 and _minutes(end_time) % SLOT == 0
+    return bitmap | bits, exact and aligned and not bitmap & bits
+
+
+def compute_day(user_id, day):
+    """(bitmap, exact) de un odontólogo en un día desde la tabla de citas."""
+    state = EMPTY
+    for start_time, end_time in Appointment.objects.filter(user_id=user_id, date=day).exclude(
+        status=CANCELLED
+    ).values_list('start_time', 'end_time'):
+        state = add(state, start_time, end_time)
+    return state
+
+
+def refresh_day(user_id, day):
+    """Recalcula (o elimina si quedó vacía) la fila de un odontólogo y día."""
+    bitmap, exact = compute_day(user_id, day)
+    if not bitmap:
+        DentistDayOccupancy.objects.filter(user_id=user_id, day=day).delete()
+        return
+    DentistDayOccupancy.objects.update_or_create(
+        user_id=user_id, day=day, defaults={'bitmap': encode(bitmap), 'exact': exact}
+    )
+
+
+def refresh_days(pairs):
+    """Recalcula cada par (user_id, día) distinto, ignorando los que no tienen odontólogo."""
+    with transaction.atomic():
+        for user_id, day in set(pairs):
+            if user_id is not None and day is not None:
+                refresh_day(user_id, day)
+
+
+def compute_all(since=None):
+    """{(odontólogo, día): (bitmap, exact)} de todas las citas (desde `since`), con una consulta."""
+    rows = Appointment.objects.exclude(user=None).exclude(status=CANCELLED)
+    if since:
+        rows = rows.filter(date__gte=since)
+    states = {}
+    for user_id, day, start_time, end_time in rows.order_by().values_list(
+        'user_id', 'date', 'start_time', 'end_time'
+    ).iterator(chunk_size=5000):
+        states[(user_id, day)] = add(states.get((user_id, day), EMPTY), start_time, end_time)
+    return states
+
+
+def rebuild(since=None):
+    """Reconstruye las filas (desde `since`, o todas) a partir de las citas."""
+    states = compute_all(since)
+    with transaction.atomic():
+        rows = DentistDayOccupancy.objects.all()
+        if since:
+            rows = rows.filter(day__gte=since)
+        rows.delete()
+        DentistDayOccupancy.objects.bulk_create([
+            DentistDayOccupancy(user_id=user_id, day=day, bitmap=encode(bitmap), exact=exact)
+            for (user_id, day), (bitmap, exact) in states.items()
+        ], batch_size=1000)
+    return len(states)
+
+
+def stored(user_ids, start, end):
+    """{(odontólogo, día): (bitmap, exact)} guardados entre start y end."""
+    rows = DentistDayOccupancy.objects.filter(day__gte=start, day__lte=end)
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    return {
+        (user_id, day): (decode(bitmap), exact)
+        for user_id, day, bitmap, exact in rows.values_list('user_id', 'day', 'bitmap', 'exact')
+    }
+
+
+def states(user_ids, start, end):
+    """Como `stored`, más las ocurrencias de series sin fila propia del rango."""
+    result = stored(user_ids, start, end)
+    series = recurrence.active_series(start, end, user_ids).select_related('patient')
+    for occurrence in recurrence.expand(start, end, series=list(series)):
+        key = (occurrence.user_id, occurrence.date)
+        result[key] = add(result.get(key, EMPTY), occurrence.start_time, occurrence.end_time)
+    return result
+
+
+def is_free(user_id, day, start_time, end_time, exclude_pk=None):
+    """
+    True si [start_time, end_time) está libre en la agenda guardada del
+    odontólogo, False si choca con otra cita y None si el día no es exacto y
+    hay que comprobarlo con las citas. `exclude_pk` es la cita que se edita.
+    """
+    row = DentistDayOccupancy.objects.filter(user_id=user_id, day=day).values_list('bitmap', 'exact').first()
+    if row is None:
+        return True
+    bitmap, exact = decode(row[0]), row[1]
+    bits = time_mask(start_time, end_time)
+    if not bitmap & bits:
+        return True
+    if not exact:
+        return None
+    if exclude_pk is not None:
+        # En un día exacto los bits de la cita editada son solo suyos
+        own = Appointment.objects.filter(pk=exclude_pk, user_id=user_id, date=day).exclude(
+            status=CANCELLED
+        ).values_list('start_time', 'end_time').first()
+        if own:
+            bitmap &= ~time_mask(*own)
+    return not bitmap & bits
+
+
+def free_runs(bitmap, opening, closing):
+    """Huecos [inicio, fin) en minutos entre opening y closing sin bits encendidos."""
+    free = ~bitmap & mask(opening, closing)
+    while free:
+        low = (free & -free).bit_length() - 1
+        shifted = free >> low
+        length = (shifted ^ (shifted + 1)).bit_length() - 1
+        yield max(low * SLOT, opening), min((low + length) * SLOT, closing)
+        free &= ~(((1 << length) - 1) << low)
+
+
+def busy_minutes(bitmap, opening, closing):
+    return (bitmap & mask(opening, closing)).bit_count() * SLOT
+
+
+def utilisation(user_ids, start, end, hours=None):
+    """
+    {odontólogo: {busy_minutes, open_minutes, utilisation, days}} dentro del
+    horario de atención entre start y end, incluidas las ocurrencias de
+    series. En los días no exactos las citas cuentan redondeadas a 5 minutos.
+    """
+    first_hour, last_hour = hours or getattr(settings, 'AGENDA_HOURS', (8, 18))
+    opening, closing = first_hour * 60, last_hour * 60
+    day_states = states(user_ids, start, end)
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    result = {}
+    for user_id in user_ids:
+        per_day = []
+        for day in days:
+            busy = busy_minutes(day_states.get((user_id, day), EMPTY)[0], opening, closing)
+            per_day.append({
+                'date': day,
+                'busy_minutes': busy,
+                'utilisation': round(busy / (closing - opening), 4),
+            })
+        total = sum(item['busy_minutes'] for item in per_day)
+        open_minutes = (closing - opening) * len(days)
+        result[user_id] = {
+            'busy_minutes': total,
+            'open_minutes': open_minutes,
+            'utilisation': round(total / open_minutes, 4) if open_minutes else None,
+            'days': per_day,
+        }
+    return result
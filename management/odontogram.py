@@ -0,0 +1,157 @@
+"""
+Odontograma empaquetado.
+
+ClinicalHistory.odontogram guarda el estado de los 32 dientes ADA como una
+cadena de 32 caracteres (posición n-1 = diente n), y los signals la mantienen
+al día cada vez que se guarda un Tooth. Con settings.ODONTOGRAM_STORAGE =
+'packed' las vistas leen el odontograma de esa columna y las filas Tooth solo
+se crean cuando un procedimiento se aplica al diente; con 'rows' (por
+defecto) se conservan las 32 filas por paciente. `migrate_odontogram` pasa
+los datos de un modo al otro.
+"""
+
+from dataclasses import dataclass
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ClinicalHistory, Tooth
+
+TEETH = range(1, 33)
+DEFAULT = 'S' * 32
+STATUS_LABELS = dict(Tooth.STATUS_CHOICES)
+
+
+def is_packed():
+    return getattr(settings, 'ODONTOGRAM_STORAGE', 'rows') == 'packed'
+
+
+@dataclass(frozen=True)
+class ToothState:
+    """Diente leído de la cadena empaquetada (misma interfaz que Tooth en las plantillas)."""
+    number_ada: int
+    status: str
+
+    def get_status_display(self):
+        return STATUS_LABELS.get(self.status, self.status)
+
+
+def _chars(odontogram):
+    return list((odontogram or DEFAULT).ljust(32, 'S')[:32])
+
+
+def unpack(odontogram):
+    chars = _chars(odontogram)
+    return [ToothState(number, chars[number - 1]) for number in TEETH]
+
+
+def pack(teeth):
+    """Cadena a partir de pares (número ADA, estado); los que falten quedan sanos."""
+    chars = _chars(DEFAULT)
+    for number, status in teeth:
+        chars[number - 1] = status
+    return ''.join(chars)
+
+
+def teeth_for(history):
+    """Los 32 dientes del odontograma ordenados por número ADA, según el modo."""
+    if history is None:
+        return []
+    if is_packed():
+        return unpack(history.odontogram)
+    return list(history.teeth.order_by('number_ada'))
+
+
+def set_status(history_id, number, status):
+    """Cambia el carácter de un diente en la cadena empaquetada. Devuelve el estado anterior."""
+    with transaction.atomic():
+        current = ClinicalHistory.objects.select_for_update().filter(
+            pk=history_id
+        ).values_list('odontogram', flat=True).first()
+        if current is None:
+            return None
+        chars = _chars(current)
+        previous = chars[number - 1]
+        if previous != status:
+            chars[number - 1] = status
+            ClinicalHistory.objects.filter(pk=history_id).update(
+                odontogram=''.join(chars), updated_at=timezone.now(),
+            )
+        return previous
+
+
+def get_tooth(history, number):
+    """Fila Tooth de un diente; si no existe se crea con el estado empaquetado."""
+    tooth, _ = Tooth.objects.get_or_create(
+        history=history,
+        number_ada=number,
+        defaults={'status': _chars(history.odontogram)[number - 1]},
+    )
+    return tooth
+
+
+def create_rows(history):
+    """Crea las filas Tooth que falten (modo 'rows') con el estado empaquetado."""
+    existing = set(history.teeth.values_list('number_ada', flat=True))
+    chars = _chars(history.odontogram)
+    Tooth.objects.bulk_create([
+        Tooth(history=history, number_ada=number, status=chars[number - 1])
+        for number in TEETH if number not in existing
+    ])
+    return 32 - len(existing)
+
+
+def to_packed(chunk_size=2000):
+    """
+    Empaqueta el estado de las filas Tooth en cada historia y borra las filas
+    que ningún procedimiento referencia. Devuelve (historias, filas borradas).
+    """
+    histories = 0
+    pending = []
+    rows = Tooth.objects.order_by('history_id', 'number_ada').values_list(
+        'history_id', 'number_ada', 'status'
+    ).iterator(chunk_size=chunk_size)
+    with transaction.atomic():
+        for history_id, teeth in groupby(rows, key=lambda row: row[0]):
+            pending.append(ClinicalHistory(pk=history_id, odontogram=pack(
+                (number, status) for _, number, status in teeth
+            )))
+            if len(pending) >= chunk_size:
+                ClinicalHistory.objects.bulk_update(pending, ['odontogram'])
+                histories += len(pending)
+                pending = []
+        if pending:
+            ClinicalHistory.objects.bulk_update(pending, ['odontogram'])
+            histories += len(pending)
+        deleted, _ = Tooth.objects.filter(procedures_applied__isnull=True).delete()
+    return histories, deleted
+
+
+def to_rows(chunk_size=2000):
+    """Crea las filas Tooth que falten a partir de la cadena empaquetada. Devuelve cuántas."""
+    existing = {}
+    for history_id, number in Tooth.objects.values_list('history_id', 'number_ada').iterator(chunk_size=chunk_size):
+        existing.setdefault(history_id, set()).add(number)
+
+    created = 0
+    batch = []
+    with transaction.atomic():
+        for history_id, odontogram in ClinicalHistory.objects.order_by('pk').values_list(
+            'pk', 'odontogram'
+        ).iterator(chunk_size=chunk_size):
+            chars = _chars(odontogram)
+            present = existing.get(history_id, ())
+            batch.extend(
+                Tooth(history_id=history_id, number_ada=number, status=chars[number - 1])
+                for number in TEETH if number not in present
+            )
+            if len(batch) >= chunk_size:
+                Tooth.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        if batch:
+            Tooth.objects.bulk_create(batch)
+            created += len(batch)
+    return created
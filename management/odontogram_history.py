@@ -0,0 +1,126 @@
+"""
+Historial versionado del odontograma.
+
+Cada cambio de estado de un diente se anota en un registro delta de la
+consulta en curso (los cambios de una misma consulta se agrupan en un solo
+registro) y, cada CHECKPOINT_EVERY deltas, se guarda un checkpoint con los 32
+estados. Reconstruir el odontograma en una fecha lee el último checkpoint
+anterior y aplica los deltas posteriores: como mucho CHECKPOINT_EVERY filas,
+sin recorrer todos los procedimientos del paciente.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import odontogram
+from .models import ClinicalHistory, OdontogramSnapshot
+
+CHECKPOINT_EVERY = 10
+
+DELTA = 'D'
+CHECKPOINT = 'C'
+
+
+def encode_changes(changes):
+    """{número ADA: estado} → "05E12O"."""
+    return ''.join(f'{number:02d}{status}' for number, status in sorted(changes.items()))
+
+
+def decode_changes(text):
+    return {int(text[i:i + 2]): text[i + 2] for i in range(0, len(text), 3)}
+
+
+def _current_state(history):
+    return odontogram.pack((tooth.number_ada, tooth.status) for tooth in odontogram.teeth_for(history))
+
+
+def record(history_id, number, previous, status, consultation_id=None, at=None):
+    """
+    Anota que el diente `number` pasó de `previous` a `status`. Se llama
+    después de guardar el diente, así que el estado actual ya lo incluye.
+    """
+    at = at or timezone.now()
+    with transaction.atomic():
+        # Bloquea la historia para numerar las versiones sin huecos ni duplicados
+        history = ClinicalHistory.objects.select_for_update().get(pk=history_id)
+        snapshots = OdontogramSnapshot.objects.filter(history=history)
+        last = snapshots.order_by('-sequence').first()
+
+        if last is None:
+            # Primer cambio registrado: checkpoint con el estado previo como base
+            chars = list(_current_state(history))
+            chars[number - 1] = previous
+            last = OdontogramSnapshot.objects.create(
+                history=history, sequence=1, kind=CHECKPOINT, state=''.join(chars), recorded_at=at,
+            )
+
+        if last.kind == DELTA and consultation_id is not None and last.consultation_id == consultation_id:
+            changes = decode_changes(last.state)
+            changes[number] = status
+            last.state = encode_changes(changes)
+            last.recorded_at = at
+            last.save(update_fields=['state', 'recorded_at'])
+            return last
+
+        delta = OdontogramSnapshot.objects.create(
+            history=history,
+            consultation_id=consultation_id,
+            sequence=last.sequence + 1,
+            kind=DELTA,
+            state=encode_changes({number: status}),
+            recorded_at=at,
+        )
+
+        checkpoint_sequence = snapshots.filter(kind=CHECKPOINT).order_by('-sequence').values_list(
+            'sequence', flat=True
+        ).first()
+        if delta.sequence - checkpoint_sequence >= CHECKPOINT_EVERY:
+            OdontogramSnapshot.objects.create(
+                history=history,
+                sequence=delta.sequence + 1,
+                kind=CHECKPOINT,
+                state=_current_state(history),
+                recorded_at=at,
+            )
+        return delta
+
+
+def state_at(history, at=None, sequence=None):
+    """
+    Cadena de 32 estados del odontograma en la fecha `at` o tras la versión
+    `sequence` (sin ninguno de los dos, el último estado registrado).
+    """
+    snapshots = OdontogramSnapshot.objects.filter(history=history)
+    bounded = snapshots
+    if sequence is not None:
+        bounded = bounded.filter(sequence__lte=sequence)
+    elif at is not None:
+        bounded = bounded.filter(recorded_at__lte=at)
+
+    checkpoint = bounded.filter(kind=CHECKPOINT).order_by('-sequence').only('sequence', 'state').first()
+    if checkpoint is None:
+        # Antes del primer cambio registrado vale el checkpoint base; sin historial, el estado actual
+        first = snapshots.filter(kind=CHECKPOINT).order_by('sequence').only('state').first()
+        return first.state if first else _current_state(history)
+
+    chars = list(checkpoint.state)
+    for changes in bounded.filter(kind=DELTA, sequence__gt=checkpoint.sequence).order_by(
+        'sequence'
+    ).values_list('state', flat=True):
+        for number, status in decode_changes(changes).items():
+            chars[number - 1] = status
+    return ''.join(chars)
+
+
+def teeth_after_consultation(consultation):
+    """Los 32 dientes tal como quedaron al terminar la consulta."""
+    history = consultation.patient.history
+    sequence = OdontogramSnapshot.objects.filter(
+        history=history, consultation=consultation, kind=DELTA,
+    ).order_by('-sequence').values_list('sequence', flat=True).first()
+    if sequence is not None:
+        state = state_at(history, sequence=sequence)
+    else:
+        # La consulta no cambió dientes: el estado vigente en su fecha
+        state = state_at(history, at=consultation.date)
+    return odontogram.unpack(state)
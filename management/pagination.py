@@ -0,0 +1,158 @@
+"""
+Paginación por cursor (keyset) para los listados.
+
+En lugar de OFFSET, cada página continúa desde los valores de ordenamiento de
+la última fila mostrada, así que la página 1.000 cuesta lo mismo que la
+primera (una búsqueda en el índice compuesto y LIMIT). El cursor viaja en la
+query string como base64 de los valores de ordenamiento.
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from functools import cached_property
+
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+def encode_cursor(values):
+    payload = json.dumps([
+        {'dt': v.isoformat()} if isinstance(v, datetime)
+        else {'d': v.isoformat()} if isinstance(v, date)
+        else v
+        for v in values
+    ], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Valores del cursor, o None si no es válido."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    decoded = []
+    for value in values:
+        if isinstance(value, dict) and 'dt' in value:
+            value = parse_datetime(value['dt'])
+        elif isinstance(value, dict) and 'd' in value:
+            value = parse_date(value['d'])
+        if value is None or isinstance(value, (dict, list)):
+            return None
+        decoded.append(value)
+    return decoded
+
+
+class KeysetPage:
+    """Una página de resultados. Se evalúa al acceder a ella (p. ej. desde la plantilla)."""
+
+    def __init__(self, paginator, values, direction):
+        self.paginator = paginator
+        self.values = values
+        self.direction = direction
+
+    @cached_property
+    def _rows(self):
+        paginator = self.paginator
+        queryset = paginator.queryset
+        ordering = paginator.ordering
+        if self.direction == 'before':
+            # Se recorre hacia atrás y luego se invierte
+            ordering = [(field, not descending) for field, descending in ordering]
+        if self.values is not None:
+            queryset = queryset.filter(paginator.after_condition(ordering, self.values))
+        queryset = queryset.order_by(*[
+            f'-{field}' if descending else field for field, descending in ordering
+        ])
+        rows = list(queryset[:paginator.per_page + 1])
+        has_more = len(rows) > paginator.per_page
+        rows = rows[:paginator.per_page]
+        if self.direction == 'before':
+            rows.reverse()
+        return rows, has_more
+
+    @property
+    def object_list(self):
+        return self._rows[0]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        if self.direction == 'before':
+            return True
+        return self._rows[1]
+
+    @property
+    def has_previous(self):
+        if self.direction == 'before':
+            return self._rows[1]
+        return self.values is not None
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self.paginator.cursor_for(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return self.paginator.cursor_for(self.object_list[0])
+        return None
+
+
+class KeysetPaginator:
+    """
+    Paginador por cursor. `ordering` es la lista de campos como en order_by()
+    y debe terminar en un campo único (normalmente 'pk' o '-pk') para que el
+    orden sea total y los cursores estables.
+    """
+
+    def __init__(self, queryset, ordering, per_page=25):
+        self.queryset = queryset
+        self.ordering = [
+            (field[1:], True) if field.startswith('-') else (field, False)
+            for field in ordering
+        ]
+        self.per_page = per_page
+
+    def cursor_for(self, obj):
+        return encode_cursor([getattr(obj, field) for field, _ in self.ordering])
+
+    @staticmethod
+    def after_condition(ordering, values):
+        """
+        Filas estrictamente posteriores a `values` en `ordering`:
+        a > x OR (a = x AND b > y) OR ...  La condición redundante a >= x
+        permite que la base de datos empiece el recorrido del índice en el cursor.
+        """
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(ordering, values):
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        first_field, first_descending = ordering[0]
+        seek = Q(**{f"{first_field}__{'lte' if first_descending else 'gte'}": values[0]})
+        return seek & condition
+
+    def page(self, after=None, before=None):
+        """Página siguiente a `after`, anterior a `before`, o la primera."""
+        if before:
+            values = decode_cursor(before, len(self.ordering))
+            if values is not None:
+                return KeysetPage(self, values, 'before')
+        if after:
+            values = decode_cursor(after, len(self.ordering))
+            if values is not None:
+                return KeysetPage(self, values, 'after')
+        return KeysetPage(self, None, 'after')
@@ -0,0 +1,135 @@
+"""
+Análisis de precios cobrados frente al precio base del catálogo.
+
+Las columnas de ToothProcedure se leen con values_list a arreglos de NumPy y
+todas las estadísticas (media, varianza, percentiles de la razón
+cobrado/base) se calculan de forma vectorizada, por procedimiento, por
+odontólogo y por mes. El mes y el rango de fechas son los de la consulta en
+que se aplicó el procedimiento, como en los demás informes. NumPy es una
+dependencia opcional: `pip install numpy`.
+"""
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import DateField
+from django.db.models.functions import TruncMonth
+
+from .models import Procedure, ToothProcedure
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depende del entorno
+    np = None
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def require_numpy():
+    if np is None:
+        raise ImproperlyConfigured('El análisis de precios requiere NumPy (pip install numpy).')
+
+
+def load_arrays(start=None, end=None):
+    """
+    Carga los procedimientos aplicados como columnas NumPy: procedimiento,
+    odontólogo (-1 si no tiene), mes de la consulta, precio cobrado y precio base.
+    """
+    require_numpy()
+    queryset = ToothProcedure.objects.all()
+    if start:
+        queryset = queryset.filter(consultation__date__date__gte=start)
+    if end:
+        queryset = queryset.filter(consultation__date__date__lte=end)
+
+    rows = list(queryset.annotate(month=TruncMonth('consultation__date', output_field=DateField())).values_list(
+        'procedure_id', 'consultation__user_id', 'month', 'price_charged', 'procedure__base_price',
+    ).order_by())
+
+    if not rows:
+        return {
+            'procedure': np.empty(0, dtype=np.int64),
+            'dentist': np.empty(0, dtype=np.int64),
+            'month': np.empty(0, dtype='datetime64[M]'),
+            'charged': np.empty(0),
+            'base': np.empty(0),
+        }
+
+    procedure, dentist, month, charged, base = zip(*rows)
+    return {
+        'procedure': np.array(procedure, dtype=np.int64),
+        'dentist': np.array([d if d is not None else -1 for d in dentist], dtype=np.int64),
+        'month': np.array(month, dtype='datetime64[M]'),
+        'charged': np.array(charged, dtype=np.float64),
+        'base': np.array(base, dtype=np.float64),
+    }
+
+
+def summarize(ratio):
+    """Estadísticas de un arreglo de razones cobrado/base."""
+    if ratio.size == 0:
+        return {'count': 0}
+    percentiles = np.percentile(ratio, PERCENTILES)
+    return {
+        'count': int(ratio.size),
+        'mean': round(float(ratio.mean()), 4),
+        'variance': round(float(ratio.var()), 6),
+        'std': round(float(ratio.std()), 4),
+        'min': round(float(ratio.min()), 4),
+        'max': round(float(ratio.max()), 4),
+        'percentiles': {f'p{p}': round(float(v), 4) for p, v in zip(PERCENTILES, percentiles)},
+        # Proporción de procedimientos cobrados por debajo del precio base
+        'discounted_share': round(float((ratio < 1).mean()), 4),
+        'mean_discount_pct': round(float((1 - ratio).clip(min=0).mean() * 100), 2),
+    }
+
+
+def summarize_groups(keys, ratio):
+    """
+    Estadísticas por grupo sin recorrer filas en Python: se ordena una vez por
+    clave y cada grupo es un segmento contiguo del arreglo.
+    """
+    if ratio.size == 0:
+        return []
+    unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    order = np.argsort(inverse, kind='stable')
+    segments = np.split(ratio[order], np.cumsum(counts)[:-1])
+    return [(key, summarize(segment)) for key, segment in zip(unique, segments)]
+
+
+def pricing_analysis(start=None, end=None):
+    """Distribución de la razón cobrado/base global, por procedimiento, odontólogo y mes."""
+    arrays = load_arrays(start, end)
+
+    # Los procedimientos sin precio base no tienen razón definida
+    valid = arrays['base'] > 0
+    ratio = arrays['charged'][valid] / arrays['base'][valid]
+    procedure = arrays['procedure'][valid]
+    dentist = arrays['dentist'][valid]
+    month = arrays['month'][valid]
+
+    procedure_names = dict(Procedure.objects.filter(
+        pk__in=np.unique(procedure).tolist()
+    ).values_list('pk', 'name'))
+    dentist_names = dict(User.objects.filter(
+        pk__in=np.unique(dentist).tolist()
+    ).values_list('pk', 'username'))
+
+    return {
+        'overall': summarize(ratio),
+        'by_procedure': [
+            {'procedure_id': int(key), 'procedure': procedure_names.get(int(key)), **stats}
+            for key, stats in summarize_groups(procedure, ratio)
+        ],
+        'by_dentist': [
+            {
+                'dentist_id': int(key) if key >= 0 else None,
+                'dentist': dentist_names.get(int(key), 'Sin asignar'),
+                **stats,
+            }
+            for key, stats in summarize_groups(dentist, ratio)
+        ],
+        'by_month': [
+            {'month': str(key), **stats}
+            for key, stats in summarize_groups(month, ratio)
+        ],
+    }
@@ -0,0 +1,125 @@
+"""
+Efecto de cada procedimiento sobre el odontograma.
+
+Procedure.resulting_status y Procedure.effect_scope declaran en qué estado
+quedan los dientes al aplicar el procedimiento (antes se deducía buscando
+'extracción' o 'resina' en el nombre). La tabla {id: (estado, alcance)} se
+carga una vez por proceso y se recarga cuando cambia el catálogo: la versión
+es la última modificación y el número de procedimientos, leídos de la base de
+datos (una consulta agregada sobre una tabla pequeña), porque un cambio hecho
+en otro proceso debe aplicarse al odontograma que se guarda aquí.
+La usan tooth_procedure_create y ConsultationAdmin.save_formset.
+"""
+
+import threading
+
+from django.db.models import Count, Max
+
+from . import odontogram, odontogram_history
+from .models import ClinicalHistory, Procedure, Tooth
+
+QUADRANTS = (range(1, 9), range(9, 17), range(17, 25), range(25, 33))
+ARCHES = (range(1, 17), range(17, 33))
+
+_lock = threading.Lock()
+_table = None
+_version = None
+
+
+def get_table():
+    """{procedure_id: (estado resultante, alcance)} vigente."""
+    global _table, _version
+    state = Procedure.objects.aggregate(changed=Max('updated_at'), count=Count('pk'))
+    version = (state['changed'], state['count'])
+    if _table is not None and _version == version:
+        return _table
+    with _lock:
+        if _table is None or _version != version:
+            _table = {
+                pk: (status, scope)
+                for pk, status, scope in Procedure.objects.values_list('pk', 'resulting_status', 'effect_scope')
+            }
+            _version = version
+        return _table
+
+
+def scope_teeth(scope, number):
+    """Números ADA afectados por un procedimiento aplicado al diente `number`."""
+    if scope == 'Q':
+        return next(quadrant for quadrant in QUADRANTS if number in quadrant)
+    if scope == 'A':
+        return next(arch for arch in ARCHES if number in arch)
+    if scope == 'M':
+        return range(1, 33)
+    return [number]
+
+
+def _set_status(tooth, status, consultation_id):
+    tooth.status = status
+    # El cambio queda en el historial del odontograma de esta consulta
+    tooth._consultation_id = consultation_id
+    tooth.save()
+
+
+def apply(tooth_procedure, consultation_id=None):
+    """
+    Aplica el efecto del procedimiento al diente y, según el alcance, a los
+    demás dientes del cuadrante, la arcada o la boca. Los dientes extraídos
+    solo cambian si son el diente del procedimiento.
+    """
+    status, scope = get_table().get(tooth_procedure.procedure_id, ('', 'T'))
+    if not status:
+        return
+
+    tooth = tooth_procedure.tooth
+    if tooth.status != status:
+        _set_status(tooth, status, consultation_id)
+    if scope == 'T':
+        return
+
+    others = [number for number in scope_teeth(scope, tooth.number_ada) if number != tooth.number_ada]
+    rows = {
+        row.number_ada: row
+        for row in Tooth.objects.filter(history_id=tooth.history_id, number_ada__in=others)
+    }
+    packed = None
+    if odontogram.is_packed():
+        packed = ClinicalHistory.objects.filter(pk=tooth.history_id).values_list('odontogram', flat=True).first()
+
+    for number in others:
+        row = rows.get(number)
+        if row is not None:
+            if row.status not in ('E', status):
+                _set_status(row, status, consultation_id)
+        elif packed is not None and packed[number - 1] not in ('E', status):
+            # Diente sin fila (odontograma empaquetado): se cambia solo la cadena
+            previous = odontogram.set_status(tooth.history_id, number, status)
+            odontogram_history.record(tooth.history_id, number, previous, status, consultation_id=consultation_id)
+
+
+def legacy_status(name):
+    """Estado que deducía la regla anterior a partir del nombre del procedimiento."""
+    name = name.lower()
+    if 'extracción' in name or 'extracci' in name:
+        return 'E'
+    if 'obturación' in name or 'resina' in name:
+        return 'O'
+    return 'P'
+
+
+def backfill_legacy():
+    """
+    Asigna el efecto que deducía la regla anterior a los procedimientos que
+    siguen con el valor por defecto (Pendiente, alcance Diente). Corre después
+    de cada migrate (signals.py) y con `backfill_procedure_effects`.
+    Devuelve los procedimientos actualizados.
+    """
+    updated = []
+    for procedure in Procedure.objects.filter(resulting_status='P', effect_scope='T'):
+        status = legacy_status(procedure.name)
+        if status != procedure.resulting_status:
+            procedure.resulting_status = status
+            # updated_at cambia la versión de la tabla en los otros procesos
+            procedure.save(update_fields=['resulting_status', 'updated_at'])
+            updated.append(procedure)
+    return updated
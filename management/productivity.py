@@ -0,0 +1,193 @@
+"""
+Productividad por odontólogo a partir de agregados diarios (DentistDailyStats).
+
+Las escrituras de consultas, procedimientos, pagos y citas llaman a
+`refresh_days` con los pares (odontólogo, día) afectados; cada día se
+recalcula con consultas acotadas a ese día. Los reportes leen solo las
+filas diarias.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import (
+    Appointment,
+    Consultation,
+    DentistDailyStats,
+    Payment,
+    ToothProcedure,
+)
+
+COUNTER_FIELDS = (
+    'consultations', 'procedures', 'billed', 'collected',
+    'appointments', 'appointments_attended', 'appointments_cancelled',
+)
+
+
+def day_bounds(day):
+    """Inicio y fin (exclusivo) de un día local como datetimes con zona horaria."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _empty_counters():
+    return {
+        field: Decimal('0.00') if field in ('billed', 'collected') else 0
+        for field in COUNTER_FIELDS
+    }
+
+
+def compute_day(user_id, day):
+    """Calcula los contadores de un odontólogo en un día desde las tablas."""
+    start, end = day_bounds(day)
+    counters = _empty_counters()
+
+    consultations = Consultation.objects.filter(user_id=user_id, date__gte=start, date__lt=end)
+    counters['consultations'] = consultations.count()
+
+    procedures = ToothProcedure.objects.filter(
+        consultation__user_id=user_id,
+        consultation__date__gte=start,
+        consultation__date__lt=end,
+    ).aggregate(count=Count('id'), billed=Sum('price_charged'))
+    counters['procedures'] = procedures['count']
+    counters['billed'] = procedures['billed'] or Decimal('0.00')
+
+    counters['collected'] = Payment.objects.filter(
+        consultation__user_id=user_id,
+        payment_date__gte=start,
+        payment_date__lt=end,
+    ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+
+    appointments = Appointment.objects.filter(user_id=user_id, date=day).aggregate(
+        total=Count('id'),
+        attended=Count('id', filter=Q(status='A')),
+        cancelled=Count('id', filter=Q(status='X')),
+    )
+    counters['appointments'] = appointments['total']
+    counters['appointments_attended'] = appointments['attended']
+    counters['appointments_cancelled'] = appointments['cancelled']
+    return counters
+
+
+def refresh_day(user_id, day):
+    """Recalcula (o elimina si quedó vacía) la fila de un odontólogo y día."""
+    counters = compute_day(user_id, day)
+    if not any(counters.values()):
+        DentistDailyStats.objects.filter(user_id=user_id, day=day).delete()
+        return
+    DentistDailyStats.objects.update_or_create(user_id=user_id, day=day, defaults=counters)
+
+
+def refresh_days(pairs):
+    """Recalcula cada par (user_id, día) distinto, ignorando los que no tienen odontólogo."""
+    with transaction.atomic():
+        for user_id, day in set(pairs):
+            if user_id is not None and day is not None:
+                refresh_day(user_id, day)
+
+
+def rebuild(since=None):
+    """
+    Reconstruye las filas diarias (desde `since`, o todas) con una consulta
+    agrupada por tabla.
+    """
+    rows = defaultdict(_empty_counters)
+    start = day_bounds(since)[0] if since else None
+
+    consultations = Consultation.objects.exclude(user=None)
+    if start:
+        consultations = consultations.filter(date__gte=start)
+    for row in consultations.annotate(day=TruncDate('date')).values('user', 'day').annotate(
+        count=Count('id')
+    ).order_by():
+        rows[(row['user'], row['day'])]['consultations'] = row['count']
+
+    procedures = ToothProcedure.objects.exclude(consultation__user=None)
+    if start:
+        procedures = procedures.filter(consultation__date__gte=start)
+    for row in procedures.annotate(day=TruncDate('consultation__date')).values(
+        'consultation__user', 'day'
+    ).annotate(count=Count('id'), billed=Sum('price_charged')).order_by():
+        counters = rows[(row['consultation__user'], row['day'])]
+        counters['procedures'] = row['count']
+        counters['billed'] = row['billed'] or Decimal('0.00')
+
+    payments = Payment.objects.exclude(consultation__user=None)
+    if start:
+        payments = payments.filter(payment_date__gte=start)
+    for row in payments.annotate(day=TruncDate('payment_date')).values(
+        'consultation__user', 'day'
+    ).annotate(total=Sum('amount')).order_by():
+        rows[(row['consultation__user'], row['day'])]['collected'] = row['total'] or Decimal('0.00')
+
+    appointments = Appointment.objects.exclude(user=None)
+    if since:
+        appointments = appointments.filter(date__gte=since)
+    for row in appointments.values('user', 'date').annotate(
+        total=Count('id'),
+        attended=Count('id', filter=Q(status='A')),
+        cancelled=Count('id', filter=Q(status='X')),
+    ).order_by():
+        counters = rows[(row['user'], row['date'])]
+        counters['appointments'] = row['total']
+        counters['appointments_attended'] = row['attended']
+        counters['appointments_cancelled'] = row['cancelled']
+
+    with transaction.atomic():
+        existing = DentistDailyStats.objects.all()
+        if since:
+            existing = existing.filter(day__gte=since)
+        existing.delete()
+        DentistDailyStats.objects.bulk_create(
+            [
+                DentistDailyStats(user_id=user_id, day=day, **counters)
+                for (user_id, day), counters in rows.items()
+            ],
+            batch_size=2000,
+        )
+    return len(rows)
+
+
+def _ratio(part, total):
+    return round(part / total, 4) if total else None
+
+
+def productivity_report(start, end, period='day', user_id=None):
+    """
+    Productividad por odontólogo entre `start` y `end` (inclusive), por día o
+    por mes, leyendo solo las filas diarias.
+    """
+    if period not in ('day', 'month'):
+        raise ValueError(f"Periodo inválido: {period}")
+
+    rows = DentistDailyStats.objects.filter(day__gte=start, day__lte=end)
+    if user_id:
+        rows = rows.filter(user_id=user_id)
+    bucket = TruncMonth('day') if period == 'month' else F('day')
+    rows = rows.annotate(bucket=bucket).values('bucket', 'user', 'user__username').annotate(
+        **{f'sum_{field}': Sum(field) for field in COUNTER_FIELDS}
+    ).order_by('bucket', 'user__username')
+
+    cent = Decimal('0.01')
+    result = []
+    for row in rows:
+        result.append({
+            'period_start': row['bucket'],
+            'dentist_id': row['user'],
+            'dentist': row['user__username'],
+            'consultations': row['sum_consultations'],
+            'procedures': row['sum_procedures'],
+            'billed': (row['sum_billed'] or Decimal('0.00')).quantize(cent),
+            'collected': (row['sum_collected'] or Decimal('0.00')).quantize(cent),
+            'appointments': row['sum_appointments'],
+            'attended_ratio': _ratio(row['sum_appointments_attended'], row['sum_appointments']),
+            'cancelled_ratio': _ratio(row['sum_appointments_cancelled'], row['sum_appointments']),
+        })
+    return result
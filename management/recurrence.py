@@ -0,0 +1,160 @@
+"""
+Series de citas periódicas.
+
+Una AppointmentSeries es una regla (frecuencia, intervalo, número de citas o
+fecha final y fechas excluidas) y no genera filas al crearse. Para un rango
+de fechas, `expand` calcula las ocurrencias de las series activas como
+Appointment sin guardar: la primera ocurrencia del rango se obtiene por
+aritmética de fechas, sin recorrer las anteriores. Solo se guarda una fila al
+editar, confirmar, atender o cancelar una ocurrencia (`materialize`); esa
+fila, con series y occurrence_date, sustituye a la ocurrencia calculada.
+
+Al guardar o borrar una ocurrencia se actualiza la serie (updated_at), que es
+lo que usa el ETag del feed de la agenda.
+"""
+
+import calendar
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Appointment, AppointmentSeries
+
+DAYS = {'D': 1, 'W': 7}
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def nth(series, index):
+    """Fecha de la ocurrencia número `index` (desde 0); el día 31 pasa al último del mes."""
+    if series.frequency == 'M':
+        return _add_months(series.start_date, index * series.interval)
+    return series.start_date + timedelta(days=index * series.interval * DAYS[series.frequency])
+
+
+def first_index(series, start):
+    """Índice de la primera ocurrencia en `start` o después."""
+    if start <= series.start_date:
+        return 0
+    if series.frequency == 'M':
+        months = (start.year - series.start_date.year) * 12 + start.month - series.start_date.month
+        index = max(0, months // series.interval - 1)
+        while nth(series, index) < start:
+            index += 1
+        return index
+    step = series.interval * DAYS[series.frequency]
+    return -(-(start - series.start_date).days // step)
+
+
+def last_occurrence(series):
+    """Fecha de la última ocurrencia, o None si la serie no termina."""
+    last = None
+    if series.count:
+        last = nth(series, series.count - 1)
+    if series.until and (last is None or series.until < last):
+        # La última ocurrencia que no pasa de `until`
+        index = first_index(series, series.until + timedelta(days=1)) - 1
+        last = nth(series, index) if index >= 0 else series.start_date - timedelta(days=1)
+    return last
+
+
+def occurrence_dates(series, start, end):
+    """Fechas de la serie entre start y end (inclusive), sin las excluidas."""
+    excluded = set(series.excluded_dates or ())
+    index = first_index(series, start)
+    while not (series.count and index >= series.count):
+        day = nth(series, index)
+        if day > end or (series.last_date and day > series.last_date) or (series.until and day > series.until):
+            return
+        if day.isoformat() not in excluded:
+            yield day
+        index += 1
+
+
+def is_occurrence(series, day):
+    return any(occurrence == day for occurrence in occurrence_dates(series, day, day))
+
+
+def occurrence(series, day):
+    """Ocurrencia de la serie en `day` como Appointment sin guardar."""
+    return Appointment(
+        series=series,
+        occurrence_date=day,
+        patient=series.patient,
+        user_id=series.user_id,
+        date=day,
+        start_time=series.start_time,
+        end_time=series.end_time,
+        reason=series.reason,
+        notes=series.notes,
+        status='P',
+    )
+
+
+def active_series(start, end, dentist_ids=None):
+    """Series con alguna fecha posible entre start y end."""
+    queryset = AppointmentSeries.objects.filter(start_date__lte=end).filter(
+        Q(last_date__isnull=True) | Q(last_date__gte=start)
+    )
+    if dentist_ids is not None:
+        queryset = queryset.filter(user_id__in=dentist_ids)
+    return queryset
+
+
+def expand(start, end, dentist_ids=None, series=None):
+    """
+    Ocurrencias sin guardar de las series activas entre start y end,
+    omitiendo las que ya tienen fila propia. Dos consultas como máximo.
+    """
+    if series is None:
+        series = list(active_series(start, end, dentist_ids).select_related('patient'))
+    if not series:
+        return []
+    saved = set(
+        Appointment.objects.filter(
+            series__in=series, occurrence_date__gte=start, occurrence_date__lte=end,
+        ).values_list('series_id', 'occurrence_date')
+    )
+    return [
+        occurrence(item, day)
+        for item in series
+        for day in occurrence_dates(item, start, end)
+        if (item.pk, day) not in saved
+    ]
+
+
+def touch(series_id):
+    """Marca la serie como modificada (cambió el conjunto de sus ocurrencias)."""
+    AppointmentSeries.objects.filter(pk=series_id).update(updated_at=timezone.now())
+
+
+def materialize(series, day, **changes):
+    """Guarda la ocurrencia de `day` como Appointment (o devuelve la ya guardada)."""
+    with transaction.atomic():
+        appointment = Appointment.objects.filter(series=series, occurrence_date=day).first()
+        if appointment is None:
+            appointment = occurrence(series, day)
+        for name, value in changes.items():
+            setattr(appointment, name, value)
+        appointment.save()
+        touch(series.pk)
+    return appointment
+
+
+def exclude(series_id, day):
+    """Quita la fecha de la serie (la ocurrencia guardada se borró)."""
+    with transaction.atomic():
+        series = AppointmentSeries.objects.select_for_update().filter(pk=series_id).first()
+        if series is None:
+            return
+        excluded = set(series.excluded_dates or ())
+        if day.isoformat() not in excluded:
+            series.excluded_dates = sorted(excluded | {day.isoformat()})
+            series.save(update_fields=['excluded_dates', 'last_date', 'updated_at'])
@@ -0,0 +1,238 @@
+"""
+Recordatorios de citas.
+
+Se recorren las citas pendientes o confirmadas que empiezan en las próximas
+horas por lotes, con paginación por cursor sobre el índice (date, start_time,
+id), y después las ocurrencias de series que caen en la ventana. Cada lote:
+
+1. descarta las citas que ya están en el registro (AppointmentReminder) o
+   cuyo paciente no tiene correo;
+2. reserva las demás insertando su clave con bulk_create: la clave es única,
+   así que dos ejecuciones simultáneas nunca reservan la misma cita;
+3. genera los mensajes con la plantilla compilada una vez por ejecución y los
+   envía por una sola conexión del backend de correo;
+4. marca sent_at en las enviadas y borra la reserva de las que fallaron, que
+   se reintentan en la siguiente ejecución.
+
+Si el proceso se interrumpe entre el envío y la marca, la reserva queda sin
+sent_at y no se reintenta: se prefiere perder un recordatorio a duplicarlo.
+
+El backend es cualquier backend de correo de Django; settings.REMINDER_BACKEND
+elige console, file o smtp (ver BACKENDS).
+"""
+
+import smtplib
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.template.loader import get_template
+from django.utils import timezone
+
+from . import recurrence
+from .models import Appointment, AppointmentReminder
+from .pagination import KeysetPaginator
+
+BACKENDS = {
+    'console': 'django.core.mail.backends.console.EmailBackend',
+    'file': 'django.core.mail.backends.filebased.EmailBackend',
+    'smtp': 'django.core.mail.backends.smtp.EmailBackend',
+}
+# Pendiente y confirmada
+REMIND_STATUSES = ('P', 'C')
+DEFAULT_CHUNK_SIZE = 500
+TEMPLATE = 'management/appointment_reminder.txt'
+CLINIC_NAME = 'GlobalDent'
+
+ORDERING = [('date', False), ('start_time', False), ('pk', False)]
+
+
+@dataclass
+class DispatchResult:
+    start: datetime = None
+    end: datetime = None
+    # Citas y ocurrencias de la ventana
+    scanned: int = 0
+    already_sent: int = 0
+    no_email: int = 0
+    # Recordatorios a enviar (en --dry-run no se envían)
+    due: int = 0
+    sent: int = 0
+    # (clave, mensaje)
+    failed: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def per_second(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+
+def backend_name(name=None):
+    return name or getattr(settings, 'REMINDER_BACKEND', 'console')
+
+
+def backend_path(name=None):
+    name = backend_name(name)
+    return BACKENDS.get(name, name)
+
+
+def reminder_key(appointment):
+    """Cita (u ocurrencia de serie) y horario: si la cita se mueve, la clave cambia."""
+    if appointment.series_id and appointment.occurrence_date:
+        origin = f'S{appointment.series_id}:{appointment.occurrence_date.isoformat()}'
+    else:
+        origin = f'A{appointment.pk}'
+    return f'{origin}@{appointment.date.isoformat()}T{appointment.start_time:%H:%M}'
+
+
+def _starts_at(appointment):
+    return timezone.make_aware(datetime.combine(appointment.date, appointment.start_time))
+
+
+def due_appointments(start, end, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Lotes de citas pendientes o confirmadas que empiezan en [start, end), en orden."""
+    start, end = timezone.localtime(start), timezone.localtime(end)
+    queryset = Appointment.objects.filter(
+        status__in=REMIND_STATUSES,
+        date__gte=start.date(),
+        date__lte=end.date(),
+    ).exclude(
+        Q(date=start.date(), start_time__lt=start.time()) | Q(date=end.date(), start_time__gte=end.time())
+    ).select_related('patient').order_by('date', 'start_time', 'pk')
+
+    values = None
+    while True:
+        page = queryset
+        if values is not None:
+            page = page.filter(KeysetPaginator.after_condition(ORDERING, values))
+        chunk = list(page[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            break
+        last = chunk[-1]
+        values = [last.date, last.start_time, last.pk]
+
+    # Ocurrencias de series sin fila propia (siempre pendientes)
+    occurrences = [
+        occurrence for occurrence in recurrence.expand(start.date(), end.date())
+        if start <= _starts_at(occurrence) < end
+    ]
+    occurrences.sort(key=lambda a: (a.date, a.start_time))
+    for index in range(0, len(occurrences), chunk_size):
+        yield occurrences[index:index + chunk_size]
+
+
+def build_message(template, appointment, dentist=None):
+    context = {
+        'appointment': appointment,
+        'patient': appointment.patient,
+        'dentist': dentist,
+        'clinic': CLINIC_NAME,
+    }
+    return EmailMessage(
+        subject=f'Recordatorio de cita: {appointment.date:%d/%m/%Y} a las {appointment.start_time:%H:%M}',
+        body=template.render(context),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[appointment.patient.email],
+    )
+
+
+def _dispatch_chunk(chunk, result, template, connection, backend, run, dry_run):
+    result.scanned += len(chunk)
+    pending = {}
+    for appointment in chunk:
+        if appointment.patient.email:
+            pending[reminder_key(appointment)] = appointment
+        else:
+            result.no_email += 1
+    if not pending:
+        return
+
+    done = set(
+        AppointmentReminder.objects.filter(key__in=list(pending)).order_by().values_list('key', flat=True)
+    )
+    result.already_sent += len(done)
+    pending = {key: appointment for key, appointment in pending.items() if key not in done}
+    result.due += len(pending)
+    if dry_run or not pending:
+        return
+
+    AppointmentReminder.objects.bulk_create([
+        AppointmentReminder(
+            key=key,
+            patient_id=appointment.patient_id,
+            appointment_id=appointment.pk,
+            series_id=appointment.series_id,
+            date=appointment.date,
+            start_time=appointment.start_time,
+            recipient=appointment.patient.email,
+            backend=backend,
+            run=run,
+        )
+        for key, appointment in pending.items()
+    ], ignore_conflicts=True)
+    claimed = set(
+        AppointmentReminder.objects.filter(key__in=list(pending), run=run).order_by().values_list('key', flat=True)
+    )
+    # Reservadas entretanto por otra ejecución
+    result.already_sent += len(pending) - len(claimed)
+    result.due -= len(pending) - len(claimed)
+
+    dentists = User.objects.in_bulk({appointment.user_id for appointment in pending.values()} - {None})
+    messages = []
+    for key, appointment in pending.items():
+        if key in claimed:
+            dentist = dentists.get(appointment.user_id)
+            dentist = dentist and (dentist.get_full_name() or dentist.username)
+            messages.append((key, build_message(template, appointment, dentist)))
+
+    sent, failed = [], []
+    for key, message in messages:
+        try:
+            if connection.send_messages([message]):
+                sent.append(key)
+            else:
+                failed.append(key)
+                result.failed.append((key, 'El backend no envió el mensaje'))
+        except (smtplib.SMTPException, OSError) as e:
+            failed.append(key)
+            result.failed.append((key, str(e)))
+
+    if sent:
+        AppointmentReminder.objects.filter(run=run, key__in=sent).update(sent_at=timezone.now())
+        result.sent += len(sent)
+    if failed:
+        AppointmentReminder.objects.filter(run=run, key__in=failed).delete()
+
+
+def dispatch(hours=None, chunk_size=DEFAULT_CHUNK_SIZE, backend=None, dry_run=False, now=None, **options):
+    """
+    Envía los recordatorios de las citas que empiezan en las próximas `hours`
+    horas (settings.REMINDER_HOURS por defecto). `options` se pasan al backend.
+    """
+    began = time.perf_counter()
+    hours = hours or getattr(settings, 'REMINDER_HOURS', 24)
+    start = timezone.localtime(now)
+    result = DispatchResult(start=start, end=start + timedelta(hours=hours))
+    backend = backend_name(backend)
+    template = get_template(TEMPLATE)
+    run = uuid.uuid4().hex
+
+    connection = get_connection(backend_path(backend), fail_silently=False, **options)
+    if not dry_run:
+        # Una conexión para toda la ejecución (en SMTP, una sola sesión)
+        connection.open()
+    try:
+        for chunk in due_appointments(result.start, result.end, chunk_size):
+            _dispatch_chunk(chunk, result, template, connection, backend, run, dry_run)
+    finally:
+        if not dry_run:
+            connection.close()
+    result.elapsed = time.perf_counter() - began
+    return result
@@ -0,0 +1,88 @@
+"""
+Reportes de la clínica que se generan en streaming.
+"""
+
+import csv
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, Q, Sum, Value, When
+from django.utils import timezone
+
+from .models import Consultation
+
+# Tramos de antigüedad en días: (etiqueta, mínimo, máximo o None)
+AGING_BUCKETS = [
+    ('0-30', 0, 30),
+    ('31-60', 31, 60),
+    ('61-90', 61, 90),
+    ('90+', 91, None),
+]
+
+
+class Echo:
+    """Pseudo-buffer para csv.writer: devuelve la línea en lugar de escribirla."""
+
+    def write(self, value):
+        return value
+
+
+def aging_queryset(today=None):
+    """
+    Saldos pendientes por paciente repartidos por antigüedad de la consulta.
+
+    Una sola consulta agrupada sobre las consultas con saldo > 0 (el saldo es
+    total_cost menos la suma de pagos, mantenido en la propia consulta).
+    """
+    now = today or timezone.now()
+    decimal_field = DecimalField(max_digits=12, decimal_places=2)
+
+    annotations = {}
+    for label, min_days, max_days in AGING_BUCKETS:
+        condition = Q(date__lte=now - timedelta(days=min_days))
+        if max_days is not None:
+            condition &= Q(date__gt=now - timedelta(days=max_days + 1))
+        annotations[f'bucket_{label}'] = Sum(
+            Case(When(condition, then='balance'), default=Value(Decimal('0.00'))),
+            output_field=decimal_field,
+        )
+
+    return Consultation.objects.filter(balance__gt=0).values(
+        'patient_id',
+        'patient__first_name',
+        'patient__paternal_surname',
+        'patient__maternal_surname',
+        'patient__id_number',
+        'patient__phone_number',
+    ).annotate(
+        total_balance=Sum('balance', output_field=decimal_field),
+        **annotations,
+    ).order_by('patient__paternal_surname', 'patient__first_name', 'patient_id')
+
+
+def aging_rows(chunk_size=2000, today=None):
+    """Genera las filas del reporte (con encabezado) sin cargar todo en memoria."""
+    yield ['Paciente', 'DNI/Cédula', 'Teléfono'] + [label for label, _, _ in AGING_BUCKETS] + ['Total']
+
+    cent = Decimal('0.01')
+    for row in aging_queryset(today).iterator(chunk_size=chunk_size):
+        name = ' '.join(filter(None, [
+            row['patient__first_name'],
+            row['patient__paternal_surname'],
+            row['patient__maternal_surname'],
+        ]))
+        yield [
+            name,
+            row['patient__id_number'] or '',
+            row['patient__phone_number'] or '',
+        ] + [
+            (row[f'bucket_{label}'] or Decimal('0.00')).quantize(cent)
+            for label, _, _ in AGING_BUCKETS
+        ] + [row['total_balance'].quantize(cent)]
+
+
+def stream_csv(rows):
+    """Convierte un iterable de filas en líneas CSV para StreamingHttpResponse."""
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
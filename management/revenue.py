@@ -0,0 +1,183 @@
+"""
+Agregados de ingresos por periodo (RevenueRollup).
+
+Cada pago suma su monto en tres filas (día, semana y mes) para su método de
+pago y el odontólogo de la consulta. Las consultas de tendencia leen solo
+estas filas, así que su costo depende del número de periodos pedidos y no
+del tamaño de la tabla de pagos.
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Payment, RevenueRollup
+
+PERIODS = ('D', 'W', 'M')
+
+# Cuántos periodos se devuelven por defecto y como máximo
+DEFAULT_BUCKETS = {'D': 30, 'W': 12, 'M': 24}
+MAX_BUCKETS = {'D': 366, 'W': 104, 'M': 120}
+
+
+def period_start(day, period):
+    """Primer día del periodo que contiene a `day`."""
+    if period == 'D':
+        return day
+    if period == 'W':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def shift_period(start, period, buckets):
+    """Inicio del periodo `buckets` posiciones antes de `start`."""
+    if period == 'D':
+        return start - timedelta(days=buckets)
+    if period == 'W':
+        return start - timedelta(weeks=buckets)
+    month_index = start.year * 12 + start.month - 1 - buckets
+    return start.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+
+
+def record_payment(amount, method, user_id, paid_at, count=1):
+    """
+    Suma `amount` (y `count` pagos) a los agregados del pago.
+    Para revertir un pago se llama con valores negativos.
+    """
+    day = timezone.localdate(paid_at)
+    with transaction.atomic():
+        for period in PERIODS:
+            lookup = {
+                'period': period,
+                'period_start': period_start(day, period),
+                'method': method,
+                'user_id': user_id,
+            }
+            updated = RevenueRollup.objects.filter(**lookup).update(
+                total=F('total') + amount,
+                payment_count=F('payment_count') + count,
+            )
+            if not updated:
+                RevenueRollup.objects.create(total=amount, payment_count=count, **lookup)
+
+
+def merge_user_rollups(user_id):
+    """
+    Pasa los agregados de un odontólogo al grupo sin odontólogo.
+    Se llama antes de borrar el usuario: sus consultas quedan con user=NULL
+    y los pagos siguen contando en los totales de la clínica.
+    """
+    with transaction.atomic():
+        rows = list(RevenueRollup.objects.select_for_update().filter(user_id=user_id))
+        for row in rows:
+            lookup = {
+                'period': row.period,
+                'period_start': row.period_start,
+                'method': row.method,
+                'user_id': None,
+            }
+            updated = RevenueRollup.objects.filter(**lookup).update(
+                total=F('total') + row.total,
+                payment_count=F('payment_count') + row.payment_count,
+            )
+            if not updated:
+                RevenueRollup.objects.create(
+                    total=row.total, payment_count=row.payment_count, **lookup
+                )
+        RevenueRollup.objects.filter(user_id=user_id).delete()
+
+
+def rebuild_revenue_rollups():
+    """Reconstruye todos los agregados a partir de la tabla de pagos."""
+    truncs = {'D': TruncDay, 'W': TruncWeek, 'M': TruncMonth}
+    created = 0
+    with transaction.atomic():
+        RevenueRollup.objects.all().delete()
+        for period, trunc in truncs.items():
+            rows = Payment.objects.annotate(
+                bucket=trunc('payment_date', output_field=DateField()),
+            ).values(
+                'bucket', 'method', 'consultation__user',
+            ).annotate(
+                total=Sum('amount'),
+                payment_count=Count('id'),
+            ).order_by()
+
+            batch = []
+            for row in rows.iterator(chunk_size=2000):
+                batch.append(RevenueRollup(
+                    period=period,
+                    period_start=row['bucket'],
+                    method=row['method'],
+                    user_id=row['consultation__user'],
+                    total=row['total'],
+                    payment_count=row['payment_count'],
+                ))
+                if len(batch) >= 2000:
+                    RevenueRollup.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            RevenueRollup.objects.bulk_create(batch)
+            created += len(batch)
+    return created
+
+
+def revenue_series(period='M', buckets=None, group_by=None):
+    """
+    Serie de ingresos de los últimos `buckets` periodos.
+
+    `group_by` puede ser 'method', 'dentist' o None (total por periodo).
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Periodo inválido: {period}")
+    if group_by not in (None, 'method', 'dentist'):
+        raise ValueError(f"Agrupación inválida: {group_by}")
+    buckets = min(buckets or DEFAULT_BUCKETS[period], MAX_BUCKETS[period])
+
+    end = period_start(timezone.localdate(), period)
+    start = shift_period(end, period, buckets - 1)
+
+    fields = ['period_start']
+    if group_by == 'method':
+        fields.append('method')
+    elif group_by == 'dentist':
+        fields += ['user', 'user__username']
+
+    rows = RevenueRollup.objects.filter(
+        period=period,
+        period_start__gte=start,
+        period_start__lte=end,
+    ).values(*fields).annotate(
+        amount=Sum('total'),
+        payments=Sum('payment_count'),
+    ).order_by(*fields)
+
+    methods = dict(Payment.METHOD_CHOICES)
+    series = []
+    for row in rows:
+        if not row['payments']:
+            continue
+        item = {
+            'period_start': row['period_start'],
+            'total': (row['amount'] or Decimal('0.00')).quantize(Decimal('0.01')),
+            'payments': row['payments'],
+        }
+        if group_by == 'method':
+            item['method'] = row['method']
+            item['label'] = methods.get(row['method'], row['method'])
+        elif group_by == 'dentist':
+            item['dentist_id'] = row['user']
+            item['label'] = row['user__username'] or 'Sin asignar'
+        series.append(item)
+
+    return {
+        'period': period,
+        'group_by': group_by,
+        'start': start,
+        'end': end,
+        'series': series,
+    }
@@ -0,0 +1,235 @@
+"""
+Detección de citas solapadas.
+
+Dos citas del mismo odontólogo y día se solapan si cada una empieza antes de
+que termine la otra (intervalos semiabiertos: 9:00-10:00 y 10:00-11:00 no
+chocan). Primero se mira el mapa de ocupación del día (occupancy.py): si el
+AND con el horario nuevo es cero no hay choque y no se leen las citas. Si no,
+el índice (user, date, start_time, end_time) acota la búsqueda a las citas de
+ese día que empiezan antes del fin de la nueva, y end_time se compara sin
+leer la tabla. Las citas canceladas no ocupan horario; las ocurrencias de
+series sin fila propia sí (ver recurrence.py).
+
+Para que dos reservas simultáneas no pasen ambas la comprobación, se valida
+dentro de una transacción y bloqueando antes la fila del odontólogo
+(select_for_update); en SQLite la transacción ya toma el bloqueo de
+escritura al empezar (transaction_mode IMMEDIATE en settings).
+
+La búsqueda de horarios libres lee los mapas de ocupación del rango (una fila
+por odontólogo y día con citas) y toma como huecos las rachas de bits en
+cero. Los días no exactos (citas fuera de múltiplos de 5 minutos o
+solapadas) se recorren con un barrido sobre las citas: un cursor avanza por
+los intervalos ocupados y cada salto entre el cursor y el siguiente inicio es
+un hueco.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import occupancy, recurrence
+from .models import Appointment, Consultation
+
+CANCELLED = 'X'
+
+# Los horarios libres empiezan en múltiplos de SLOT_STEP minutos
+SLOT_STEP = 15
+DEFAULT_SEARCH_DAYS = 14
+MAX_SEARCH_DAYS = 92
+DEFAULT_SLOTS = 10
+MAX_SLOTS = 100
+# Ocurrencias de una serie nueva que se comprueban contra la agenda
+SERIES_CHECK_DAYS = 365
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _clock(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def lock_dentist(user_id):
+    """Serializa las reservas del odontólogo hasta que termine la transacción en curso."""
+    if user_id is not None and transaction.get_connection().in_atomic_block:
+        list(User.objects.select_for_update().filter(pk=user_id).values_list('pk', flat=True))
+
+
+def overlapping(user_id, day, start, end, exclude_pk=None):
+    """Citas activas del odontólogo que se solapan con [start, end) el día `day`."""
+    queryset = Appointment.objects.filter(
+        user_id=user_id,
+        date=day,
+        start_time__lt=end,
+        end_time__gt=start,
+    ).exclude(status=CANCELLED)
+    if exclude_pk is not None:
+        queryset = queryset.exclude(pk=exclude_pk)
+    return queryset
+
+
+def check_overlap(user_id, day, start, end, exclude_pk=None, status=None, exclude_occurrence=None):
+    """
+    Lanza ValidationError si el horario choca con otra cita del odontólogo.
+    `exclude_occurrence` es (serie, fecha) de la ocurrencia sin guardar que se edita.
+    """
+    if user_id is None or status == CANCELLED or not (day and start and end):
+        return
+    lock_dentist(user_id)
+    conflicts = []
+    if not occupancy.is_free(user_id, day, start, end, exclude_pk):
+        # Choque (o día no exacto): se leen las citas para confirmarlo y describirlo
+        conflicts = list(
+            overlapping(user_id, day, start, end, exclude_pk).select_related('patient').order_by('start_time')[:3]
+        )
+    # Ocurrencias de series sin fila propia ese día
+    conflicts += [
+        occurrence for occurrence in recurrence.expand(day, day, dentist_ids=[user_id])
+        if occurrence.start_time < end and occurrence.end_time > start
+        and (occurrence.series_id, occurrence.occurrence_date) != exclude_occurrence
+    ]
+    conflicts.sort(key=lambda a: a.start_time)
+    if conflicts:
+        detail = ', '.join(
+            f"{a.start_time:%H:%M}-{a.end_time:%H:%M} ({a.patient})" for a in conflicts[:3]
+        )
+        raise ValidationError(
+            f'El odontólogo ya tiene una cita en ese horario: {detail}.',
+            code='overlap',
+        )
+
+
+def dentists():
+    """Usuarios activos con citas o consultas a su nombre."""
+    return User.objects.filter(is_active=True).filter(
+        Exists(Appointment.objects.filter(user=OuterRef('pk')))
+        | Exists(Consultation.objects.filter(user=OuterRef('pk')))
+    ).order_by('username')
+
+
+def busy_intervals(dentist_ids, start_date, end_date, exclude_series=None):
+    """
+    {(odontólogo, día): [(inicio, fin) en minutos]} de las citas activas y de
+    las ocurrencias de series del rango, ordenados por inicio.
+    """
+    busy = defaultdict(list)
+    rows = Appointment.objects.filter(
+        user_id__in=dentist_ids,
+        date__gte=start_date,
+        date__lte=end_date,
+    ).exclude(status=CANCELLED)
+    if exclude_series is not None:
+        rows = rows.exclude(series_id=exclude_series)
+    for user_id, day, start, end in rows.order_by('user_id', 'date', 'start_time').values_list(
+        'user_id', 'date', 'start_time', 'end_time'
+    ):
+        busy[(user_id, day)].append((_minutes(start), _minutes(end)))
+
+    series = recurrence.active_series(start_date, end_date, dentist_ids)
+    if exclude_series is not None:
+        series = series.exclude(pk=exclude_series)
+    changed = set()
+    for occurrence in recurrence.expand(start_date, end_date, series=list(series)):
+        key = (occurrence.user_id, occurrence.date)
+        busy[key].append((_minutes(occurrence.start_time), _minutes(occurrence.end_time)))
+        changed.add(key)
+    for key in changed:
+        busy[key].sort()
+    return busy
+
+
+def check_series_overlap(series):
+    """
+    Lanza ValidationError si alguna ocurrencia de la serie en los próximos
+    SERIES_CHECK_DAYS días choca con otra cita del odontólogo.
+    """
+    if series.user_id is None:
+        return
+    lock_dentist(series.user_id)
+    last = series.start_date + timedelta(days=SERIES_CHECK_DAYS - 1)
+    busy = busy_intervals([series.user_id], series.start_date, last, exclude_series=series.pk)
+    start, end = _minutes(series.start_time), _minutes(series.end_time)
+    clashes = [
+        day for day in recurrence.occurrence_dates(series, series.start_date, last)
+        if any(busy_start < end and busy_end > start for busy_start, busy_end in busy.get((series.user_id, day), ()))
+    ]
+    if clashes:
+        detail = ', '.join(day.strftime('%d/%m/%Y') for day in clashes[:3])
+        more = f' y {len(clashes) - 3} más' if len(clashes) > 3 else ''
+        raise ValidationError(
+            f'La serie choca con otras citas del odontólogo: {detail}{more}.',
+            code='overlap',
+        )
+
+
+def gaps(intervals, opening, closing):
+    """Huecos [inicio, fin) entre `opening` y `closing` que dejan libres los intervalos ordenados."""
+    cursor = opening
+    for start, end in intervals:
+        if start > cursor:
+            yield cursor, min(start, closing)
+        cursor = max(cursor, end)
+        if cursor >= closing:
+            return
+    if cursor < closing:
+        yield cursor, closing
+
+
+def free_slots(duration, start_date, end_date, dentist_ids=None, limit=DEFAULT_SLOTS, now=None):
+    """
+    Primeros horarios libres de `duration` minutos dentro del horario de
+    atención (settings.AGENDA_HOURS), del más temprano al más tardío. Se
+    devuelve uno por hueco, con la hora hasta la que sigue libre.
+    """
+    first_hour, last_hour = getattr(settings, 'AGENDA_HOURS', (8, 18))
+    opening, closing = first_hour * 60, last_hour * 60
+    if not 0 < duration <= closing - opening:
+        raise ValueError(f'La duración debe estar entre 1 y {closing - opening} minutos.')
+    if end_date < start_date:
+        raise ValueError('La fecha final debe ser posterior a la inicial.')
+    if (end_date - start_date).days >= MAX_SEARCH_DAYS:
+        raise ValueError(f'El rango de búsqueda no puede superar {MAX_SEARCH_DAYS} días.')
+    limit = max(1, min(limit, MAX_SLOTS))
+
+    names = dict(
+        (dentists() if dentist_ids is None else User.objects.filter(pk__in=dentist_ids)).values_list('pk', 'username')
+    )
+    states = occupancy.states(list(names), start_date, end_date)
+    # Los días no exactos se recorren con los intervalos de las citas
+    inexact = {key for key, (bitmap, exact) in states.items() if not exact}
+    busy = busy_intervals(sorted({user_id for user_id, day in inexact}), start_date, end_date) if inexact else {}
+    now = timezone.localtime(now)
+
+    slots = []
+    day = max(start_date, now.date())
+    while day <= end_date and len(slots) < limit:
+        day_opening = max(opening, _minutes(now) + 1) if day == now.date() else opening
+        candidates = []
+        for dentist_id, name in names.items():
+            key = (dentist_id, day)
+            if key in inexact:
+                day_gaps = gaps(busy.get(key, ()), day_opening, closing)
+            else:
+                day_gaps = occupancy.free_runs(states.get(key, occupancy.EMPTY)[0], day_opening, closing)
+            for gap_start, gap_end in day_gaps:
+                start = -(-gap_start // SLOT_STEP) * SLOT_STEP
+                if gap_end - start >= duration:
+                    candidates.append((start, name, dentist_id, gap_end))
+        for start, name, dentist_id, gap_end in sorted(candidates)[:limit - len(slots)]:
+            slots.append({
+                'dentist_id': dentist_id,
+                'dentist': name,
+                'date': day,
+                'start': _clock(start),
+                'end': _clock(start + duration),
+                'available_until': _clock(gap_end),
+            })
+        day += timedelta(days=1)
+    return slots
@@ -0,0 +1,168 @@
+"""
+Búsqueda de pacientes con un índice de texto completo FTS5 de SQLite.
+
+La tabla virtual `management_patient_search` guarda el nombre completo y el
+DNI de cada paciente (rowid = id del paciente). El tokenizador elimina los
+acentos (José = Jose) y el índice de prefijos permite buscar mientras se
+escribe. Los signals la mantienen sincronizada; `rebuild_patient_search`
+la regenera. Si la base de datos no es SQLite con FTS5, `search_patients`
+devuelve None y la vista usa el filtro icontains de siempre.
+"""
+
+import logging
+import re
+
+from django.db import DatabaseError, connection
+
+from .models import Patient
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'management_patient_search'
+
+MAX_RESULTS = 200
+
+_available = None
+_table_ready = False
+
+
+def is_available():
+    """True si la base de datos es SQLite con soporte FTS5 (se comprueba una vez)."""
+    global _available
+    if _available is None:
+        _available = False
+        if connection.vendor == 'sqlite':
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+                    compiled = cursor.fetchone()[0]
+                    if not compiled:
+                        # Algunas compilaciones cargan FTS5 sin la opción explícita
+                        cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+                        cursor.execute("DROP TABLE temp.fts5_probe")
+                _available = True
+            except DatabaseError:
+                logger.warning("⚠️ FTS5 no disponible: la búsqueda de pacientes usará icontains")
+    return _available
+
+
+def ensure_table():
+    """Crea la tabla virtual si no existe."""
+    global _table_ready
+    if not is_available():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "name, id_number, "
+            "tokenize = 'unicode61 remove_diacritics 2', "
+            "prefix = '2 3 4'"
+            ")"
+        )
+    _table_ready = True
+    return True
+
+
+def table_ready():
+    """
+    True si el índice se puede usar. Comprueba que la tabla existe una sola
+    vez por proceso (la crea el post_migrate), sin ejecutar DDL en cada
+    guardado o búsqueda.
+    """
+    global _table_ready
+    if _table_ready:
+        return True
+    if not is_available():
+        return False
+    if TABLE in connection.introspection.table_names():
+        _table_ready = True
+        return True
+    return ensure_table()
+
+
+def _document(patient):
+    name = ' '.join(filter(None, [
+        patient.first_name, patient.paternal_surname, patient.maternal_surname,
+    ]))
+    return name, patient.id_number or ''
+
+
+def index_patient(patient):
+    """Inserta o reemplaza el documento de un paciente."""
+    if not table_ready():
+        return
+    name, id_number = _document(patient)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [patient.pk])
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, name, id_number) VALUES (%s, %s, %s)",
+            [patient.pk, name, id_number],
+        )
+
+
+def index_new_patients(patients):
+    """Agrega en lote documentos de pacientes recién creados (importación masiva)."""
+    if not table_ready():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (rowid, name, id_number) VALUES (%s, %s, %s)",
+            [(patient.pk, *_document(patient)) for patient in patients],
+        )
+
+
+def remove_patient(patient_id):
+    if not table_ready():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [patient_id])
+
+
+def rebuild(chunk_size=2000):
+    """Regenera el índice completo a partir de la tabla de pacientes."""
+    if not ensure_table():
+        return None
+    count = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        batch = []
+        for patient in Patient.objects.only(
+            'first_name', 'paternal_surname', 'maternal_surname', 'id_number'
+        ).order_by('pk').iterator(chunk_size=chunk_size):
+            batch.append((patient.pk, *_document(patient)))
+            if len(batch) >= chunk_size:
+                cursor.executemany(f"INSERT INTO {TABLE} (rowid, name, id_number) VALUES (%s, %s, %s)", batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(f"INSERT INTO {TABLE} (rowid, name, id_number) VALUES (%s, %s, %s)", batch)
+            count += len(batch)
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+    return count
+
+
+def match_expression(query):
+    """
+    Convierte el texto del usuario en una expresión MATCH: cada palabra se
+    busca como prefijo y todas deben aparecer ("jose"* "gar"*).
+    """
+    tokens = re.findall(r'\w+', query, flags=re.UNICODE)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_patients(query, limit=MAX_RESULTS):
+    """
+    Ids de pacientes ordenados por relevancia (bm25), o None si FTS5 no está
+    disponible y hay que usar la búsqueda tradicional.
+    """
+    if not table_ready():
+        return None
+    expression = match_expression(query)
+    if not expression:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s ORDER BY rank LIMIT %s",
+            [expression, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
@@ -1,7 +1,11 @@
-from django.db.models.signals import post_save
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete, post_migrate
 from django.dispatch import receiver
 from django.db import transaction
-from .models import Patient, ClinicalHistory, Tooth
+from django.utils import timezone
+from decimal import Decimal
+from .models import Patient, ClinicalHistory, Tooth, Consultation, Procedure, ToothProcedure, Payment, Appointment
+from . import stats, revenue, productivity, fragments, search, odontogram, odontogram_history, recurrence, occupancy, procedure_effects
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,6 +27,10 @@ def create_history_and_teeth(sender, instance, created, **kwargs):
                 history = ClinicalHistory.objects.create(patient=instance)
                 logger.info(f"✅ Historia Clínica creada para {instance}")
 
+            # Odontograma empaquetado: los dientes se crean al aplicarles un procedimiento
+            if odontogram.is_packed():
+                return
+
             # Verificar si ya tiene dientes antes de crearlos
             if history.teeth.exists():
                 logger.info(f"ℹ️ Los dientes ya existen para {instance}")
@@ -52,6 +60,9 @@ def create_teeth_if_missing(sender, instance, created, **kwargs):
     
     Solo crea dientes si NO existen, evitando duplicados.
     """
+    if odontogram.is_packed():
+        return
+
     # Solo ejecutar si no hay dientes
     if instance.teeth.count() == 0:
         try:
@@ -71,4 +82,325 @@ def create_teeth_if_missing(sender, instance, created, **kwargs):
     elif instance.teeth.count() < 32:
         logger.warning(
             f"⚠️ Historia de {instance.patient} tiene solo {instance.teeth.count()} dientes"
-        )
\ No newline at end of file
+        )
+
+
+@receiver(pre_save, sender=Tooth)
+def remember_previous_tooth_status(sender, instance, **kwargs):
+    instance._previous_status = None
+    if instance.pk:
+        instance._previous_status = Tooth.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Tooth)
+def pack_tooth_status(sender, instance, **kwargs):
+    """Refleja el estado del diente en el odontograma empaquetado de la historia."""
+    odontogram.set_status(instance.history_id, instance.number_ada, instance.status)
+
+
+@receiver(post_save, sender=Tooth)
+def record_tooth_status_change(sender, instance, **kwargs):
+    """
+    Anota el cambio en el historial del odontograma. Las vistas indican la
+    consulta en curso con `tooth._consultation_id`.
+    """
+    previous = getattr(instance, '_previous_status', None)
+    if previous is not None and previous != instance.status:
+        odontogram_history.record(
+            instance.history_id,
+            instance.number_ada,
+            previous,
+            instance.status,
+            consultation_id=getattr(instance, '_consultation_id', None),
+        )
+
+
+# --- Estadísticas del dashboard (ClinicStats) ---
+
+@receiver(post_save, sender=Patient)
+def stats_patient_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.apply_delta(total_patients=1)
+
+
+@receiver(post_delete, sender=Patient)
+def stats_patient_deleted(sender, instance, **kwargs):
+    stats.apply_delta(total_patients=-1)
+
+
+@receiver(pre_save, sender=Consultation)
+def remember_previous_consultation(sender, instance, **kwargs):
+    """Guarda el costo, odontólogo y fecha previos para actualizar los agregados."""
+    instance._previous_consultation = None
+    if instance.pk:
+        instance._previous_consultation = Consultation.objects.filter(
+            pk=instance.pk
+        ).values('total_cost', 'user_id', 'date').first()
+
+
+@receiver(post_save, sender=Consultation)
+def stats_consultation_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_consultation', None)
+    previous_cost = previous['total_cost'] if previous else None
+    if created or previous_cost is None:
+        stats.apply_delta(
+            total_consultations=1,
+            pending_balance_count=int(stats.is_outstanding(instance.total_cost, Decimal('0.00'))),
+        )
+    elif previous_cost != instance.total_cost:
+        paid = stats.consultation_paid(instance.pk)
+        delta = (int(stats.is_outstanding(instance.total_cost, paid))
+                 - int(stats.is_outstanding(previous_cost, paid)))
+        if delta:
+            stats.apply_delta(pending_balance_count=delta)
+
+
+@receiver(post_delete, sender=Consultation)
+def stats_consultation_deleted(sender, instance, **kwargs):
+    # Los pagos protegen a la consulta, así que al borrarla no tiene pagos
+    stats.apply_delta(
+        total_consultations=-1,
+        pending_balance_count=-int(stats.is_outstanding(instance.total_cost, Decimal('0.00'))),
+    )
+
+
+@receiver(post_save, sender=ToothProcedure)
+def stats_tooth_procedure_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.apply_delta(total_procedures=1)
+
+
+@receiver(post_delete, sender=ToothProcedure)
+def stats_tooth_procedure_deleted(sender, instance, **kwargs):
+    stats.apply_delta(total_procedures=-1)
+
+
+def _payment_stats_delta(payment, amount_delta, previous=None):
+    """
+    Aplica a las estadísticas el efecto de cambiar en `amount_delta` lo pagado.
+
+    Si el pago se editó, `previous` es su estado anterior: se revierte el par
+    (monto, fecha) previo y se suma el nuevo, por si cambió de mes.
+    """
+    total_cost = Consultation.objects.filter(
+        pk=payment.consultation_id
+    ).values_list('total_cost', flat=True).first()
+    pending_delta = 0
+    if total_cost is not None:
+        paid = stats.consultation_paid(payment.consultation_id)
+        pending_delta = (int(stats.is_outstanding(total_cost, paid))
+                         - int(stats.is_outstanding(total_cost, paid - amount_delta)))
+    if previous:
+        stats.apply_delta(
+            income=payment.amount,
+            paid_at=payment.payment_date,
+            reverted_income=previous['amount'],
+            reverted_paid_at=previous['payment_date'],
+            pending_balance_count=pending_delta,
+        )
+    else:
+        stats.apply_delta(
+            income=amount_delta,
+            paid_at=payment.payment_date,
+            pending_balance_count=pending_delta,
+        )
+
+
+@receiver(pre_save, sender=Payment)
+def remember_previous_payment(sender, instance, **kwargs):
+    """Guarda el estado previo del pago para revertirlo en los agregados."""
+    instance._previous_payment = None
+    if instance.pk:
+        instance._previous_payment = Payment.objects.filter(pk=instance.pk).values(
+            'amount', 'method', 'payment_date', 'consultation__user'
+        ).first()
+
+
+@receiver(post_save, sender=Payment)
+def stats_payment_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_payment', None)
+    previous_amount = previous['amount'] if previous else Decimal('0.00')
+    amount_delta = instance.amount - previous_amount
+    if amount_delta or (previous and previous['payment_date'] != instance.payment_date):
+        _payment_stats_delta(instance, amount_delta, previous)
+
+
+@receiver(post_delete, sender=Payment)
+def stats_payment_deleted(sender, instance, **kwargs):
+    _payment_stats_delta(instance, -instance.amount)
+
+
+# --- Agregados de ingresos (RevenueRollup) ---
+
+@receiver(post_save, sender=Payment)
+def revenue_payment_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_payment', None)
+    if previous:
+        revenue.record_payment(
+            -previous['amount'], previous['method'],
+            previous['consultation__user'], previous['payment_date'], count=-1,
+        )
+    user_id = Consultation.objects.filter(
+        pk=instance.consultation_id
+    ).values_list('user_id', flat=True).first()
+    revenue.record_payment(instance.amount, instance.method, user_id, instance.payment_date)
+
+
+@receiver(post_delete, sender=Payment)
+def revenue_payment_deleted(sender, instance, **kwargs):
+    user_id = Consultation.objects.filter(
+        pk=instance.consultation_id
+    ).values_list('user_id', flat=True).first()
+    revenue.record_payment(
+        -instance.amount, instance.method, user_id, instance.payment_date, count=-1,
+    )
+
+
+@receiver(post_save, sender=Consultation)
+def revenue_consultation_reassigned(sender, instance, created, **kwargs):
+    """Mueve los pagos de la consulta a los agregados del nuevo odontólogo."""
+    previous = getattr(instance, '_previous_consultation', None)
+    if not previous or previous['user_id'] == instance.user_id:
+        return
+    for amount, method, payment_date in instance.payments.values_list('amount', 'method', 'payment_date'):
+        revenue.record_payment(-amount, method, previous['user_id'], payment_date, count=-1)
+        revenue.record_payment(amount, method, instance.user_id, payment_date)
+
+
+@receiver(pre_delete, sender=User)
+def revenue_user_deleted(sender, instance, **kwargs):
+    # Sus consultas quedan con user=NULL; los ingresos no deben desaparecer
+    revenue.merge_user_rollups(instance.pk)
+
+
+# --- Productividad diaria por odontólogo (DentistDailyStats) ---
+
+def _local_day(value):
+    return timezone.localdate(value) if value else None
+
+
+@receiver(post_save, sender=Consultation)
+@receiver(post_delete, sender=Consultation)
+def productivity_consultation_changed(sender, instance, **kwargs):
+    pairs = [(instance.user_id, _local_day(instance.date))]
+    previous = getattr(instance, '_previous_consultation', None)
+    if previous:
+        pairs.append((previous['user_id'], _local_day(previous['date'])))
+    productivity.refresh_days(pairs)
+
+
+@receiver(post_save, sender=ToothProcedure)
+@receiver(post_delete, sender=ToothProcedure)
+def productivity_tooth_procedure_changed(sender, instance, **kwargs):
+    consultation = Consultation.objects.filter(
+        pk=instance.consultation_id
+    ).values('user_id', 'date').first()
+    if consultation:
+        productivity.refresh_days([(consultation['user_id'], _local_day(consultation['date']))])
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def productivity_payment_changed(sender, instance, **kwargs):
+    user_id = Consultation.objects.filter(
+        pk=instance.consultation_id
+    ).values_list('user_id', flat=True).first()
+    pairs = [(user_id, _local_day(instance.payment_date))]
+    previous = getattr(instance, '_previous_payment', None)
+    if previous:
+        pairs.append((previous['consultation__user'], _local_day(previous['payment_date'])))
+    productivity.refresh_days(pairs)
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_previous_appointment(sender, instance, **kwargs):
+    instance._previous_appointment = None
+    if instance.pk:
+        instance._previous_appointment = Appointment.objects.filter(
+            pk=instance.pk
+        ).values('user_id', 'date').first()
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def productivity_appointment_changed(sender, instance, **kwargs):
+    pairs = [(instance.user_id, instance.date)]
+    previous = getattr(instance, '_previous_appointment', None)
+    if previous:
+        pairs.append((previous['user_id'], previous['date']))
+    productivity.refresh_days(pairs)
+
+
+# --- Ocupación de la agenda (DentistDayOccupancy, occupancy.py) ---
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def occupancy_appointment_changed(sender, instance, **kwargs):
+    pairs = [(instance.user_id, instance.date)]
+    previous = getattr(instance, '_previous_appointment', None)
+    if previous:
+        pairs.append((previous['user_id'], previous['date']))
+    occupancy.refresh_days(pairs)
+
+
+# --- Invalidación de fragmentos en caché (fragments.py) ---
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def fragments_patient_changed(sender, instance, **kwargs):
+    fragments.bump_on_commit('patient')
+
+
+@receiver(post_save, sender=Consultation)
+@receiver(post_delete, sender=Consultation)
+@receiver(post_save, sender=ToothProcedure)
+@receiver(post_delete, sender=ToothProcedure)
+def fragments_consultation_changed(sender, instance, **kwargs):
+    fragments.bump_on_commit('consultation')
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def fragments_payment_changed(sender, instance, **kwargs):
+    fragments.bump_on_commit('payment')
+
+
+@receiver(post_save, sender=Procedure)
+@receiver(post_delete, sender=Procedure)
+def fragments_procedure_changed(sender, instance, **kwargs):
+    fragments.bump_on_commit('procedure')
+
+
+@receiver(post_migrate)
+def backfill_procedure_effects(sender, **kwargs):
+    # Las instalaciones existentes conservan el efecto que antes se deducía del nombre
+    if sender.name == 'management':
+        for procedure in procedure_effects.backfill_legacy():
+            logger.info(f"✅ Efecto de '{procedure.name}': {procedure.get_resulting_status_display()}")
+
+
+# --- Índice de búsqueda de pacientes (FTS5, search.py) ---
+
+@receiver(post_migrate)
+def create_patient_search_table(sender, **kwargs):
+    if sender.name == 'management':
+        search.ensure_table()
+
+
+@receiver(post_save, sender=Patient)
+def search_index_patient(sender, instance, **kwargs):
+    search.index_patient(instance)
+
+
+@receiver(post_delete, sender=Patient)
+def search_remove_patient(sender, instance, **kwargs):
+    search.remove_patient(instance.pk)
+
+
+# --- Series de citas (recurrence.py) ---
+
+@receiver(post_delete, sender=Appointment)
+def exclude_deleted_occurrence(sender, instance, **kwargs):
+    """Borrar una ocurrencia guardada la quita de la serie (si no, volvería a calcularse)."""
+    if instance.series_id and instance.occurrence_date:
+        recurrence.exclude(instance.series_id, instance.occurrence_date)
@@ -0,0 +1,108 @@
+"""
+Mantenimiento de la instantánea de estadísticas del dashboard (ClinicStats).
+
+Los signals llaman a `apply_delta` con los cambios de cada escritura; el
+dashboard solo lee la fila con `get_stats`. `rebuild_stats` recalcula todo
+desde cero (comando `rebuild_stats`).
+"""
+
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import ClinicStats, Consultation, Patient, Payment, ToothProcedure
+
+
+def current_month_start():
+    """Primer día del mes actual (zona horaria local)."""
+    return timezone.localdate().replace(day=1)
+
+
+def is_outstanding(total_cost, total_paid):
+    """Una consulta está pendiente si tiene costo y no está cubierta por los pagos."""
+    return total_cost != 0 and (total_paid or Decimal('0.00')) < total_cost
+
+
+def consultation_paid(consultation_id):
+    """Suma de pagos registrados para una consulta."""
+    return Payment.objects.filter(consultation_id=consultation_id).aggregate(
+        total=Sum('amount')
+    )['total'] or Decimal('0.00')
+
+
+def rebuild_stats():
+    """Recalcula la instantánea completa a partir de las tablas."""
+    month = current_month_start()
+    month_start = timezone.make_aware(datetime.combine(month, time.min))
+
+    monthly_income = Payment.objects.filter(
+        payment_date__gte=month_start
+    ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+
+    pending_balance_count = Consultation.objects.annotate(
+        total_paid=Sum('payments__amount')
+    ).filter(
+        Q(total_paid__lt=F('total_cost')) | Q(total_paid__isnull=True)
+    ).exclude(total_cost=0).count()
+
+    with transaction.atomic():
+        stats, _ = ClinicStats.objects.select_for_update().get_or_create(
+            pk=ClinicStats.SINGLETON_PK
+        )
+        stats.total_patients = Patient.objects.count()
+        stats.total_consultations = Consultation.objects.count()
+        stats.total_procedures = ToothProcedure.objects.count()
+        stats.monthly_income = monthly_income
+        stats.income_month = month
+        stats.pending_balance_count = pending_balance_count
+        stats.save()
+    return stats
+
+
+def get_stats():
+    """Devuelve la instantánea (una búsqueda por pk), creándola si no existe."""
+    stats = ClinicStats.objects.filter(pk=ClinicStats.SINGLETON_PK).first()
+    if stats is None:
+        stats = rebuild_stats()
+    if stats.income_month != current_month_start():
+        # Aún no hay pagos en el mes en curso
+        stats.monthly_income = Decimal('0.00')
+    return stats
+
+
+def apply_delta(income=Decimal('0.00'), paid_at=None,
+                reverted_income=Decimal('0.00'), reverted_paid_at=None, **counts):
+    """
+    Aplica cambios incrementales a la instantánea.
+
+    `counts` son incrementos de los contadores (total_patients=1, ...).
+    `income` se suma a los ingresos del mes solo si `paid_at` cae en el mes
+    en curso; `reverted_income` se resta con la misma regla según
+    `reverted_paid_at` (el estado previo de un pago editado). Debe llamarse
+    dentro de la transacción de la escritura original.
+    """
+    with transaction.atomic():
+        stats = ClinicStats.objects.select_for_update().filter(
+            pk=ClinicStats.SINGLETON_PK
+        ).first()
+        if stats is None:
+            # La reconstrucción ya refleja la escritura que disparó el cambio
+            rebuild_stats()
+            return
+
+        for field, delta in counts.items():
+            setattr(stats, field, max(getattr(stats, field) + delta, 0))
+
+        for amount, day in ((-reverted_income, reverted_paid_at), (income, paid_at)):
+            if amount and day is not None:
+                month = timezone.localdate(day).replace(day=1)
+                if month == current_month_start():
+                    if stats.income_month != month:
+                        stats.income_month = month
+                        stats.monthly_income = Decimal('0.00')
+                    stats.monthly_income = max(stats.monthly_income + amount, Decimal('0.00'))
+
+        stats.save()
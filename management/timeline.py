@@ -0,0 +1,178 @@
+"""
+Línea de tiempo de un paciente: consultas, procedimientos, pagos y citas
+mezclados del más reciente al más antiguo.
+
+Cada fuente hace una sola consulta acotada (LIMIT página + 1) que continúa
+desde el cursor, y heapq.merge mezcla los cuatro flujos ya ordenados sin
+cargar el historial completo. El orden total es (fecha, tipo, id), así que el
+cursor es el último evento mostrado.
+
+Los procedimientos y los pagos se filtran por el paciente de su consulta, así
+que sus filas vienen de varias consultas y hay que ordenarlas: primero se
+eligen los ids de la página con el índice (consulta, fecha, id), que cubre la
+consulta, y después se leen solo esas filas.
+"""
+
+import heapq
+from datetime import datetime
+from itertools import islice
+
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Appointment, Consultation, Payment, ToothProcedure
+from .pagination import decode_cursor, encode_cursor
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Desempate entre eventos con la misma fecha (mayor = aparece antes)
+KIND_RANK = {'appointment': 0, 'consultation': 1, 'procedure': 2, 'payment': 3}
+
+
+def _before(kind, bound, strictly_earlier, same_time):
+    """
+    Condición "después del cursor" en orden descendente para una fuente:
+    fecha anterior, o misma fecha y (tipo, id) menor.
+    """
+    if bound is None:
+        return Q()
+    timestamp, rank, pk = bound
+    own_rank = KIND_RANK[kind]
+    condition = strictly_earlier(timestamp)
+    if own_rank < rank:
+        condition |= same_time(timestamp)
+    elif own_rank == rank:
+        condition |= same_time(timestamp) & Q(pk__lt=pk)
+    return condition
+
+
+def _datetime_field(field):
+    return (
+        lambda timestamp: Q(**{f'{field}__lt': timestamp}),
+        lambda timestamp: Q(**{field: timestamp}),
+    )
+
+
+def _appointment_fields():
+    def local(timestamp):
+        timestamp = timezone.localtime(timestamp)
+        return timestamp.date(), timestamp.time()
+
+    def strictly_earlier(timestamp):
+        day, time = local(timestamp)
+        return Q(date__lt=day) | Q(date=day, start_time__lt=time)
+
+    def same_time(timestamp):
+        day, time = local(timestamp)
+        return Q(date=day, start_time=time)
+
+    return strictly_earlier, same_time
+
+
+def _page_ids(queryset, ordering, limit):
+    """Ids de la página ordenados solo con las columnas del índice."""
+    return list(queryset.order_by(*ordering).values_list('pk', flat=True)[:limit])
+
+
+def _consultations(patient_id, bound, limit):
+    queryset = Consultation.objects.filter(patient_id=patient_id).filter(
+        _before('consultation', bound, *_datetime_field('date'))
+    ).select_related('user').only(
+        'date', 'reason', 'total_cost', 'balance', 'user__username',
+    ).order_by('-date', '-pk')[:limit]
+    for consultation in queryset:
+        yield (consultation.date, KIND_RANK['consultation'], consultation.pk, {
+            'type': 'consultation',
+            'title': 'Consulta',
+            'detail': consultation.reason,
+            'amount': consultation.total_cost,
+            'balance': consultation.balance,
+            'dentist': consultation.user.username if consultation.user else None,
+            'url': reverse('consultation_detail', args=[consultation.pk]),
+        })
+
+
+def _procedures(patient_id, bound, limit):
+    ordering = ('-created_at', '-pk')
+    ids = _page_ids(ToothProcedure.objects.filter(consultation__patient_id=patient_id).filter(
+        _before('procedure', bound, *_datetime_field('created_at'))
+    ), ordering, limit)
+    queryset = ToothProcedure.objects.filter(pk__in=ids).select_related('procedure', 'tooth').only(
+        'created_at', 'consultation_id', 'price_charged', 'procedure__name', 'tooth__number_ada',
+    ).order_by(*ordering)
+    for item in queryset:
+        yield (item.created_at, KIND_RANK['procedure'], item.pk, {
+            'type': 'procedure',
+            'title': 'Procedimiento',
+            'detail': f'{item.procedure.name} en diente {item.tooth.number_ada}',
+            'amount': item.price_charged,
+            'url': reverse('consultation_detail', args=[item.consultation_id]),
+        })
+
+
+def _payments(patient_id, bound, limit):
+    ordering = ('-payment_date', '-pk')
+    ids = _page_ids(Payment.objects.filter(consultation__patient_id=patient_id).filter(
+        _before('payment', bound, *_datetime_field('payment_date'))
+    ), ordering, limit)
+    queryset = Payment.objects.filter(pk__in=ids).only(
+        'payment_date', 'consultation_id', 'amount', 'method',
+    ).order_by(*ordering)
+    for payment in queryset:
+        yield (payment.payment_date, KIND_RANK['payment'], payment.pk, {
+            'type': 'payment',
+            'title': 'Pago',
+            'detail': payment.get_method_display(),
+            'amount': payment.amount,
+            'url': reverse('consultation_detail', args=[payment.consultation_id]),
+        })
+
+
+def _appointments(patient_id, bound, limit):
+    queryset = Appointment.objects.filter(patient_id=patient_id).filter(
+        _before('appointment', bound, *_appointment_fields())
+    ).only(
+        'date', 'start_time', 'end_time', 'reason', 'status',
+    ).order_by('-date', '-start_time', '-pk')[:limit]
+    for appointment in queryset:
+        start = timezone.make_aware(datetime.combine(appointment.date, appointment.start_time))
+        yield (start, KIND_RANK['appointment'], appointment.pk, {
+            'type': 'appointment',
+            'title': 'Cita',
+            'detail': appointment.reason,
+            'status': appointment.get_status_display(),
+            'url': reverse('appointment_detail', args=[appointment.pk]),
+        })
+
+
+SOURCES = (_consultations, _procedures, _payments, _appointments)
+
+
+def patient_timeline(patient_id, after=None, limit=DEFAULT_LIMIT):
+    """
+    Una página de eventos del paciente, del más reciente al más antiguo.
+    Devuelve {'events': [...], 'next': cursor o None}.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    bound = decode_cursor(after, 3) if after else None
+    if bound is not None and not (
+        isinstance(bound[0], datetime) and isinstance(bound[1], int) and isinstance(bound[2], int)
+    ):
+        # Cursor inválido: primera página, como en los listados
+        bound = None
+
+    streams = [source(patient_id, bound, limit + 1) for source in SOURCES]
+    merged = heapq.merge(*streams, key=lambda event: event[:3], reverse=True)
+    page = list(islice(merged, limit + 1))
+
+    events = [
+        {'id': pk, 'date': timestamp, **payload}
+        for timestamp, _, pk, payload in page[:limit]
+    ]
+    next_cursor = None
+    if len(page) > limit:
+        timestamp, rank, pk, _ = page[limit - 1]
+        next_cursor = encode_cursor([timestamp, rank, pk])
+    return {'events': events, 'next': next_cursor}
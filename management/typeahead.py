@@ -0,0 +1,125 @@
+"""
+Índice en memoria para el autocompletado de pacientes.
+
+Cada proceso guarda una lista ordenada de claves (palabras del nombre sin
+acentos y en minúsculas, más el DNI) y busca por prefijo con bisect, sin
+consultar la base de datos. El índice se reconstruye cuando cambia la versión
+'patient' de fragments.py, que los signals incrementan al guardar o borrar
+un paciente. Esa versión solo la comparten los procesos si la caché es
+compartida (file, la configuración por defecto); con LocMemCache cada proceso
+compara en su lugar la última modificación y el número de pacientes (una
+consulta agregada por búsqueda), que sí ven los cambios de otros procesos.
+"""
+
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+
+from django.db.models import Count, Max
+
+from . import fragments
+from .models import Patient
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+_lock = threading.Lock()
+_index = None
+
+
+def normalize(text):
+    """Minúsculas y sin acentos (José → jose)."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    return re.findall(r'\w+', normalize(text))
+
+
+class PatientIndex:
+    """Claves ordenadas → id de paciente, y etiqueta de cada paciente."""
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.labels = {}
+        self.tokens = {}
+        entries = []
+        for pk, first_name, paternal, maternal, id_number in rows:
+            label = ' '.join(filter(None, [first_name, paternal, maternal]))
+            self.labels[pk] = (label, id_number or '')
+            tokens = set(tokenize(label))
+            if id_number:
+                tokens.add(normalize(id_number))
+            self.tokens[pk] = tokens
+            entries.extend((token, pk) for token in tokens)
+        entries.sort()
+        self.keys = [token for token, _ in entries]
+        self.ids = [pk for _, pk in entries]
+
+    def _prefix_matches(self, prefix):
+        position = bisect_left(self.keys, prefix)
+        while position < len(self.keys) and self.keys[position].startswith(prefix):
+            yield self.ids[position]
+            position += 1
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """
+        Pacientes cuyas palabras empiezan por cada una de las del texto. Se
+        recorre el rango de la palabra más larga (la más selectiva) y se
+        descartan los que no tienen las demás.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        terms.sort(key=len, reverse=True)
+        first, rest = terms[0], terms[1:]
+
+        results = []
+        seen = set()
+        for pk in self._prefix_matches(first):
+            if pk in seen:
+                continue
+            seen.add(pk)
+            tokens = self.tokens[pk]
+            if all(any(token.startswith(term) for token in tokens) for term in rest):
+                results.append(pk)
+                if len(results) >= limit:
+                    break
+        return [
+            {'id': pk, 'label': self.labels[pk][0], 'id_number': self.labels[pk][1]}
+            for pk in results
+        ]
+
+
+def _build(version):
+    rows = Patient.objects.order_by().values_list(
+        'pk', 'first_name', 'paternal_surname', 'maternal_surname', 'id_number',
+    )
+    return PatientIndex(version, rows.iterator(chunk_size=2000))
+
+
+def _current_version():
+    if fragments.is_shared():
+        return fragments.versions()['patient']
+    state = Patient.objects.aggregate(changed=Max('updated_at'), count=Count('pk'))
+    return state['changed'], state['count']
+
+
+def get_index():
+    """Índice vigente; se reconstruye si los pacientes cambiaron."""
+    global _index
+    version = _current_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _lock:
+        if _index is None or _index.version != version:
+            _index = _build(version)
+        return _index
+
+
+def search(query, limit=DEFAULT_LIMIT):
+    limit = max(1, min(limit, MAX_LIMIT))
+    return get_index().search(query, limit)
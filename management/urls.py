@@ -5,10 +5,19 @@ urlpatterns = [
     # Dashboard
     path('', views.dashboard, name='dashboard'),
 
+    # Reportes
+    path('reports/revenue/', views.revenue_report, name='revenue_report'),
+    path('reports/aging/', views.aging_report, name='aging_report'),
+    path('reports/productivity/', views.dentist_productivity_report, name='dentist_productivity_report'),
+    path('reports/pricing/', views.pricing_report, name='pricing_report'),
+    path('reports/export/', views.clinical_export, name='clinical_export'),
+
     # Pacientes
     path('patients/', views.patient_list, name='patient_list'),
+    path('patients/typeahead/', views.patient_typeahead, name='patient_typeahead'),
     path('patients/create/', views.patient_create, name='patient_create'),
     path('patients/<int:pk>/', views.patient_detail, name='patient_detail'),
+    path('patients/<int:pk>/timeline/', views.patient_timeline, name='patient_timeline'),
     path('patients/<int:pk>/edit/', views.patient_edit, name='patient_edit'),
     path('patients/<int:pk>/delete/', views.patient_delete, name='patient_delete'),
 
@@ -34,7 +43,12 @@ urlpatterns = [
     
     # Citas / Agenda
     path('appointments/', views.appointment_calendar, name='appointment_calendar'),
+    path('appointments/feed/', views.appointment_feed, name='appointment_feed'),
+    path('appointments/free-slots/', views.appointment_free_slots, name='appointment_free_slots'),
+    path('appointments/occupancy/', views.appointment_occupancy, name='appointment_occupancy'),
     path('appointments/create/', views.appointment_create, name='appointment_create'),
+    path('appointments/series/create/', views.appointment_series_create, name='appointment_series_create'),
+    path('appointments/series/<int:series_pk>/<str:day>/', views.appointment_occurrence, name='appointment_occurrence'),
     path('appointments/<int:pk>/', views.appointment_detail, name='appointment_detail'),
     path('appointments/<int:pk>/edit/', views.appointment_edit, name='appointment_edit'),
     path('appointments/<int:pk>/delete/', views.appointment_delete, name='appointment_delete'),
@@ -1,13 +1,34 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.core.exceptions import ImproperlyConfigured
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db.models import Q, Sum, Count, F
-from django.db import models
-from django.http import JsonResponse
+from django.db.models import Q
+from django.db import models, transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
-from decimal import Decimal
-from .models import Patient, ClinicalHistory, Tooth, Consultation, Procedure, ToothProcedure, Payment, Appointment
-from .forms import PatientForm, ClinicalHistoryForm, ConsultationForm, ProcedureForm, ToothProcedureForm, PaymentForm, AppointmentForm
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from .models import Patient, ClinicalHistory, Consultation, Procedure, ToothProcedure, Payment, Appointment, AppointmentSeries
+from .forms import PatientForm, ClinicalHistoryForm, ConsultationForm, ProcedureForm, ToothProcedureForm, PaymentForm, AppointmentForm, AppointmentSeriesForm
+from .stats import get_stats
+from .revenue import revenue_series
+from .reports import aging_rows, stream_csv
+from .export import export_gzip, parse_since
+from .productivity import productivity_report
+from .pricing import pricing_analysis
+from .search import search_patients
+from .duplicates import find_duplicates
+from .timeline import patient_timeline as build_patient_timeline
+from .odontogram_history import teeth_after_consultation
+from . import typeahead, odontogram, procedure_effects, agenda, scheduling, recurrence, occupancy
+from .pagination import KeysetPaginator
+from . import fragments
+
+
+# Filas por página en los listados paginados
+PAGE_SIZE = 25
 
 
 # DASHBOARD
@@ -15,43 +36,126 @@ from .forms import PatientForm, ClinicalHistoryForm, ConsultationForm, Procedure
 @login_required
 def dashboard(request):
     """Dashboard principal con estadísticas generales."""
-    total_patients = Patient.objects.count()
-    total_consultations = Consultation.objects.count()
-    total_procedures = ToothProcedure.objects.count()
+    # Contadores e ingresos del mes desde la instantánea (una fila por pk)
+    stats = get_stats()
 
+    # Los querysets son perezosos: solo se evalúan si el fragmento no está en caché
     # Consultas recientes
     recent_consultations = Consultation.objects.select_related('patient', 'user').order_by('-date')[:5]
 
     # Pacientes recientes
     recent_patients = Patient.objects.order_by('-created_at')[:5]
 
-    # Ingresos del mes actual
-    current_month = timezone.now().month
-    current_year = timezone.now().year
-    monthly_income = Payment.objects.filter(
-        payment_date__month=current_month,
-        payment_date__year=current_year
-    ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-
     # Consultas pendientes de pago
-    pending_consultations = Consultation.objects.annotate(
-        total_paid=Sum('payments__amount')
-    ).filter(
-        Q(total_paid__lt=F('total_cost')) | Q(total_paid__isnull=True)
-    ).exclude(total_cost=0)[:5]
+    pending_consultations = Consultation.objects.filter(
+        balance__gt=0
+    ).select_related('patient').order_by('-date')[:5]
 
     context = {
-        'total_patients': total_patients,
-        'total_consultations': total_consultations,
-        'total_procedures': total_procedures,
-        'monthly_income': monthly_income,
+        'total_patients': stats.total_patients,
+        'total_consultations': stats.total_consultations,
+        'total_procedures': stats.total_procedures,
+        'monthly_income': stats.monthly_income,
+        'pending_balance_count': stats.pending_balance_count,
         'recent_consultations': recent_consultations,
         'recent_patients': recent_patients,
         'pending_consultations': pending_consultations,
+        'fragment_cache': fragments.context(),
     }
     return render(request, 'management/dashboard.html', context)
 
 
+# REPORTES
+
+@login_required
+def revenue_report(request):
+    """
+    Tendencia de ingresos en JSON a partir de los agregados por periodo.
+    Parámetros: period (D/W/M), buckets (número de periodos), group (method/dentist).
+    """
+    period = request.GET.get('period', 'M')
+    group_by = request.GET.get('group') or None
+    try:
+        buckets = int(request.GET.get('buckets', 0)) or None
+        data = revenue_series(period=period, buckets=buckets, group_by=group_by)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(data)
+
+
+@login_required
+def aging_report(request):
+    """Antigüedad de saldos pendientes por paciente (0-30/31-60/61-90/90+ días) en CSV."""
+    response = StreamingHttpResponse(
+        stream_csv(aging_rows()),
+        content_type='text/csv; charset=utf-8',
+    )
+    filename = f"antiguedad_saldos_{timezone.localdate():%Y%m%d}.csv"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+def dentist_productivity_report(request):
+    """
+    Productividad por odontólogo en JSON a partir de los agregados diarios.
+    Parámetros: period (day/month), start y end (AAAA-MM-DD), dentist (id).
+    """
+    from datetime import date, timedelta
+
+    today = timezone.localdate()
+    try:
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else today
+        start = (date.fromisoformat(request.GET['start']) if request.GET.get('start')
+                 else end.replace(day=1))
+        dentist = int(request.GET['dentist']) if request.GET.get('dentist') else None
+        if end < start or (end - start) > timedelta(days=731):
+            raise ValueError('Rango de fechas inválido (máximo 2 años).')
+        rows = productivity_report(
+            start, end, period=request.GET.get('period', 'day'), user_id=dentist
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'start': start, 'end': end, 'rows': rows})
+
+
+@login_required
+def pricing_report(request):
+    """
+    Distribución de la razón precio cobrado / precio base en JSON.
+    Parámetros opcionales: start y end (AAAA-MM-DD).
+    """
+    from datetime import date
+
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    try:
+        data = pricing_analysis(start, end)
+    except ImproperlyConfigured as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    return JsonResponse(data)
+
+
+@staff_member_required
+def clinical_export(request):
+    """
+    Exportación de los datos clínicos en JSON Lines con gzip (solo personal
+    administrador). Parámetro opcional: since (AAAA-MM-DD o fecha y hora ISO)
+    para exportar solo lo creado o modificado desde entonces.
+    """
+    try:
+        since = parse_since(request.GET['since']) if request.GET.get('since') else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    response = StreamingHttpResponse(export_gzip(since=since), content_type='application/gzip')
+    filename = f"globaldent_{timezone.localtime():%Y%m%d_%H%M%S}.jsonl.gz"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 # PACIENTES
 
 @login_required
@@ -60,19 +164,36 @@ def patient_list(request):
     query = request.GET.get('q', '')
     patients = Patient.objects.all()
     
-    if query:
+    # Índice de texto completo (sin acentos, por prefijo), ordenado por relevancia
+    ranked_ids = search_patients(query) if query else None
+    
+    if ranked_ids is not None:
+        ranking = models.Case(
+            *[models.When(pk=pk, then=position) for position, pk in enumerate(ranked_ids)],
+            output_field=models.IntegerField(),
+        )
+        patients = patients.filter(pk__in=ranked_ids).order_by(ranking) if ranked_ids else patients.none()
+    elif query:
         patients = patients.filter(
             Q(first_name__icontains=query) |
             Q(paternal_surname__icontains=query) |
             Q(maternal_surname__icontains=query) |
             Q(id_number__icontains=query)
-        )
+        ).order_by('paternal_surname', 'first_name')
     
-    patients = patients.order_by('paternal_surname', 'first_name')
+    # Sin búsqueda: paginación por cursor sobre (apellido paterno, nombre, id)
+    page = None
+    if not query:
+        page = KeysetPaginator(
+            patients, ['paternal_surname', 'first_name', 'pk'], per_page=PAGE_SIZE
+        ).page(after=request.GET.get('after'), before=request.GET.get('before'))
+        patients = page
     
     context = {
         'patients': patients,
+        'page': page,
         'query': query,
+        'fragment_cache': fragments.context(),
     }
     return render(request, 'management/patient_list.html', context)
 
@@ -82,24 +203,60 @@ def patient_detail(request, pk):
     """Detalle de un paciente con su historia clínica y consultas."""
     patient = get_object_or_404(Patient, pk=pk)
     
+    consultations = patient.consultations.all().order_by('-date')
+
+    # Odontograma tal como quedó en una consulta anterior (?as_of=<id de consulta>)
+    as_of = request.GET.get('as_of', '')
+    odontogram_as_of = consultations.filter(pk=as_of).first() if as_of.isdigit() else None
+
     try:
         history = patient.history
-        teeth = history.teeth.all().order_by('number_ada')
+        if odontogram_as_of:
+            teeth = teeth_after_consultation(odontogram_as_of)
+        else:
+            teeth = odontogram.teeth_for(history)
     except ClinicalHistory.DoesNotExist:
         history = None
         teeth = []
 
-    consultations = patient.consultations.all().order_by('-date')
-
     context = {
         'patient': patient,
         'history': history,
         'teeth': teeth,
         'consultations': consultations,
+        'odontogram_as_of': odontogram_as_of,
     }
     return render(request, 'management/patient_detail.html', context)
 
 
+@login_required
+def patient_timeline(request, pk):
+    """
+    Línea de tiempo del paciente en JSON (consultas, procedimientos, pagos y citas).
+    Parámetros: after (cursor devuelto en 'next'), limit.
+    """
+    patient = get_object_or_404(Patient.objects.only('pk'), pk=pk)
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        return JsonResponse({'error': 'limit debe ser un número entero'}, status=400)
+    return JsonResponse(build_patient_timeline(patient.pk, after=request.GET.get('after'), limit=limit))
+
+
+@login_required
+def patient_typeahead(request):
+    """
+    Autocompletado de pacientes en JSON (índice en memoria, ver typeahead.py).
+    Parámetros: q (prefijo de nombre, apellidos o DNI), limit.
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = int(request.GET.get('limit', typeahead.DEFAULT_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'limit debe ser un número entero'}, status=400)
+    return JsonResponse({'results': typeahead.search(query, limit)})
+
+
 @login_required
 def patient_create(request):
     """Crear un nuevo paciente."""
@@ -107,27 +264,37 @@ def patient_create(request):
         patient_form = PatientForm(request.POST)
         history_form = ClinicalHistoryForm(request.POST)
         
-        if patient_form.is_valid() and history_form.is_valid():
-            patient = patient_form.save()
-            
-            # La historia clínica y los dientes se crean automáticamente por signals
-            # Pero actualizamos los campos adicionales si se proporcionaron
-            if hasattr(patient, 'history'):
-                history = patient.history
-                for field, value in history_form.cleaned_data.items():
-                    if value:
-                        setattr(history, field, value)
-                history.save()
+        valid = patient_form.is_valid() and history_form.is_valid()
+        
+        # Posibles duplicados (mismo bloque apellido + año): se pide confirmación
+        duplicates = []
+        if valid and not request.POST.get('confirm_duplicate'):
+            duplicates = find_duplicates(patient_form.cleaned_data)
+        
+        if valid and not duplicates:
+            with transaction.atomic():
+                patient = patient_form.save()
+                
+                # La historia clínica y los dientes se crean automáticamente por signals
+                # Pero actualizamos los campos adicionales si se proporcionaron
+                if hasattr(patient, 'history'):
+                    history = patient.history
+                    for field, value in history_form.cleaned_data.items():
+                        if value:
+                            setattr(history, field, value)
+                    history.save()
             
             messages.success(request, f'Paciente {patient} creado exitosamente.')
             return redirect('patient_detail', pk=patient.pk)
     else:
         patient_form = PatientForm()
         history_form = ClinicalHistoryForm()
+        duplicates = []
     
     context = {
         'patient_form': patient_form,
         'history_form': history_form,
+        'duplicates': duplicates,
         'action': 'Crear',
     }
     return render(request, 'management/patient_form.html', context)
@@ -174,7 +341,8 @@ def patient_delete(request, pk):
     
     if request.method == 'POST':
         patient_name = str(patient)
-        patient.delete()
+        with transaction.atomic():
+            patient.delete()
         messages.success(request, f'Paciente {patient_name} eliminado exitosamente.')
         return redirect('patient_list')
     
@@ -186,10 +354,17 @@ def patient_delete(request, pk):
 
 @login_required
 def consultation_list(request):
-    """Lista de todas las consultas."""
-    consultations = Consultation.objects.select_related('patient', 'user').order_by('-date')
+    """Lista de todas las consultas, paginada por cursor sobre (-fecha, -id)."""
+    consultations = Consultation.objects.select_related('patient', 'user')
+    page = KeysetPaginator(
+        consultations, ['-date', '-pk'], per_page=PAGE_SIZE
+    ).page(after=request.GET.get('after'), before=request.GET.get('before'))
     
-    context = {'consultations': consultations}
+    context = {
+        'consultations': page,
+        'page': page,
+        'fragment_cache': fragments.context(),
+    }
     return render(request, 'management/consultation_list.html', context)
 
 
@@ -200,14 +375,14 @@ def consultation_detail(request, pk):
     tooth_procedures = consultation.tooth_procedures.select_related('tooth', 'procedure').all()
     payments = consultation.payments.all()
     
-    # Calcular balance
-    total_paid = payments.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-    balance = consultation.total_cost - total_paid
+    # Balance desnormalizado en la consulta
+    total_paid = consultation.amount_paid
+    balance = consultation.balance
     
     # Obtener todos los dientes del paciente para el odontograma
     try:
-        teeth = consultation.patient.history.teeth.all().order_by('number_ada')
-    except:
+        teeth = odontogram.teeth_for(consultation.patient.history)
+    except ClinicalHistory.DoesNotExist:
         teeth = []
     
     context = {
@@ -233,7 +408,8 @@ def consultation_create(request, patient_pk):
             consultation = form.save(commit=False)
             consultation.patient = patient
             consultation.user = request.user
-            consultation.save()
+            with transaction.atomic():
+                consultation.save()
             
             messages.success(request, 'Consulta creada exitosamente.')
             return redirect('consultation_detail', pk=consultation.pk)
@@ -283,24 +459,15 @@ def tooth_procedure_create(request, consultation_pk):
         if form.is_valid():
             tooth_procedure = form.save(commit=False)
             tooth_procedure.consultation = consultation
-            tooth_procedure.save()
-            
-            # Actualizar el costo total de la consulta
-            consultation.total_cost = consultation.calculate_total_cost()
-            consultation.save()
-            
-            # Actualizar el estado del diente si es necesario
-            tooth = tooth_procedure.tooth
-            procedure_name = tooth_procedure.procedure.name.lower()
-            
-            if 'extracción' in procedure_name or 'extracci' in procedure_name:
-                tooth.status = 'E'
-            elif 'obturación' in procedure_name or 'resina' in procedure_name:
-                tooth.status = 'O'
-            else:
-                tooth.status = 'P'
-            
-            tooth.save()
+            with transaction.atomic():
+                tooth_procedure.save()
+                
+                # Actualizar el costo total de la consulta
+                consultation.total_cost = consultation.calculate_total_cost()
+                consultation.save()
+                
+                # Actualizar el odontograma según el efecto declarado en el catálogo
+                procedure_effects.apply(tooth_procedure, consultation_id=consultation.pk)
             
             messages.success(request, 'Procedimiento agregado exitosamente.')
             return redirect('consultation_detail', pk=consultation.pk)
@@ -321,11 +488,12 @@ def tooth_procedure_delete(request, pk):
     consultation = tooth_procedure.consultation
     
     if request.method == 'POST':
-        tooth_procedure.delete()
-        
-        # Recalcular el costo total de la consulta
-        consultation.total_cost = consultation.calculate_total_cost()
-        consultation.save()
+        with transaction.atomic():
+            tooth_procedure.delete()
+            
+            # Recalcular el costo total de la consulta
+            consultation.total_cost = consultation.calculate_total_cost()
+            consultation.save()
         
         messages.success(request, 'Procedimiento eliminado exitosamente.')
         return redirect('consultation_detail', pk=consultation.pk)
@@ -350,15 +518,15 @@ def payment_create(request, consultation_pk):
         if form.is_valid():
             payment = form.save(commit=False)
             payment.consultation = consultation
-            payment.save()
+            with transaction.atomic():
+                payment.save()
+                consultation.update_payment_totals()
             
             messages.success(request, f'Pago de ${payment.amount} registrado exitosamente.')
             return redirect('consultation_detail', pk=consultation.pk)
     else:
-        # Calcular el balance pendiente
-        total_paid = consultation.payments.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        balance = consultation.total_cost - total_paid
-        
+        # Balance pendiente
+        balance = consultation.balance
         form = PaymentForm(initial={'amount': balance if balance > 0 else None})
     
     context = {
@@ -375,7 +543,9 @@ def payment_delete(request, pk):
     consultation = payment.consultation
     
     if request.method == 'POST':
-        payment.delete()
+        with transaction.atomic():
+            payment.delete()
+            consultation.update_payment_totals()
         messages.success(request, 'Pago eliminado exitosamente.')
         return redirect('consultation_detail', pk=consultation.pk)
     
@@ -459,43 +629,40 @@ def procedure_delete(request, pk):
 
 @login_required
 def appointment_calendar(request):
-    """Vista de calendario semanal de citas."""
-    from datetime import datetime, timedelta
-    
+    """
+    Vista de calendario semanal de citas.
+    Parámetros: week (semanas respecto a la actual), slot (minutos por franja: 15, 30 o 60).
+    """
+    from datetime import timedelta
+
     # Obtener la semana actual o la semana especificada
-    week_offset = int(request.GET.get('week', 0))
-    today = datetime.now().date()
-    
+    try:
+        week_offset = int(request.GET.get('week', 0))
+    except ValueError:
+        week_offset = 0
+    slot = agenda.slot_minutes(request.GET.get('slot'))
+    today = timezone.localdate()
+
     # Calcular el inicio de la semana (lunes)
     start_of_week = today - timedelta(days=today.weekday()) + timedelta(weeks=week_offset)
     end_of_week = start_of_week + timedelta(days=6)
-    
-    # Obtener citas de la semana
-    appointments = Appointment.objects.filter(
-        date__gte=start_of_week,
-        date__lte=end_of_week,
-        user=request.user
-    ).select_related('patient').order_by('date', 'start_time')
-    
-    # Generar los 7 días de la semana
-    week_days = []
-    for i in range(7):
-        day = start_of_week + timedelta(days=i)
-        day_appointments = appointments.filter(date=day)
-        week_days.append({
-            'date': day,
-            'appointments': day_appointments,
-            'is_today': day == today
-        })
-    
-    # Horarios de trabajo (8:00 AM - 6:00 PM)
-    work_hours = []
-    for hour in range(8, 18):
-        work_hours.append(f"{hour:02d}:00")
-    
+
+    # Una sola consulta; las citas se reparten por franja y día en una pasada
+    rows = agenda.build_grid(
+        agenda.week_appointments(request.user, start_of_week),
+        start_of_week,
+        slot=slot,
+    )
+    week_days = [
+        {'date': cell.date, 'is_today': cell.date == today}
+        for cell in rows[0].cells
+    ]
+
     context = {
         'week_days': week_days,
-        'work_hours': work_hours,
+        'rows': rows,
+        'slot': slot,
+        'slot_choices': agenda.SLOT_CHOICES,
         'start_of_week': start_of_week,
         'end_of_week': end_of_week,
         'week_offset': week_offset,
@@ -505,15 +672,117 @@ def appointment_calendar(request):
     return render(request, 'management/appointment_calendar.html', context)
 
 
+@login_required
+def appointment_feed(request):
+    """
+    Citas de varios odontólogos en JSON para la agenda.
+    Parámetros: view (day/week/month) y date (AAAA-MM-DD, por defecto hoy), o
+    start y end; dentist (uno o varios ids, separados por comas; por defecto
+    todos). Responde 304 si el rango no cambió (ETag).
+    """
+    from datetime import date
+
+    try:
+        anchor = date.fromisoformat(request.GET['date']) if request.GET.get('date') else timezone.localdate()
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+        start, end = agenda.feed_range(request.GET.get('view', 'week'), anchor, start, end)
+        dentist_ids = [
+            int(value) for param in request.GET.getlist('dentist') for value in param.split(',') if value
+        ]
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    users = User.objects.filter(pk__in=dentist_ids).order_by('username') if dentist_ids else scheduling.dentists()
+    dentists = list(users.values_list('pk', 'username'))
+    dentist_ids = [pk for pk, _ in dentists]
+    queryset = agenda.feed_appointments(dentist_ids, start, end)
+    series = recurrence.active_series(start, end, dentist_ids)
+
+    # Consultas agregadas deciden si hace falta leer y serializar las citas
+    etag = quote_etag(agenda.feed_version(queryset, series, start, end, dentists))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(agenda.feed_payload(queryset, series, dentists, start, end))
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+def appointment_free_slots(request):
+    """
+    Primeros horarios libres en JSON.
+    Parámetros: duration (minutos), dentist (opcional, por defecto toda la clínica),
+    start y end (AAAA-MM-DD; por defecto las próximas dos semanas), limit.
+    """
+    from datetime import date, timedelta
+
+    try:
+        duration = int(request.GET['duration'])
+        dentist = request.GET.get('dentist')
+        dentist_ids = [int(dentist)] if dentist else None
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else timezone.localdate()
+        end = (
+            date.fromisoformat(request.GET['end']) if request.GET.get('end')
+            else start + timedelta(days=scheduling.DEFAULT_SEARCH_DAYS - 1)
+        )
+        limit = int(request.GET.get('limit', scheduling.DEFAULT_SLOTS))
+        slots = scheduling.free_slots(duration, start, end, dentist_ids=dentist_ids, limit=limit)
+    except KeyError:
+        return JsonResponse({'error': 'Falta el parámetro duration (minutos)'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'slots': slots})
+
+
+@login_required
+def appointment_occupancy(request):
+    """
+    Ocupación del horario de atención por odontólogo y día en JSON, a partir
+    de los mapas de ocupación. Parámetros: start y end (AAAA-MM-DD; por
+    defecto la semana actual) y dentist (opcional, por defecto toda la clínica).
+    """
+    from datetime import date, timedelta
+
+    today = timezone.localdate()
+    try:
+        start = (date.fromisoformat(request.GET['start']) if request.GET.get('start')
+                 else today - timedelta(days=today.weekday()))
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else start + timedelta(days=6)
+        dentist = int(request.GET['dentist']) if request.GET.get('dentist') else None
+        if end < start or (end - start).days >= scheduling.MAX_SEARCH_DAYS:
+            raise ValueError(f'Rango de fechas inválido (máximo {scheduling.MAX_SEARCH_DAYS} días).')
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    dentists = User.objects.filter(pk=dentist) if dentist else scheduling.dentists()
+    names = dict(dentists.values_list('pk', 'username'))
+    usage = occupancy.utilisation(list(names), start, end)
+    return JsonResponse({
+        'start': start,
+        'end': end,
+        'slot_minutes': occupancy.SLOT,
+        'dentists': [
+            {'id': pk, 'username': username, **usage[pk]}
+            for pk, username in names.items()
+        ],
+    })
+
+
 @login_required
 def appointment_create(request):
     """Crear una nueva cita."""
     if request.method == 'POST':
-        form = AppointmentForm(request.POST)
-        if form.is_valid():
-            appointment = form.save(commit=False)
-            appointment.user = request.user
-            appointment.save()
+        form = AppointmentForm(request.POST, user=request.user)
+        # Validación (con bloqueo del odontólogo) y guardado en la misma transacción
+        with transaction.atomic():
+            saved = form.is_valid()
+            if saved:
+                appointment = form.save(commit=False)
+                appointment.user = request.user
+                appointment.save()
+        if saved:
             messages.success(request, f'Cita agendada para {appointment.patient} el {appointment.date}.')
             return redirect('appointment_calendar')
     else:
@@ -525,12 +794,85 @@ def appointment_create(request):
             initial_data['date'] = initial_date
         if initial_time:
             initial_data['start_time'] = initial_time
-        form = AppointmentForm(initial=initial_data)
+        form = AppointmentForm(initial=initial_data, user=request.user)
     
     context = {'form': form}
     return render(request, 'management/appointment_form.html', context)
 
 
+@login_required
+def appointment_series_create(request):
+    """Crear una serie de citas periódicas (sus fechas se calculan al mostrarlas)."""
+    if request.method == 'POST':
+        form = AppointmentSeriesForm(request.POST, user=request.user)
+        with transaction.atomic():
+            saved = form.is_valid()
+            if saved:
+                series = form.save(commit=False)
+                series.user = request.user
+                series.save()
+        if saved:
+            messages.success(request, f'Serie de citas creada para {series.patient} desde el {series.start_date}.')
+            return redirect('appointment_calendar')
+    else:
+        initial_data = {}
+        if request.GET.get('date'):
+            initial_data['start_date'] = request.GET['date']
+        if request.GET.get('time'):
+            initial_data['start_time'] = request.GET['time']
+        form = AppointmentSeriesForm(initial=initial_data, user=request.user)
+
+    return render(request, 'management/appointment_series_form.html', {'form': form})
+
+
+@login_required
+def appointment_occurrence(request, series_pk, day):
+    """
+    Cita de una serie que todavía no tiene fila propia. Confirmarla, marcarla
+    como atendida, cancelarla o guardar cambios (?action=edit) la guarda como
+    Appointment; abrir el formulario de edición no escribe nada.
+    """
+    from datetime import date
+
+    series = get_object_or_404(AppointmentSeries.objects.select_related('patient', 'user'), pk=series_pk)
+    try:
+        day = date.fromisoformat(day)
+    except ValueError:
+        raise Http404('Fecha no válida.')
+    saved = Appointment.objects.filter(series=series, occurrence_date=day).first()
+    if saved:
+        return redirect('appointment_detail', pk=saved.pk)
+    if not recurrence.is_occurrence(series, day):
+        raise Http404('La serie no tiene cita en esa fecha.')
+
+    if request.GET.get('action') == 'edit':
+        appointment = recurrence.occurrence(series, day)
+        if request.method == 'POST':
+            form = AppointmentForm(request.POST, instance=appointment)
+            with transaction.atomic():
+                saved = form.is_valid()
+                if saved:
+                    recurrence.materialize(series, day, **form.cleaned_data)
+            if saved:
+                messages.success(request, 'Cita actualizada exitosamente.')
+                return redirect('appointment_calendar')
+        else:
+            form = AppointmentForm(instance=appointment)
+        context = {'form': form, 'appointment': appointment}
+        return render(request, 'management/appointment_form.html', context)
+
+    if request.method == 'POST':
+        statuses = {'confirm': 'C', 'attend': 'A', 'cancel': 'X'}
+        action = request.POST.get('action')
+        if action in statuses:
+            appointment = recurrence.materialize(series, day, status=statuses[action])
+            messages.success(request, f'Cita del {day:%d/%m/%Y}: {appointment.get_status_display()}.')
+            return redirect('appointment_detail', pk=appointment.pk)
+
+    context = {'appointment': recurrence.occurrence(series, day)}
+    return render(request, 'management/appointment_detail.html', context)
+
+
 @login_required
 def appointment_edit(request, pk):
     """Editar una cita existente."""
@@ -538,8 +880,11 @@ def appointment_edit(request, pk):
     
     if request.method == 'POST':
         form = AppointmentForm(request.POST, instance=appointment)
-        if form.is_valid():
-            form.save()
+        with transaction.atomic():
+            saved = form.is_valid()
+            if saved:
+                form.save()
+        if saved:
             messages.success(request, 'Cita actualizada exitosamente.')
             return redirect('appointment_calendar')
     else: